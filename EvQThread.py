@@ -27,7 +27,101 @@
 ###############################################################################
 
 from BaseThread import *
-from queue import SimpleQueue
+import collections
+import threading
+
+# Overflow policies of a bounded event queue
+QUEUE_BLOCK = 0 # Wait for space
+QUEUE_DROP_OLDEST = 1 # Discard the oldest queued event
+QUEUE_DROP_NEWEST = 2 # Discard the event being put
+QUEUE_COALESCE = 3 # Merge with the newest queued event, or wait for space if they cannot be merged
+
+###############################################################################
+# Class : cEventQueue
+#
+# Event queue, optionally bounded, with depth telemetry
+###############################################################################
+
+class cEventQueue():
+    '''
+    Event queue with the same put(), get() and empty() methods as
+    queue.SimpleQueue. If iMaxSize is greater than 0, the queue holds at
+    most iMaxSize events and iPolicy says what happens when it is full.
+    For QUEUE_COALESCE, fnCoalesce(oLast, oNew) returns the event to put in
+    place of the newest queued event oLast, or None if the two cannot be
+    merged. The high-water mark and counts of dropped, coalesced and
+    blocked puts are kept for telemetry.
+    '''
+
+    # Constructor
+    def __init__(self, iMaxSize=0, iPolicy=QUEUE_BLOCK, fnCoalesce=None):
+        self.iMaxSize = iMaxSize
+        self.iPolicy = iPolicy
+        self.fnCoalesce = fnCoalesce
+        self.aEvents = collections.deque()
+        self.oLock = threading.Lock()
+        self.oNotEmpty = threading.Condition(self.oLock)
+        self.oNotFull = threading.Condition(self.oLock)
+        # Telemetry
+        self.iPut = 0 # Events put, including those dropped or coalesced
+        self.iHighWater = 0
+        self.iDropped = 0
+        self.iCoalesced = 0
+        self.iBlocked = 0 # Puts which had to wait for space
+
+    def put(self, event, bForce=False):
+        '''
+        Put an event. bForce puts the event even if the queue is full,
+        e.g. to unblock the thread when stopping it.
+        '''
+        with self.oLock:
+            self.iPut += 1
+            if self.iMaxSize > 0 and not bForce and len(self.aEvents) >= self.iMaxSize:
+                if self.iPolicy == QUEUE_DROP_NEWEST:
+                    self.iDropped += 1
+                    return
+                if self.iPolicy == QUEUE_DROP_OLDEST:
+                    self.aEvents.popleft()
+                    self.iDropped += 1
+                elif self.iPolicy == QUEUE_COALESCE and self.aEvents:
+                    oMerged = self.fnCoalesce(self.aEvents[-1], event)
+                    if oMerged is not None:
+                        self.aEvents[-1] = oMerged
+                        self.iCoalesced += 1
+                        return
+                if len(self.aEvents) >= self.iMaxSize:
+                    self.iBlocked += 1
+                    while len(self.aEvents) >= self.iMaxSize:
+                        self.oNotFull.wait()
+            self.aEvents.append(event)
+            self.iHighWater = max(self.iHighWater, len(self.aEvents))
+            self.oNotEmpty.notify()
+
+    def get(self):
+        '''Get the oldest event, waiting for one if the queue is empty.'''
+        with self.oLock:
+            while not self.aEvents:
+                self.oNotEmpty.wait()
+            event = self.aEvents.popleft()
+            self.oNotFull.notify()
+            return event
+
+    def empty(self):
+        return len(self.aEvents) == 0
+
+    def qsize(self):
+        return len(self.aEvents)
+
+    def GetStats(self):
+        return {
+            'iDepth': len(self.aEvents),
+            'iMaxSize': self.iMaxSize,
+            'iPut': self.iPut,
+            'iHighWater': self.iHighWater,
+            'iDropped': self.iDropped,
+            'iCoalesced': self.iCoalesced,
+            'iBlocked': self.iBlocked,
+        }
 
 ###############################################################################
 # Class : cEvQThread
@@ -46,10 +140,10 @@ class cEvQThread(cBaseThread):
     '''
 
     # Constructor
-    def __init__(self):
+    def __init__(self, iMaxSize=0, iPolicy=QUEUE_BLOCK, fnCoalesce=None):
         cBaseThread.__init__(self)
-        # Queue
-        self.oQueue = SimpleQueue()
+        # Queue. Unbounded unless iMaxSize is given.
+        self.oQueue = cEventQueue(iMaxSize, iPolicy, fnCoalesce)
 
     # Methods
     def SendEvent(self, event):
@@ -59,13 +153,19 @@ class cEvQThread(cBaseThread):
         # Put an event to the Queue
         self.oQueue.put(event)
 
+    def GetQueueStats(self):
+        '''
+        Returns the depth, high-water mark and overflow counts of the queue.
+        '''
+        return self.oQueue.GetStats()
+
     # Overridden Virtual methods
     def StopUnblock(self):
         '''
         Unblocks the thread blocking on a queue read.
         '''
-        # Put a dummy event to the Queue to unblock it
-        self.oQueue.put('')
+        # Put a dummy event to the Queue to unblock it, even if it is full
+        self.oQueue.put('', True)
 
     # Overridden Virtual methods
     def Stop(self):
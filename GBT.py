@@ -28,9 +28,13 @@
 
 
 import EvQThread
+import GBTBlockTracker
+import GBTCheckpoint
+import GBTWatchdog
 import Logger
 import threading
 import time
+from typing import NamedTuple
 
 # GBT constants
 GBT_MAX_PAYLOAD = 10 # Keep it small for simulator
@@ -46,9 +50,37 @@ GBT_SVR_BTW = 6  # The number of blocks a server can receive in one window
 aCltDropMsgs = []
 aSvrDropMsgs = [0]
 
+# Optional loss models (see GBTLoss.py) applied in addition to the lists above.
+# None = no additional loss.
+oCltLoss = None
+oSvrLoss = None
+
+# Optional shared cache of segmented payloads (see GBTBlockCache.py), so
+# that sessions sending the same payload share its blocks. None = no cache.
+oBlockCache = None
+
+# NON-STANDARD extension, off by default. Optional compression of payloads
+# before they are split into blocks (see GBTCompress.py). Both ends must
+# have the same. None = payloads sent as they are.
+oCompression = None
+
 # Timeouts in seconds for server and client wait for message
 tTimeouts = (5.0, 10.0) # Server, client
 
+# Watchdog limits. A stuck session is aborted when one is reached. 0 = disabled.
+# Only the runaway check is on by default: under bursty loss, sessions which
+# would still complete can go a long time without progress.
+GBT_WDG_STALL_ROUNDS = 0 # Round trips without progress, e.g. 10
+GBT_WDG_REPEAT_WINDOWS = 0 # Identical windows sent in a row, e.g. 8
+GBT_WDG_TIMEOUTS = 0 # Timer expiries in a row, e.g. 5
+GBT_WDG_RUNAWAY_BLOCKS = 40 # BNs received past the end of the stream
+
+# NON-STANDARD extension, off by default. If True, the receiver reports all
+# the gaps in RQ in one acknowledgement and the sender resends them, followed
+# by new blocks, in one window, instead of recovering one gap per round trip
+# as in the DLMS Green Book. Both sides must enable it.
+GBT_MULTI_GAP = False
+
 # Set self and peer parameters
 GBT_CLT_WSELF = GBT_CLT_BTW
 GBT_SVR_WSELF = GBT_SVR_BTW
@@ -58,16 +90,118 @@ GBT_SVR_WPEER = GBT_CLT_WSELF
 # GBT Thread general events
 EVT_PEER_MSG = 0
 EVT_TIMER_EXPIRY_MSG = 1
+EVT_PEER_ABORT_MSG = 2
+EVT_RESUME_MSG = 4 # data is (checkpoint, payload or None)
+EVT_TRANSFER_TIMEOUT_MSG = 5 # data is the GBTTransfer.cTransfer
 
 # GBT Client thread events
-EVT_CLT_INVOKE_ACC_REQ = 2
+EVT_CLT_INVOKE_ACC_REQ = 3
 
 # GBT Server thread events
-EVT_SVR_INVOKE_ACC_RSP = 2
+EVT_SVR_INVOKE_ACC_RSP = 3
 
+###############################################################################
+# Class : cGBTConfig
+#
+# Immutable per-session GBT configuration
+###############################################################################
 
-# Threshold to allow breakpoint on runaway. Debug only.
-GBT_RUNAWAY_THRESHOLD = 40
+class cGBTConfig(NamedTuple):
+    '''
+    Per-session GBT configuration. Passed to cGBTThread and its subclasses
+    so that sessions with different parameters can run side by side in
+    the same process. It is immutable; use _replace() to derive a
+    variant, e.g. GetDefaultConfig()._replace(CltBTW=16).
+    The defaults are the module level values above.
+    '''
+    MaxPayload: int = GBT_MAX_PAYLOAD
+    CltBTS: int = GBT_CLT_BTS
+    CltBTW: int = GBT_CLT_BTW
+    SvrBTS: int = GBT_SVR_BTS
+    SvrBTW: int = GBT_SVR_BTW
+    aCltDropMsgs: tuple = tuple(aCltDropMsgs)
+    aSvrDropMsgs: tuple = tuple(aSvrDropMsgs)
+    oCltLoss: object = oCltLoss
+    oSvrLoss: object = oSvrLoss
+    tTimeouts: tuple = tTimeouts # Server, client
+    iWdgStallRounds: int = GBT_WDG_STALL_ROUNDS
+    iWdgRepeatWindows: int = GBT_WDG_REPEAT_WINDOWS
+    iWdgTimeouts: int = GBT_WDG_TIMEOUTS
+    iWdgRunawayBlocks: int = GBT_WDG_RUNAWAY_BLOCKS
+    bMultiGap: bool = GBT_MULTI_GAP # NON-STANDARD, see GBT_MULTI_GAP
+    oBlockCache: object = oBlockCache
+    oCompression: object = oCompression # NON-STANDARD, see oCompression
+
+    def GetBTS(self, bIsClient):
+        return (self.SvrBTS, self.CltBTS)[bIsClient]
+
+    def GetBTW(self, bIsClient):
+        return (self.SvrBTW, self.CltBTW)[bIsClient]
+
+    def GetDropMsgs(self, bIsClient):
+        return (self.aSvrDropMsgs, self.aCltDropMsgs)[bIsClient]
+
+    def GetLoss(self, bIsClient):
+        return (self.oSvrLoss, self.oCltLoss)[bIsClient]
+
+    def GetTimeout(self, bIsClient):
+        return self.tTimeouts[bIsClient]
+
+###############################################################################
+# Function : GetDefaultConfig
+#
+# Build a configuration from the current module level values
+###############################################################################
+
+def GetDefaultConfig():
+    '''
+    Build a configuration from the module level values. These are read at
+    call time, so edits to the values at the top of this file still apply
+    to sessions which are not given an explicit configuration.
+    '''
+    return cGBTConfig(MaxPayload=GBT_MAX_PAYLOAD,
+                      CltBTS=GBT_CLT_BTS, CltBTW=GBT_CLT_BTW,
+                      SvrBTS=GBT_SVR_BTS, SvrBTW=GBT_SVR_BTW,
+                      aCltDropMsgs=tuple(aCltDropMsgs), aSvrDropMsgs=tuple(aSvrDropMsgs),
+                      oCltLoss=oCltLoss, oSvrLoss=oSvrLoss,
+                      tTimeouts=tuple(tTimeouts),
+                      iWdgStallRounds=GBT_WDG_STALL_ROUNDS,
+                      iWdgRepeatWindows=GBT_WDG_REPEAT_WINDOWS,
+                      iWdgTimeouts=GBT_WDG_TIMEOUTS,
+                      iWdgRunawayBlocks=GBT_WDG_RUNAWAY_BLOCKS,
+                      bMultiGap=GBT_MULTI_GAP,
+                      oBlockCache=oBlockCache,
+                      oCompression=oCompression)
+
+###############################################################################
+# Function : SegmentPayload
+#
+# Split a payload into blocks
+###############################################################################
+
+def SegmentPayload(data, maxPayload):
+    '''
+    Returns the blocks of data, a dictionary keyed by BN, and the next
+    BN. The blocks are not changed once in SQ, so may be shared.
+    '''
+    dBlocks = {}
+    start = 0
+    length = len(data)
+    bn = 1 # Block number starts at 1
+    while length > maxPayload:
+        dBlocks[bn] = cGBTBlock(0, bn, data[start:start+maxPayload])
+        start += maxPayload
+        length -= maxPayload
+        bn += 1
+    # Check for any residual block
+    if length > 0:
+        # Additional last block
+        dBlocks[bn] = cGBTBlock(1, bn, data[start:start+length])
+        bn += 1
+    else:
+        # Previous block is the last block
+        dBlocks[bn-1].LB = 1
+    return dBlocks, bn
 
 ###############################################################################
 # Class : cEvt
@@ -118,13 +252,16 @@ class cGBTBlock():
 ###############################################################################
 
 class cGBTAPDU():
-    def __init__(self, block: cGBTBlock, STR=None, W=None, BNA=None):
+    def __init__(self, block: cGBTBlock, STR=None, W=None, BNA=None, SR=None):
         self.LB = block.LB
         self.BN = block.BN
         self.BD = block.BD
         self.STR = STR
         self.W = W
         self.BNA = BNA
+        # NON-STANDARD selective recovery (see GBT_MULTI_GAP):
+        # None, or (highest BN in RQ, tuple of BNs missing below it)
+        self.SR = SR
 
 ###############################################################################
 # Class : cGBTThread
@@ -143,26 +280,69 @@ class cGBTThread(EvQThread.cEvQThread):
     '''
 
     # Constructor
-    def __init__(self, BTS, BTW, bIsClient):
+    def __init__(self, oConfig, bIsClient):
         EvQThread.cEvQThread.__init__(self)
-        self.BTS = BTS
-        self.BTW = BTW
+        if oConfig is None:
+            oConfig = GetDefaultConfig()
+        self.oConfig = oConfig
+        self.BTS = oConfig.GetBTS(bIsClient)
+        self.BTW = oConfig.GetBTW(bIsClient)
         self.bIsClient = bIsClient
         self.bGBTProcessing = False
         self.bTimerEnabled = True
         self.oTimer = None
+        self.fnTimer = threading.Timer # Timer factory, replaced when running in simulated time
+        self.fnClock = time.perf_counter # Clock in seconds, replaced when running in simulated time
+        self.oBlockTracker = GBTBlockTracker.cBlockTracker() # Kept until the next session starts
         self.startts = time.time_ns()
+        self.oWatchdog = GBTWatchdog.cGBTWatchdog(oConfig.iWdgStallRounds, oConfig.iWdgRepeatWindows,
+                                                  oConfig.iWdgTimeouts, oConfig.iWdgRunawayBlocks)
+        self.oSegments = None # Blocks acquired from the block cache
         self.ClearVars()
         # GBT state vars will be cleared when peer thread is set.
         self.iSAScnt = 0
         self.iPGAcnt = 0
         self.iCRFcnt = 0
+        # Statistics
+        self.iTxCnt = 0 # GBT APDUs sent
+        self.iRxCnt = 0 # GBT APDUs received
+        self.iDropCnt = 0 # GBT APDUs dropped
+        self.iTimeoutCnt = 0 # Timer expiries
+        # Payload reassembled from RQ when a stream has been received
+        self.rxData = None
+        self.iRxStreams = 0 # Streams received
+        # Transfer awaited by a future, see GBTTransfer
+        self.oTransfer = None
+        # Optional GBTApduStore.cApduStore, to which the APDUs received are added
+        self.oApduStore = None
+        # Payload being sent, referenced by checkpoints
+        self.txData = None
+        # Checkpoint taken when the session was aborted, for ResumeGBT()
+        self.oCheckpoint = None
+        # Set when GBT processing stops, i.e. a stream has been sent or received
+        self.oDoneEvent = threading.Event()
+        # Reason and state snapshot if the session was aborted
+        self.sAbortReason = None
+        self.sAbortSnapshot = None
 
     def ClearVars(self):
         self.oGBTStateVars = cGBTStateVars(self.BTS, self.BTW) # BTS, BTW
         self.msgCount = 0 # Used to selectively deny messages to simulate loss
         self.dSQ = {} # Use dictionary keyed by BN
         self.dRQ = {} # Use dictionary keyed by BN
+        if self.oSegments is not None:
+            self.oConfig.oBlockCache.Release(self.oSegments)
+            self.oSegments = None
+        self.oWatchdog.Reset()
+        # Progress through the payload, for the watchdog: blocks with
+        # payload acknowledged by the peer and received from it, and the BN
+        # of the peer's last block once received
+        self.iAckedBlocks = 0
+        self.iRxBlocks = 0
+        self.bnPeerLast = None
+        # NON-STANDARD selective recovery to send and as received from the peer
+        self.tSR = None
+        self.tPeerSR = None
     
     def SetPeerThread(self, oPeerThread):
         self.oPeerThread = oPeerThread
@@ -175,8 +355,48 @@ class cGBTThread(EvQThread.cEvQThread):
         # 'A priori' setting of Wpeer
         self.oGBTStateVars.Wpeer = self.oPeerThread.oGBTStateVars.Wself
         # Start processing
+        self.oBlockTracker.Reset()
+        self.oDoneEvent.clear()
+        self.sAbortReason = None
+        self.sAbortSnapshot = None
+        self.txData = None
+        self.oCheckpoint = None
         self.bGBTProcessing = True
 
+    def ResumeGBT(self, oCheckpoint, data=None):
+        '''
+        Resume a session from a checkpoint taken by GetCheckpoint().
+        The sender passes the payload, which must be the one checkpointed,
+        and carries on from the first block not acknowledged. The receiver
+        passes no payload and keeps the blocks already in RQ. Not part of
+        the DLMS Green Book: both sides must resume from their checkpoints
+        of the same session, the receiver first.
+        '''
+        if oCheckpoint.MaxPayload != self.oConfig.MaxPayload:
+            raise ValueError("Checkpoint block size %d, session block size %d" %
+                             (oCheckpoint.MaxPayload, self.oConfig.MaxPayload))
+        if (data is not None) and \
+           (GBTCheckpoint.GetPayloadRef(data) != (oCheckpoint.iPayloadLen, oCheckpoint.bDigest)):
+            raise ValueError("Checkpoint is for a different payload")
+        self.StartGBT()
+        if data is not None:
+            self.FillSQ(data)
+            # Blocks up to BNApeer have been acknowledged
+            for bn in [bn for bn in self.dSQ if bn <= oCheckpoint.BNApeer]:
+                del self.dSQ[bn]
+        sv = self.oGBTStateVars
+        sv.BNAself, sv.BNApeer, sv.NextBN = oCheckpoint.BNAself, oCheckpoint.BNApeer, oCheckpoint.NextBN
+        sv.STRself, sv.STRpeer = oCheckpoint.STRself, oCheckpoint.STRpeer
+        sv.Wself, sv.Wpeer = oCheckpoint.Wself, oCheckpoint.Wpeer
+        for bn, LB, BD in oCheckpoint.aRQ:
+            self.dRQ[bn] = cGBTBlock(LB, bn, BD)
+        self.DiagnosticMsg("Resuming %s" % self.GetStateSnapshot())
+        if data is not None:
+            self.SendGBTAPDUStream()
+        else:
+            # Awaiting the sender
+            self.StartTimer()
+
     def StopGBT(self):
         # Belt 'n' braces reset of variables
         self.ClearVars()
@@ -184,12 +404,13 @@ class cGBTThread(EvQThread.cEvQThread):
         self.oGBTStateVars.Wpeer = self.oPeerThread.oGBTStateVars.Wself
         # Stop processing
         self.bGBTProcessing = False
+        self.oDoneEvent.set()
 
     def StartTimer(self):
         '''Start a timer.'''
         if self.bTimerEnabled and self.oTimer is None:
             #print("%s starting timer, duration %f" % (self.GetNameStr(), timeout))
-            self.oTimer = threading.Timer(tTimeouts[self.bIsClient], self.HandleTimerExpiry)
+            self.oTimer = self.fnTimer(self.oConfig.GetTimeout(self.bIsClient), self.HandleTimerExpiry)
             self.oTimer.start()
 
     def StopTimer(self):
@@ -204,19 +425,160 @@ class cGBTThread(EvQThread.cEvQThread):
         #print("%s timer expiry" % self.GetNameStr())
         self.SendEvent(cEvt(EVT_TIMER_EXPIRY_MSG))
 
+    def TimerExpired(self):
+        '''
+        Called in thread context when the timer expiry event is handled.
+        The expired timer is released so that it can be restarted,
+        otherwise a second loss in a row would never be recovered.
+        '''
+        self.oTimer = None
+        self.iTimeoutCnt += 1
+        if self.bGBTProcessing:
+            self.oWatchdog.Timeout()
+
+    def GetCheckpoint(self):
+        '''Checkpoint of the session state, from which ResumeGBT() carries on.'''
+        sv = self.oGBTStateVars
+        iPayloadLen, bDigest = GBTCheckpoint.GetPayloadRef(self.txData)
+        return GBTCheckpoint.cGBTCheckpoint(self.bIsClient, self.oConfig.MaxPayload, iPayloadLen, bDigest,
+                                            sv.BNAself, sv.BNApeer, sv.NextBN, sv.STRself, sv.STRpeer,
+                                            sv.Wself, sv.Wpeer,
+                                            tuple((bn, blk.LB, blk.BD) for bn, blk in sorted(self.dRQ.items())))
+
+    def GetStateSnapshot(self):
+        '''Compact one line snapshot of the session state for diagnostics.'''
+        sv = self.oGBTStateVars
+        return "BNAself=%d STRself=%d Wself=%d BNApeer=%d STRpeer=%d Wpeer=%d NextBN=%d SQ=[%s] RQ=[%s] tx=%d rx=%d drop=%d timeouts=%d" % \
+               (sv.BNAself, sv.STRself, sv.Wself, sv.BNApeer, sv.STRpeer, sv.Wpeer, sv.NextBN,
+                GBTWatchdog.FormatBNs(self.dSQ.keys()), GBTWatchdog.FormatBNs(self.dRQ.keys()),
+                self.iTxCnt, self.iRxCnt, self.iDropCnt, self.iTimeoutCnt)
+
+    def CheckWatchdog(self):
+        '''
+        Abort the session if the watchdog has found it to be stuck.
+        Called once an event has been completely handled, so that the
+        GBT procedures are never torn down part way through.
+        '''
+        if self.bGBTProcessing and (self.oWatchdog.sReason is not None):
+            self.AbortGBT("Watchdog: " + self.oWatchdog.sReason)
+
+    def AbortGBT(self, sReason):
+        '''
+        Abort the session: record and print a state snapshot, tell the peer
+        and free the session resources (timer, SQ and RQ).
+        '''
+        sSnapshot = self.GetStateSnapshot()
+        self.DiagnosticMsg("ABORT (%s) %s" % (sReason, sSnapshot))
+        # The abort is not subject to simulated loss
+        self.oPeerThread.SendEvent(cEvt(EVT_PEER_ABORT_MSG, sReason))
+        self.StopTimer()
+        oCheckpoint = self.GetCheckpoint()
+        self.StopGBT()
+        self.oCheckpoint = oCheckpoint
+        self.sAbortReason = sReason
+        self.sAbortSnapshot = sSnapshot
+
+    def HandlePeerAbort(self, sReason):
+        '''Handle an abort from the peer.'''
+        if self.bGBTProcessing:
+            sSnapshot = self.GetStateSnapshot()
+            self.DiagnosticMsg("Peer ABORT (%s) %s" % (sReason, sSnapshot))
+            self.StopTimer()
+            oCheckpoint = self.GetCheckpoint()
+            self.StopGBT()
+            self.oCheckpoint = oCheckpoint
+            self.sAbortReason = "Peer: " + sReason
+            self.sAbortSnapshot = sSnapshot
+
+    def StartTransfer(self, oTransfer):
+        '''
+        Track oTransfer (a GBTTransfer.cTransfer) until it ends. Called
+        when it is invoked, before the stream is started. Returns False if
+        its future has been cancelled, in which case it is not invoked.
+        '''
+        if self.oTransfer is not None:
+            oLast, self.oTransfer = self.oTransfer, None
+            oLast.Fail(oLast.Aborted("Superseded by a new transfer"))
+        if not oTransfer.Start(self):
+            return False
+        self.oTransfer = oTransfer
+        return True
+
+    def CheckTransfer(self):
+        '''
+        Resolve the future of the transfer if it has ended. Called once an
+        event has been completely handled, after CheckWatchdog().
+        '''
+        oTransfer = self.oTransfer
+        if (oTransfer is not None) and oTransfer.IsEnded():
+            # Cleared first, as the done callbacks may start the next transfer
+            self.oTransfer = None
+            oTransfer.End()
+
+    def TransferTimeout(self, oTransfer):
+        '''Handle the timeout of a transfer: abort the session and fail the future.'''
+        if oTransfer is not self.oTransfer:
+            # Ended in the meantime
+            return
+        if self.bGBTProcessing:
+            self.AbortGBT("Transfer timeout")
+        self.oTransfer = None
+        oTransfer.Fail(TimeoutError("Transfer timeout after %.1f s" % oTransfer.fTimeout))
+
+    def IsMsgDropped(self):
+        '''Check whether the current message is to be dropped to simulate loss.'''
+        if self.msgCount in self.oConfig.GetDropMsgs(self.bIsClient):
+            return True
+        oLoss = self.oConfig.GetLoss(self.bIsClient)
+        return (oLoss is not None) and oLoss.IsDropped(self.msgCount)
+
+    def IsTxPending(self):
+        '''
+        Whether more blocks of the stream being sent are still to be added
+        to SQ, e.g. by a relay forwarding blocks as they arrive. If so, an
+        empty SQ does not mean the stream has been sent.
+        '''
+        return False
+
+    def GetRxData(self):
+        '''Reassemble the payload from the blocks in RQ.'''
+        aBD = [self.dRQ[bn].BD for bn in sorted(self.dRQ.keys()) if self.dRQ[bn].BD is not None]
+        if len(aBD) == 0:
+            return None
+        # Works for both str and bytes payloads
+        return aBD[0][:0].join(aBD)
+
+    def EncodePayload(self, data):
+        '''The payload as carried by the stream, compressed if configured (NON-STANDARD).'''
+        if self.oConfig.oCompression is None:
+            return data
+        return self.oConfig.oCompression.Encode(data)
+
+    def DecodePayload(self, data):
+        '''The payload from the stream received, see EncodePayload().'''
+        if (self.oConfig.oCompression is None) or (data is None):
+            return data
+        return self.oConfig.oCompression.Decode(data)
+
     def GetNameStr(self):
         return ("Server", "Client")[self.bIsClient]
 
     def GetApduStr(self, apdu:cGBTAPDU, bDropped:bool):
         ts = time.time_ns() - self.startts
-        if apdu.BN > GBT_RUNAWAY_THRESHOLD:
-            print("%s runaway!!!!!" % self.GetNameStr())
         msgtype = ('>','x')[bDropped]
         sDir = ("CLT -%c SVR" % msgtype, "SVR -%c CLT" % msgtype)[self.bIsClient] 
-        return "%s: %s LB=%d, STR=%d, W=%d, BN=%d, BNA=%d, BD=%s" % (sDir, ts, apdu.LB, apdu.STR, apdu.W, apdu.BN, apdu.BNA, apdu.BD) 
+        return "%s: %s %s" % (sDir, ts, self.GetSimpleApduStr(apdu))
+
+    def StoreApdu(self, apdu:cGBTAPDU, bDropped:bool):
+        '''Add the APDU received to the APDU store, if there is one.'''
+        if self.oApduStore is not None:
+            self.oApduStore.Add(self.fnClock(), self.bIsClient, apdu, bDropped)
 
     def GetSimpleApduStr(self, apdu:cGBTAPDU):
-        return "LB=%d, STR=%d, W=%d, BN=%d, BNA=%d, BD=%s" % (apdu.LB, apdu.STR, apdu.W, apdu.BN, apdu.BNA, apdu.BD) 
+        sApdu = "LB=%d, STR=%d, W=%d, BN=%d, BNA=%d, BD=%s" % (apdu.LB, apdu.STR, apdu.W, apdu.BN, apdu.BNA, apdu.BD)
+        if apdu.SR is not None:
+            sApdu += ", SR=%d/%s" % (apdu.SR[0], GBTWatchdog.FormatBNs(apdu.SR[1]))
+        return sApdu
 
     def DiagnosticMsg(self, sMsg):
         self.oLoggerThread.PostLog(Logger.LOG_CONSOLE_PRINT, "%s: %s" % (self.GetNameStr(), sMsg))
@@ -238,23 +600,18 @@ class cGBTThread(EvQThread.cEvQThread):
         Fill blocks to Send Queue SQ.
         This is not an explicit sub-procedure but is shown
         on the flowchart in DLMS Green Book Ed. 11 V1.0 Figure 140
+        If the configuration has a block cache, the blocks are shared
+        with other sessions sending the same payload, and the cache
+        compresses it if configured, once for all of them.
         '''
-        start = 0
-        length = len(data)
-        bn = 1 # Block number starts at 1
-        while length > GBT_MAX_PAYLOAD:
-            self.dSQ[bn] = cGBTBlock(0, bn, data[start:start+GBT_MAX_PAYLOAD])
-            start += GBT_MAX_PAYLOAD
-            length -= GBT_MAX_PAYLOAD
-            bn += 1
-        # Check for any residual block
-        if length > 0:
-            # Additional last block
-            self.dSQ[bn] = cGBTBlock(1, bn, data[start:start+length])
-            bn += 1
+        self.txData = data
+        oBlockCache = self.oConfig.oBlockCache
+        if oBlockCache is not None:
+            self.oSegments = oBlockCache.Acquire(data, self.oConfig.MaxPayload, self.oConfig.oCompression)
+            dBlocks, bn = self.oSegments.dBlocks, self.oSegments.NextBN
         else:
-            # Previous block is the last block
-            self.dSQ[bn-1].LB = 1
+            dBlocks, bn = SegmentPayload(self.EncodePayload(data), self.oConfig.MaxPayload)
+        self.dSQ.update(dBlocks)
         # Set next block number
         self.oGBTStateVars.NextBN = bn
 
@@ -293,6 +650,15 @@ class cGBTThread(EvQThread.cEvQThread):
         # Note: The blocks are not removed from SQ until acknowledged.
         WpeerBlkcount = 0 # Use counter to ensure no more than Wpeer blocks sent in a window
         bnsSQ = sorted(self.dSQ.keys()) # Should already be in order but just in case
+        # NON-STANDARD: send only the blocks the peer is missing, then blocks it has not been sent
+        if self.oConfig.bMultiGap and (self.tPeerSR is not None):
+            bnHigh, bnsMissing = self.tPeerSR
+            bnsMissing = set(bnsMissing)
+            bnsSelected = [bn for bn in bnsSQ if (bn in bnsMissing) or (bn > bnHigh)]
+            if len(bnsSelected) > 0:
+                self.SASDiagMsg("Selective recovery of %s" % GBTWatchdog.FormatBNs(bnsMissing))
+                bnsSQ = bnsSelected
+        bnsSent = [] # For the watchdog
         for bn in bnsSQ:
             # "Send each block B of S with a GBT APDU Gs such that
             # Gs.LB = B.LB, Gs.STR = STRself, Gs.W = Wself
@@ -318,11 +684,16 @@ class cGBTThread(EvQThread.cEvQThread):
             # Note: These MUST have been set correctly prior to invoking this method
             Gs.W = self.oGBTStateVars.Wself
             Gs.BNA = self.oGBTStateVars.BNAself
+            Gs.SR = self.tSR
 
             self.SASDiagMsg("Sending APDU %s" % self.GetSimpleApduStr(Gs))
 
             # Send GBT APDU
             self.oPeerThread.SendEvent(cEvt(EVT_PEER_MSG, Gs))
+            self.iTxCnt += 1
+            bnsSent.append(bn)
+            if Gs.BD is not None:
+                self.oBlockTracker.Sent(bn, self.fnClock())
 
             # Increment block count
             WpeerBlkcount += 1
@@ -336,6 +707,9 @@ class cGBTThread(EvQThread.cEvQThread):
                 # Stop sending blocks from the SQ.
                 break
 
+        # Check for the same window being sent over and over
+        self.oWatchdog.WindowSent((tuple(bnsSent), self.oGBTStateVars.Wself))
+
         # Increment invocation count
         self.iSAScnt += 1
 
@@ -349,6 +723,7 @@ class cGBTThread(EvQThread.cEvQThread):
             return
 
         self.PGADiagMsg("Process GBT APDU")
+        self.oWatchdog.ApduReceived()
 
         #if not self.bIsClient and Gr.BN == 6:
         #    print("Trap1") 
@@ -391,6 +766,18 @@ class cGBTThread(EvQThread.cEvQThread):
                 self.PGADiagMsg("Adding to RQ")
                 # "Put B in RQ with B.LB = Gr.LB, B.BN = Gr.BN, B.BD = Gr.BD"
                 self.dRQ[Gr.BN] = cGBTBlock(Gr.LB, Gr.BN, Gr.BD)
+                if Gr.BD is not None:
+                    self.iRxBlocks += 1
+                    if Gr.LB == 1:
+                        self.bnPeerLast = Gr.BN
+
+        # Check the peer's BN has not run away past the end of its stream
+        self.oWatchdog.BlockReceived(Gr.BN, self.GetPeerEndBN(Gr))
+
+        # NON-STANDARD: gaps reported by the peer, if any. Ignored if BNApeer
+        # goes backwards, as the peer has then started a new stream.
+        if self.oConfig.bMultiGap:
+            self.tPeerSR = Gr.SR if Gr.BNA >= self.oGBTStateVars.BNApeer else None
 
         # "Wpeer = Gr.W, BNApeer = Gr.BNA"
         self.oGBTStateVars.Wpeer = Gr.W # Overrides a priori default
@@ -404,10 +791,15 @@ class cGBTThread(EvQThread.cEvQThread):
 
         # Remove all sent items up to and including BNApeer from SQ
         prevBlk = None
+        fNow = self.fnClock() # Blocks acknowledged together have the same time
         for bn in bnsSQ:
             if bn <= self.oGBTStateVars.BNApeer:
                 self.PGADiagMsg("Removing block %d from SQ" % bn)
                 prevBlk = self.dSQ.pop(bn)
+                if prevBlk.BD is not None:
+                    self.iAckedBlocks += 1
+                # Block acknowledged
+                self.oBlockTracker.Acked(bn, fNow)
             else:
                 break # Gone through all the low blocks
 
@@ -431,12 +823,16 @@ class cGBTThread(EvQThread.cEvQThread):
                 bWindowFinished = True
 
         # Somehow we need to determine when a sequence has actually been sent
-        if (len(self.dSQ) == 0) and (prevBlk is not None) and (prevBlk.BD is not None):
+        if (len(self.dSQ) == 0) and (prevBlk is not None) and (prevBlk.BD is not None) and \
+           not self.IsTxPending():
             # Last block with payload has been removed from SQ
             self.PGADiagMsg("Finished sending stream")
             self.StopTimer()
             self.StopGBT()
         elif bWindowFinished:
+            # A round trip has completed, check the payload has moved on.
+            # BNs alone are no measure: blocks without payload get new ones.
+            self.oWatchdog.RoundTrip((self.iAckedBlocks, self.iRxBlocks))
             # "Confirmed stream finished. Return RQ"
             # In this case it means checking the RQ
             self.CheckRQandFillGaps()
@@ -444,6 +840,20 @@ class cGBTThread(EvQThread.cEvQThread):
         # Increment invocation count
         self.iPGAcnt += 1
 
+    def GetPeerEndBN(self, Gr:cGBTAPDU):
+        '''
+        The highest BN the peer should send in this stream, for the
+        watchdog, or None if not known. Blocks with payload end at the
+        peer's last block. Blocks without payload acknowledge the stream we
+        send, at most once per round trip, so about twice per block sent
+        even under heavy loss.
+        '''
+        if Gr.BD is not None:
+            return self.bnPeerLast
+        if self.txData is not None:
+            return 2 * (self.oGBTStateVars.NextBN - 1)
+        return None
+
     def CheckRQandFillGaps(self):
         '''
         Check RQ and fill gaps sub-procedure.
@@ -460,6 +870,7 @@ class cGBTThread(EvQThread.cEvQThread):
 
         # Get sorted list of block numbers in RQ
         bnsRQ = sorted(self.dRQ.keys()) # Should already be in order but just in case
+        self.tSR = None
 
         # "RQ empty?"
         if len(bnsRQ) == 0:
@@ -492,8 +903,17 @@ class cGBTThread(EvQThread.cEvQThread):
                 # TODO: Note: cannot be larger than window
                 #self.oGBTStateVars.BNAself = bnCheck + 1
                 self.oGBTStateVars.BNAself = bnCheck
-                self.oGBTStateVars.Wself = gapSize - 1            
-                self.CRFDiagMsg("Gap, BNAself %d, Wself %d" % (self.oGBTStateVars.BNAself, self.oGBTStateVars.Wself))
+                if self.oConfig.bMultiGap and (self.dRQ[bnsRQ[-1]].BD is not None):
+                    # NON-STANDARD: report every gap up to the highest block in RQ,
+                    # and open a full window for the missing blocks and new ones
+                    self.tSR = (bnsRQ[-1], tuple(bnMissing for bnMissing in range(bnCheck + 1, bnsRQ[-1])
+                                                 if bnMissing not in self.dRQ))
+                    self.oGBTStateVars.Wself = self.BTW
+                    self.CRFDiagMsg("Gaps %s, BNAself %d, Wself %d" % (GBTWatchdog.FormatBNs(self.tSR[1]),
+                                                                      self.oGBTStateVars.BNAself, self.oGBTStateVars.Wself))
+                else:
+                    self.oGBTStateVars.Wself = gapSize - 1            
+                    self.CRFDiagMsg("Gap, BNAself %d, Wself %d" % (self.oGBTStateVars.BNAself, self.oGBTStateVars.Wself))
             else:
                 self.oGBTStateVars.BNAself = bn
                 self.oGBTStateVars.Wself = self.BTW            
@@ -510,6 +930,8 @@ class cGBTThread(EvQThread.cEvQThread):
                     # Invoke indication/confirm?
                     # Stop processing
                     self.CRFDiagMsg("Finished receiving stream")
+                    self.rxData = self.DecodePayload(self.GetRxData())
+                    self.iRxStreams += 1
                     self.StopTimer()
                     self.StopGBT()
                 else:
@@ -0,0 +1,286 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Compact store of the GBT APDUs of a run
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# A GBT thread with a store (oApduStore) adds a record of each GBT APDU it
+# receives, dropped or not. Records are held field by field in arrays, about
+# 23 bytes each, rather than as objects or lines of text, so that a run of
+# millions of APDUs can be kept and shown. Records are only ever added, and
+# a record is visible once all its fields are, so the store may be read from
+# one thread (e.g. the GUI) while the GBT threads add to it.
+#
+# cApduView is a filtered view of a store, by direction, dropped APDUs or a
+# range of BNs, holding the indexes of the records which match. Update()
+# filters the records added since the last call, a bounded number at a time,
+# so that a view of millions of records can be built up from a GUI timer
+# without blocking it. The GUI shows a view in a virtual list, which asks
+# for the text of the rows on screen only.
+
+import argparse
+import array
+import threading
+import time
+
+# Flags of a record
+AS_FROM_SERVER = 0x01 # Else from client
+AS_DROPPED = 0x02
+AS_LB = 0x04
+AS_STR = 0x08
+AS_SR = 0x10 # NON-STANDARD selective recovery present
+
+# Columns of a record as text
+AS_COLUMNS = ("#", "Time (s)", "Direction", "BN", "BNA", "LB", "STR", "W", "BD bytes")
+
+# Direction filters
+AS_ALL = "all"
+AS_FROM_CLIENT_ONLY = "client"
+AS_FROM_SERVER_ONLY = "server"
+AS_DROPPED_ONLY = "dropped"
+AS_FILTERS = (AS_ALL, AS_FROM_CLIENT_ONLY, AS_FROM_SERVER_ONLY, AS_DROPPED_ONLY)
+
+# Records filtered by each call of cApduView.Update()
+AS_UPDATE_RECORDS = 200000
+
+###############################################################################
+# Class : cApduStore
+#
+# Records of GBT APDUs, one array per field
+###############################################################################
+
+class cApduStore():
+    '''
+    Store of GBT APDU records. Add() is called by the receiving GBT
+    thread, so the direction is that of the APDU.
+    '''
+
+    # Constructor
+    def __init__(self):
+        self.oLock = threading.Lock()
+        self.iGeneration = 0 # Changed by Clear(), so that views start again
+        self.Clear()
+
+    def Clear(self):
+        with self.oLock:
+            self.aTime = array.array('d')
+            self.aFlags = array.array('B')
+            self.aW = array.array('H')
+            self.aBN = array.array('I')
+            self.aBNA = array.array('I')
+            self.aLen = array.array('i') # -1 if no block data
+            self.iCount = 0
+            self.fStart = None
+            self.iGeneration += 1
+
+    def __len__(self):
+        return self.iCount
+
+    def Add(self, fTime, bFromServer, apdu, bDropped):
+        iFlags = (AS_FROM_SERVER if bFromServer else 0) | (AS_DROPPED if bDropped else 0) | \
+                 (AS_LB if apdu.LB else 0) | (AS_STR if apdu.STR else 0) | (AS_SR if apdu.SR is not None else 0)
+        with self.oLock:
+            if self.fStart is None:
+                self.fStart = fTime
+            self.aTime.append(fTime - self.fStart)
+            self.aFlags.append(iFlags)
+            self.aW.append(apdu.W or 0)
+            self.aBN.append(apdu.BN)
+            self.aBNA.append(apdu.BNA or 0)
+            self.aLen.append(-1 if apdu.BD is None else len(apdu.BD))
+            self.iCount += 1
+
+    def GetText(self, i, iColumn):
+        '''Text of column iColumn (see AS_COLUMNS) of record i.'''
+        if iColumn == 0:
+            return str(i)
+        if iColumn == 1:
+            return "%.6f" % self.aTime[i]
+        iFlags = self.aFlags[i]
+        if iColumn == 2:
+            sDir = ("CLT -%c SVR", "SVR -%c CLT")[iFlags & AS_FROM_SERVER] % ('>', 'x')[(iFlags & AS_DROPPED) != 0]
+            return sDir + (" SR" if iFlags & AS_SR else "")
+        if iColumn == 3:
+            return str(self.aBN[i])
+        if iColumn == 4:
+            return str(self.aBNA[i])
+        if iColumn == 5:
+            return ("0", "1")[(iFlags & AS_LB) != 0]
+        if iColumn == 6:
+            return ("0", "1")[(iFlags & AS_STR) != 0]
+        if iColumn == 7:
+            return str(self.aW[i])
+        iLen = self.aLen[i]
+        return "-" if iLen < 0 else str(iLen)
+
+###############################################################################
+# Class : cApduView
+#
+# Filtered view of an APDU store
+###############################################################################
+
+class cApduView():
+    '''
+    Records of oStore matching the filter. sFilter is one of AS_FILTERS,
+    tBN None or the (lowest, highest) BN shown. Rows are numbered from 0.
+    '''
+
+    # Constructor
+    def __init__(self, oStore, sFilter=AS_ALL, tBN=None):
+        self.oStore = oStore
+        self.SetFilter(sFilter, tBN)
+
+    def SetFilter(self, sFilter=AS_ALL, tBN=None):
+        if sFilter not in AS_FILTERS:
+            raise ValueError("Unknown filter %s" % sFilter)
+        self.sFilter = sFilter
+        self.tBN = tBN
+        self.bAll = (sFilter == AS_ALL) and (tBN is None)
+        self.aIndex = array.array('I') # Records shown, unless all are
+        self.iScanned = 0 # Records filtered so far
+        self.iGeneration = self.oStore.iGeneration
+
+    def __len__(self):
+        return self.iScanned if self.bAll else len(self.aIndex)
+
+    def IsBehind(self):
+        return self.iScanned < len(self.oStore)
+
+    def Update(self, iMaxRecords=AS_UPDATE_RECORDS):
+        '''
+        Filter up to iMaxRecords of the records added since the last call.
+        Returns True if the rows have changed.
+        '''
+        oStore = self.oStore
+        if self.iGeneration != oStore.iGeneration:
+            # Store cleared
+            self.SetFilter(self.sFilter, self.tBN)
+            return True
+        iStart = self.iScanned
+        iEnd = min(len(oStore), iStart + iMaxRecords)
+        if iEnd == iStart:
+            return False
+        self.iScanned = iEnd
+        if self.bAll:
+            return True
+        iLen = len(self.aIndex)
+        aFlags = oStore.aFlags
+        if self.sFilter == AS_FROM_CLIENT_ONLY:
+            aMatch = [i for i in range(iStart, iEnd) if not aFlags[i] & AS_FROM_SERVER]
+        elif self.sFilter == AS_FROM_SERVER_ONLY:
+            aMatch = [i for i in range(iStart, iEnd) if aFlags[i] & AS_FROM_SERVER]
+        elif self.sFilter == AS_DROPPED_ONLY:
+            aMatch = [i for i in range(iStart, iEnd) if aFlags[i] & AS_DROPPED]
+        else:
+            aMatch = range(iStart, iEnd)
+        if self.tBN is not None:
+            iLow, iHigh = self.tBN
+            aBN = oStore.aBN
+            aMatch = [i for i in aMatch if iLow <= aBN[i] <= iHigh]
+        self.aIndex.extend(aMatch)
+        return len(self.aIndex) != iLen
+
+    def GetRecord(self, iRow):
+        return iRow if self.bAll else self.aIndex[iRow]
+
+    def GetText(self, iRow, iColumn):
+        return self.oStore.GetText(self.GetRecord(iRow), iColumn)
+
+###############################################################################
+# Function : ParseBNRange
+#
+# Parse a BN or range of BNs
+###############################################################################
+
+def ParseBNRange(sRange):
+    '''"" = None, "5" = (5, 5), "10-20" = (10, 20), "10-" = from 10. Raises ValueError.'''
+    sRange = sRange.strip()
+    if not sRange:
+        return None
+    aParts = sRange.split('-')
+    if len(aParts) == 1:
+        return int(aParts[0]), int(aParts[0])
+    if len(aParts) == 2:
+        # Either end may be left open
+        iLow = int(aParts[0]) if aParts[0].strip() else 0
+        iHigh = int(aParts[1]) if aParts[1].strip() else (1 << 32) - 1
+        return iLow, iHigh
+    raise ValueError("Expected BN or lowest-highest: %s" % sRange)
+
+###############################################################################
+# Function : GBTApduStoreMain
+#
+# Main function
+###############################################################################
+
+def GBTApduStoreMain(aArgs=None):
+    import GBT
+    import GBTClientThread
+    import GBTLoss
+    import GBTServerThread
+    import GBTSimEngine
+    oParser = argparse.ArgumentParser(description="Measure the APDU store and its views on a large run.")
+    oParser.add_argument("--payload", type=int, default=1000000, help="payload size in bytes")
+    oParser.add_argument("-b", "--block-size", type=int, default=10, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--loss", type=float, default=0.01, help="loss probability of each GBT APDU")
+    oArgs = oParser.parse_args(aArgs)
+
+    oStore = cApduStore()
+    def Create(oConfig, bIsClient):
+        oThread = (GBTServerThread.cGBTServerThread, GBTClientThread.cGBTClientThread)[bIsClient](oConfig)
+        oThread.oApduStore = oStore
+        return oThread
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, aCltDropMsgs=(), aSvrDropMsgs=(),
+                                              oCltLoss=GBTLoss.CreateLoss(oArgs.loss, 1.0, 1),
+                                              oSvrLoss=GBTLoss.CreateLoss(oArgs.loss, 1.0, 2),
+                                              iWdgStallRounds=0, iWdgRepeatWindows=0, iWdgTimeouts=0)
+    t = time.perf_counter()
+    d = GBTSimEngine.RunTransfer(oConfig, 'x' * oArgs.payload, "response", fMaxTime=float('inf'),
+                                 fnCreate=Create)
+    t = time.perf_counter() - t
+    iBytes = sum(oArray.itemsize * len(oArray) for oArray in
+                 (oStore.aTime, oStore.aFlags, oStore.aW, oStore.aBN, oStore.aBNA, oStore.aLen))
+    print("%d APDUs stored in a run of %.1f s (verified %s), %.1f MB, %.1f bytes per record" %
+          (len(oStore), t, d['bVerified'], iBytes / 1e6, iBytes / float(len(oStore))))
+    for sFilter, tBN in ((AS_ALL, None), (AS_FROM_CLIENT_ONLY, None), (AS_DROPPED_ONLY, None),
+                         (AS_ALL, (1000, 2000))):
+        oView = cApduView(oStore, sFilter, tBN)
+        t = time.perf_counter()
+        iUpdates = 0
+        while oView.IsBehind():
+            oView.Update()
+            iUpdates += 1
+        t = time.perf_counter() - t
+        # A screen of rows, as a virtual list asks for them
+        t2 = time.perf_counter()
+        for iRow in range(min(len(oView), 50)):
+            for iColumn in range(len(AS_COLUMNS)):
+                oView.GetText(iRow, iColumn)
+        t2 = time.perf_counter() - t2
+        print("Filter %-7s BN %-12s: %8d rows, filtered in %6.3f s (%d updates, %.3f s each), "
+              "screen of rows %.2f ms" % (sFilter, tBN, len(oView), t, iUpdates, t / max(iUpdates, 1), t2 * 1e3))
+
+if __name__ == '__main__':
+    GBTApduStoreMain()
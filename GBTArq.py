@@ -0,0 +1,356 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Go-back-N and selective repeat baselines
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Textbook sliding window ARQ protocols, NOT part of the DLMS Green Book, for
+# comparison with GBT. They are derived from cGBTThread, so they split the
+# payload into blocks with the same FillSQ(), apply the same loss models and
+# drop lists on receipt, run on the same links in GBTSimEngine and keep the
+# same statistics (iTxCnt, iSAScnt, block tracker etc.).
+#
+# Blocks are carried in GBT APDUs. The sender keeps up to W blocks
+# outstanding, where W is the BTW of the receiver as for GBT. The receiver
+# acknowledges every GBT APDU with block data by a GBT APDU with no block
+# data, BN = the block received and BNA = the highest block received in
+# order. Unlike GBT, the sender runs the timer, whichever side it is.
+# - Go-back-N: the receiver discards blocks out of order. On a timeout the
+#   sender resends every block outstanding.
+# - Selective repeat: the receiver keeps blocks out of order within its
+#   window. Each block has its own timer and only that block is resent.
+#
+# Each thread runs one transfer: once the receiver has the whole payload it
+# keeps acknowledging repeated blocks, in case its acknowledgements were
+# lost, until the next StartGBT().
+
+import functools
+import GBT
+
+# Baselines by name: thread class
+ARQ_PROTOCOLS = {}
+
+###############################################################################
+# Class : cArqThread
+#
+# Sliding window ARQ thread
+###############################################################################
+
+class cArqThread(GBT.cGBTThread):
+    '''
+    Base class of the ARQ baselines. Handles the same events as the GBT
+    client and server threads; subclasses provide the window procedures.
+    '''
+    sName = "ARQ"
+
+    # Constructor
+    def __init__(self, oConfig, bIsClient):
+        GBT.cGBTThread.__init__(self, oConfig, bIsClient)
+        self.bTimerEnabled = True # The sender always runs the timer
+        self.oThread.name = "%s %s Thread" % (self.sName, self.GetNameStr())
+        self.bSender = False
+        self.NextSend = 1
+
+    def GetWindow(self):
+        '''Blocks outstanding at most, the BTW of the receiver.'''
+        return self.oConfig.GetBTW(not self.bIsClient)
+
+    def StartGBT(self):
+        GBT.cGBTThread.StartGBT(self)
+        self.rxData = None
+        self.bSender = False
+        self.NextSend = 1
+
+    def StartSending(self, data):
+        self.DiagnosticMsg("Invoking %s transfer" % self.sName)
+        self.StartGBT()
+        self.bSender = True
+        self.FillSQ(data)
+        self.SendWindow()
+
+    def SendBlock(self, bn, STR):
+        '''Send a block from SQ.'''
+        apdu = GBT.cGBTAPDU(self.dSQ[bn], STR, self.BTW, self.oGBTStateVars.BNAself)
+        self.oPeerThread.SendEvent(GBT.cEvt(GBT.EVT_PEER_MSG, apdu))
+        self.iTxCnt += 1
+        self.oBlockTracker.Sent(bn, self.fnClock())
+
+    def SendWindow(self):
+        '''Send the blocks not yet sent which fit in the window.'''
+        if not self.bGBTProcessing or (len(self.dSQ) == 0):
+            return
+        bnLimit = min(self.dSQ) + self.GetWindow()
+        bnsSend = [bn for bn in range(self.NextSend, min(bnLimit, self.oGBTStateVars.NextBN))]
+        for i, bn in enumerate(bnsSend):
+            self.SendBlock(bn, int(i < len(bnsSend) - 1))
+            self.BlockSent(bn)
+        if bnsSend:
+            self.NextSend = bnsSend[-1] + 1
+            self.iSAScnt += 1
+
+    def SendAck(self, bn):
+        '''Acknowledge block bn, and all blocks up to BNAself.'''
+        apdu = GBT.cGBTAPDU(GBT.cGBTBlock(0, bn), 0, self.BTW, self.oGBTStateVars.BNAself)
+        self.oPeerThread.SendEvent(GBT.cEvt(GBT.EVT_PEER_MSG, apdu))
+        self.iTxCnt += 1
+
+    def Acked(self, bns):
+        '''Remove acknowledged blocks from SQ. Returns True if the transfer has finished.'''
+        fNow = self.fnClock()
+        for bn in bns:
+            if self.dSQ.pop(bn, None) is not None:
+                self.oBlockTracker.Acked(bn, fNow)
+                self.BlockAcked(bn)
+        if len(self.dSQ) == 0:
+            self.DiagnosticMsg("Finished sending stream")
+            self.StopGBT()
+            return True
+        return False
+
+    def Received(self):
+        '''Called by the receiver after each block. Returns True if the payload is complete.'''
+        blk = self.dRQ.get(self.oGBTStateVars.BNAself)
+        if (blk is not None) and (blk.LB == 1):
+            self.DiagnosticMsg("Finished receiving stream")
+            self.rxData = self.GetRxData()
+            # Keep RQ and BNAself, to acknowledge repeated blocks
+            self.bGBTProcessing = False
+            self.oDoneEvent.set()
+            return True
+        return False
+
+    def HandleMsgFromPeer(self, apdu):
+        if apdu.BD is None:
+            if self.bGBTProcessing and self.bSender:
+                self.oWatchdog.ApduReceived()
+                self.ProcessAck(apdu)
+        elif self.bGBTProcessing and not self.bSender:
+            self.ProcessBlock(apdu)
+            self.SendAck(apdu.BN)
+        elif self.rxData is not None:
+            # Transfer finished, the peer has missed an acknowledgement
+            self.SendAck(apdu.BN)
+        elif not self.bGBTProcessing:
+            self.DiagnosticMsg("New %s stream" % self.sName)
+            self.StartGBT()
+            self.ProcessBlock(apdu)
+            self.SendAck(apdu.BN)
+
+    def HandleEvent(self, event):
+        '''
+        Pure virtual method to handle the event obtained from the queue.
+        '''
+        if event.evtType == GBT.EVT_PEER_MSG:
+            if self.IsMsgDropped():
+                self.iDropCnt += 1
+            else:
+                self.iRxCnt += 1
+                self.HandleMsgFromPeer(event.data)
+            self.msgCount += 1
+        elif event.evtType == GBT.EVT_CLT_INVOKE_ACC_REQ:
+            self.StartSending(event.data)
+        elif event.evtType == GBT.EVT_TIMER_EXPIRY_MSG:
+            self.TimerExpired()
+            if self.bGBTProcessing and self.bSender:
+                self.Timeout(event.data)
+        elif event.evtType == GBT.EVT_PEER_ABORT_MSG:
+            self.HandlePeerAbort(event.data)
+        # Abort if the session is stuck
+        self.CheckWatchdog()
+
+    # Overridden by the protocols as needed
+
+    def BlockSent(self, bn):
+        pass
+
+    def BlockAcked(self, bn):
+        pass
+
+    # Pure Virtual methods to be overridden by the protocols
+    # def ProcessAck(self, apdu):
+        # Pure virtual method to process an acknowledgement
+        # received by the sender.
+
+    # def ProcessBlock(self, apdu):
+        # Pure virtual method to put a block received by the
+        # receiver in RQ and move BNAself on.
+
+    # def Timeout(self, data):
+        # Pure virtual method to handle a timer expiry at the
+        # sender. data is that of the timer expiry event.
+
+###############################################################################
+# Class : cGoBackNThread
+#
+# Go-back-N
+###############################################################################
+
+class cGoBackNThread(cArqThread):
+    '''
+    Go-back-N. One timer runs while any block is outstanding and is
+    restarted whenever the oldest outstanding block is acknowledged.
+    '''
+    sName = "Go-back-N"
+
+    def BlockSent(self, bn):
+        self.StartTimer()
+
+    def ProcessAck(self, apdu):
+        if apdu.BNA < min(self.dSQ):
+            return # Nothing new acknowledged
+        self.StopTimer()
+        if self.Acked(range(min(self.dSQ), apdu.BNA + 1)):
+            return
+        self.NextSend = max(self.NextSend, min(self.dSQ))
+        self.SendWindow()
+        if self.NextSend > min(self.dSQ):
+            # Blocks still outstanding
+            self.StartTimer()
+
+    def ProcessBlock(self, apdu):
+        if apdu.BN == self.oGBTStateVars.BNAself + 1:
+            self.dRQ[apdu.BN] = GBT.cGBTBlock(apdu.LB, apdu.BN, apdu.BD)
+            self.oGBTStateVars.BNAself = apdu.BN
+            self.Received()
+
+    def Timeout(self, data):
+        self.DiagnosticMsg("Timeout, going back to %d" % min(self.dSQ))
+        self.oWatchdog.Timeout()
+        self.NextSend = min(self.dSQ)
+        self.SendWindow()
+
+ARQ_PROTOCOLS["go-back-n"] = cGoBackNThread
+
+###############################################################################
+# Class : cSelectiveRepeatThread
+#
+# Selective repeat
+###############################################################################
+
+class cSelectiveRepeatThread(cArqThread):
+    '''
+    Selective repeat. Each outstanding block has its own timer.
+    '''
+    sName = "Selective repeat"
+
+    def StartGBT(self):
+        cArqThread.StartGBT(self)
+        self.dTimers = {} # Keyed by BN
+
+    def StopGBT(self):
+        for oTimer in self.dTimers.values():
+            oTimer.cancel()
+        self.dTimers = {}
+        cArqThread.StopGBT(self)
+
+    def BlockSent(self, bn):
+        oTimer = self.dTimers.pop(bn, None)
+        if oTimer is not None:
+            oTimer.cancel()
+        oTimer = self.fnTimer(self.oConfig.GetTimeout(self.bIsClient), functools.partial(self.HandleBlockTimerExpiry, bn))
+        self.dTimers[bn] = oTimer
+        oTimer.start()
+
+    def BlockAcked(self, bn):
+        oTimer = self.dTimers.pop(bn, None)
+        if oTimer is not None:
+            oTimer.cancel()
+
+    def HandleBlockTimerExpiry(self, bn):
+        self.SendEvent(GBT.cEvt(GBT.EVT_TIMER_EXPIRY_MSG, bn))
+
+    def TimerExpired(self):
+        # Timers are per block, not the single session timer
+        self.iTimeoutCnt += 1
+
+    def ProcessAck(self, apdu):
+        if self.Acked([apdu.BN] + list(range(min(self.dSQ), apdu.BNA + 1))):
+            return
+        self.SendWindow()
+
+    def ProcessBlock(self, apdu):
+        sv = self.oGBTStateVars
+        if (sv.BNAself < apdu.BN <= sv.BNAself + self.BTW) and (apdu.BN not in self.dRQ):
+            self.dRQ[apdu.BN] = GBT.cGBTBlock(apdu.LB, apdu.BN, apdu.BD)
+            while sv.BNAself + 1 in self.dRQ:
+                sv.BNAself += 1
+            self.Received()
+
+    def Timeout(self, bn):
+        if (bn not in self.dSQ) or (self.dTimers.pop(bn, None) is None):
+            return # Acknowledged meanwhile
+        self.DiagnosticMsg("Timeout, resending %d" % bn)
+        # Only the oldest block counts towards the watchdog, as all the
+        # blocks of a lost window time out together
+        if bn == min(self.dSQ):
+            self.oWatchdog.Timeout()
+        self.SendBlock(bn, 0)
+        self.BlockSent(bn)
+        self.iSAScnt += 1
+
+ARQ_PROTOCOLS["selective-repeat"] = cSelectiveRepeatThread
+
+###############################################################################
+# Function : CreateThread
+#
+# Thread factory for GBTSimEngine.RunTransfer()
+###############################################################################
+
+def CreateThread(sProtocol, oConfig, bIsClient):
+    '''
+    A thread of the protocol named in ARQ_PROTOCOLS, or a GBT client or
+    server thread for "gbt".
+    '''
+    if sProtocol == "gbt":
+        import GBTClientThread
+        import GBTServerThread
+        if bIsClient:
+            return GBTClientThread.cGBTClientThread(oConfig)
+        return GBTServerThread.cGBTServerThread(oConfig)
+    return ARQ_PROTOCOLS[sProtocol](oConfig, bIsClient)
+
+###############################################################################
+# Function : GBTArqMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTArqMain():
+    import GBTLoss
+    import GBTSimEngine
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=32, CltBTW=16, SvrBTW=16, aCltDropMsgs=(), aSvrDropMsgs=(),
+                                              oCltLoss=GBTLoss.cBernoulliLoss(0.05, 1),
+                                              oSvrLoss=GBTLoss.cBernoulliLoss(0.05, 2), tTimeouts=(2.0, 2.0))
+    oLink = GBTSimEngine.cLinkModel(0.1, 9600.0)
+    for sProtocol in ["gbt"] + list(ARQ_PROTOCOLS):
+        for sDirection in ("request", "response"):
+            d = GBTSimEngine.RunTransfer(oConfig, 'x' * 4000, sDirection, oLink,
+                                         fnCreate=functools.partial(CreateThread, sProtocol))
+            print("%-16s %-8s complete %s, verified %s, time %.2f s, rounds %d, APDUs %d, bytes %d" %
+                  (sProtocol, sDirection, d['bComplete'], d['bVerified'], d['fRxTime'] or 0.0, d['iRounds'],
+                   d['iApdus'], d['iBytes']))
+
+if __name__ == '__main__':
+    GBTArqMain()
@@ -0,0 +1,127 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Compare GBT with go-back-N and selective repeat
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Runs the same transfers, with the same block size, window, link, timeout
+# and loss patterns, with GBT and with the baselines in GBTArq, and reports
+# for each protocol:
+# - goodput: payload bits over the time until the receiver has the payload
+# - APDUs and bytes on the link, in both directions, per payload byte
+# - percentiles of the completion time
+# Means and percentiles are over the runs which completed; the number of
+# runs which did not is reported too.
+
+import argparse
+import functools
+import GBT
+import GBTArq
+import GBTHeadEnd
+import GBTLoss
+import GBTRecoveryBench
+import GBTSimEngine
+
+###############################################################################
+# Function : RunProtocol
+#
+# Run one loss scenario with one protocol
+###############################################################################
+
+def RunProtocol(sProtocol, oConfig, oLink, iPayload, sDirection, fLoss, fBurst, iRuns):
+    '''
+    Returns a dictionary of statistics over the runs, the same loss
+    pattern being used for run i whatever the protocol.
+    '''
+    fnCreate = None if sProtocol == "gbt" else functools.partial(GBTArq.CreateThread, sProtocol)
+    payload = 'x' * iPayload
+    aTimes = []
+    iApdus = 0
+    iBytes = 0
+    for iRun in range(iRuns):
+        oRunConfig = oConfig._replace(aCltDropMsgs=(), aSvrDropMsgs=(),
+                                      oCltLoss=GBTLoss.CreateLoss(fLoss, fBurst, 2 * iRun),
+                                      oSvrLoss=GBTLoss.CreateLoss(fLoss, fBurst, 2 * iRun + 1))
+        d = GBTSimEngine.RunTransfer(oRunConfig, payload, sDirection, oLink, fnCreate=fnCreate)
+        if d['bComplete'] and d['bVerified']:
+            aTimes.append(d['fRxTime'])
+            iApdus += d['iApdus']
+            iBytes += d['iBytes']
+    aTimes.sort()
+    iDone = len(aTimes)
+    if iDone == 0:
+        return {'iDone': 0, 'iFailed': iRuns}
+    return {
+        'iDone': iDone,
+        'iFailed': iRuns - iDone,
+        'fGoodput': sum(iPayload * 8.0 / fTime for fTime in aTimes) / iDone,
+        'fApdusPerByte': iApdus / float(iDone * iPayload),
+        'fBytesPerByte': iBytes / float(iDone * iPayload),
+        'fP50': GBTHeadEnd.Percentile(aTimes, 50),
+        'fP90': GBTHeadEnd.Percentile(aTimes, 90),
+        'fP99': GBTHeadEnd.Percentile(aTimes, 99),
+    }
+
+###############################################################################
+# Function : GBTArqBenchMain
+#
+# Main function
+###############################################################################
+
+def GBTArqBenchMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare GBT with go-back-N and selective repeat "
+                                      "under random and bursty loss.")
+    oParser.add_argument("--payload", type=int, default=4000, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="request")
+    oParser.add_argument("-b", "--block-size", type=int, default=32, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--window", type=int, default=16, help="BTW of both sides")
+    oParser.add_argument("--latency", type=float, default=0.1, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("--timeout", type=float, default=2.0, help="timeout in seconds")
+    oParser.add_argument("--runs", type=int, default=100, help="runs per scenario and protocol")
+    oParser.add_argument("--protocols", default=",".join(["gbt"] + list(GBTArq.ARQ_PROTOCOLS)),
+                         help="comma separated protocols")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.window,
+                                              SvrBTW=oArgs.window, tTimeouts=(oArgs.timeout, oArgs.timeout))
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    print("Payload %d bytes %s, block %d, window %d, latency %.3f s, %.0f bit/s, timeout %.1f s, %d runs" %
+          (oArgs.payload, oArgs.direction, oArgs.block_size, oArgs.window, oArgs.latency, oArgs.bit_rate,
+           oArgs.timeout, oArgs.runs))
+    print("%-20s %-16s %6s | %9s | %10s | %11s | %-23s" %
+          ("Scenario", "Protocol", "failed", "goodput", "APDUs/byte", "bytes/byte", "time (s) p50/p90/p99"))
+    for sName, fLoss, fBurst in (("no loss", 0.0, 1.0),) + GBTRecoveryBench.RB_SCENARIOS:
+        for sProtocol in oArgs.protocols.split(','):
+            d = RunProtocol(sProtocol, oConfig, oLink, oArgs.payload, oArgs.direction, fLoss, fBurst, oArgs.runs)
+            if d['iDone'] == 0:
+                print("%-20s %-16s %6d | no run completed" % (sName, sProtocol, d['iFailed']))
+                continue
+            print("%-20s %-16s %6d | %9.0f | %10.4f | %11.3f | %7.2f %7.2f %7.2f" %
+                  (sName, sProtocol, d['iFailed'], d['fGoodput'], d['fApdusPerByte'], d['fBytesPerByte'],
+                   d['fP50'], d['fP90'], d['fP99']))
+
+if __name__ == '__main__':
+    GBTArqBenchMain()
@@ -0,0 +1,237 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Shared cache of segmented payloads
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# When many sessions send the same payload (a firmware image, a tariff
+# table), each would split it into its own blocks. With a block cache in the
+# session configuration (oBlockCache), FillSQ() takes the blocks from the
+# cache instead: the payload is split once for each block size, and every
+# session sending it refers to the same read only cGBTBlock objects. Each
+# session still has its own SQ dictionary, from which acknowledged blocks
+# are removed.
+#
+# Entries are keyed by a digest of the payload, the block size and the
+# compression (see GBTCompress.py), and hold the blocks of the payload as
+# sent, so that a payload is compressed once rather than by every session.
+# Entries are counted by reference: a session holds its entry from FillSQ() until its
+# GBT processing stops. Entries no session holds are kept for reuse, and
+# evicted least recently used first when the cache is over its memory
+# budget. Entries in use are never evicted, so the cache may be over budget
+# while they are.
+
+import argparse
+import collections
+import hashlib
+import sys
+import threading
+import time
+import tracemalloc
+import GBT
+import GBTClientThread
+import GBTServerThread
+
+###############################################################################
+# Class : cSegments
+#
+# A payload split into blocks
+###############################################################################
+
+class cSegments():
+    __slots__ = ('tKey', 'dBlocks', 'NextBN', 'iBytes', 'iRefs')
+
+    def __init__(self, tKey, dBlocks, NextBN):
+        self.tKey = tKey
+        self.dBlocks = dBlocks
+        self.NextBN = NextBN
+        self.iBytes = sys.getsizeof(dBlocks) + \
+                      sum(sys.getsizeof(blk) + sys.getsizeof(blk.__dict__) + sys.getsizeof(blk.BD)
+                          for blk in dBlocks.values())
+        self.iRefs = 0
+
+###############################################################################
+# Function : GetPayloadKey
+#
+# Key of a payload and block size
+###############################################################################
+
+def GetPayloadKey(data, maxPayload, oCompression=None):
+    # str and bytes payloads give different blocks, so are kept apart.
+    # oCompression is an immutable cCompression, equal if configured alike.
+    if isinstance(data, str):
+        bDigest = hashlib.sha256(b's' + data.encode('utf-8')).digest()
+    else:
+        bDigest = hashlib.sha256(b'b' + bytes(data)).digest()
+    return bDigest, len(data), maxPayload, oCompression
+
+###############################################################################
+# Class : cBlockCache
+#
+# Reference counted, LRU cache of segmented payloads
+###############################################################################
+
+class cBlockCache():
+    '''
+    Cache of payloads split into blocks, shared by sessions. iBudget is the
+    memory budget in bytes for the blocks. Thread safe, as sessions may run
+    in their own threads.
+    '''
+
+    # Constructor
+    def __init__(self, iBudget=64 << 20):
+        self.iBudget = iBudget
+        self.dEntries = collections.OrderedDict() # Key: cSegments, least recently used first
+        self.iBytes = 0
+        self.iHits = 0
+        self.iMisses = 0
+        self.iEvictions = 0
+        self.oLock = threading.Lock()
+
+    def Acquire(self, data, maxPayload, oCompression=None):
+        '''
+        The blocks of data, encoded with oCompression if given and split as
+        GBT.SegmentPayload(). Release() when done.
+        '''
+        tKey = GetPayloadKey(data, maxPayload, oCompression)
+        with self.oLock:
+            oSegments = self.dEntries.get(tKey)
+            if oSegments is not None:
+                self.iHits += 1
+                self.dEntries.move_to_end(tKey)
+                oSegments.iRefs += 1
+                return oSegments
+        # Encode and split outside the lock. Another session may do the same, the first in wins.
+        if oCompression is not None:
+            data = oCompression.Encode(data)
+        oNew = cSegments(tKey, *GBT.SegmentPayload(data, maxPayload))
+        with self.oLock:
+            oSegments = self.dEntries.get(tKey)
+            if oSegments is None:
+                self.iMisses += 1
+                oSegments = self.dEntries[tKey] = oNew
+                self.iBytes += oNew.iBytes
+            else:
+                self.iHits += 1
+                self.dEntries.move_to_end(tKey)
+            oSegments.iRefs += 1
+            self.Evict()
+            return oSegments
+
+    def Release(self, oSegments):
+        with self.oLock:
+            oSegments.iRefs -= 1
+            if oSegments.iRefs == 0:
+                self.Evict()
+
+    def Evict(self):
+        '''Evict unused entries, least recently used first, while over budget. Called with the lock held.'''
+        if self.iBytes <= self.iBudget:
+            return
+        for tKey in [tKey for tKey, oSegments in self.dEntries.items() if oSegments.iRefs == 0]:
+            oSegments = self.dEntries.pop(tKey)
+            self.iBytes -= oSegments.iBytes
+            self.iEvictions += 1
+            if self.iBytes <= self.iBudget:
+                break
+
+    def GetStats(self):
+        with self.oLock:
+            return {
+                'iEntries': len(self.dEntries),
+                'iInUse': sum(1 for oSegments in self.dEntries.values() if oSegments.iRefs > 0),
+                'iBytes': self.iBytes,
+                'iHits': self.iHits,
+                'iMisses': self.iMisses,
+                'iEvictions': self.iEvictions,
+            }
+
+###############################################################################
+# Function : BenchSetup
+#
+# Memory and time to fill SQ for sessions serving one payload
+###############################################################################
+
+def BenchSetup(iSessions, payload, oConfig):
+    '''
+    Creates iSessions server threads, then fills the SQ of each with
+    payload. Returns the time and the memory allocated to fill them.
+    '''
+    oPeer = GBTClientThread.cGBTClientThread(oConfig)
+    aSessions = [GBTServerThread.cGBTServerThread(oConfig) for i in range(iSessions)]
+    for oSession in aSessions:
+        oSession.SetPeerThread(oPeer)
+    tracemalloc.start()
+    iBefore = tracemalloc.get_traced_memory()[0]
+    t = time.perf_counter()
+    for oSession in aSessions:
+        oSession.StartGBT()
+        oSession.FillSQ(payload)
+    t = time.perf_counter() - t
+    iMemory = tracemalloc.get_traced_memory()[0] - iBefore
+    tracemalloc.stop()
+    for oSession in aSessions:
+        oSession.ClearVars() # Releases the cache entry
+    return t, iMemory
+
+###############################################################################
+# Function : GBTBlockCacheMain
+#
+# Main function
+###############################################################################
+
+def GBTBlockCacheMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare the memory and set-up time of sessions serving one "
+                                      "payload with and without a shared block cache.")
+    oParser.add_argument("-n", "--sessions", default="10,100,500", help="comma separated numbers of sessions")
+    oParser.add_argument("--payload", type=int, default=200000, help="payload size in bytes")
+    oParser.add_argument("-b", "--block-size", type=int, default=128, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--budget", type=int, default=64 << 20, help="cache memory budget in bytes")
+    oParser.add_argument("--compress", choices=("none", "zlib", "lzma"), default="none",
+                         help="NON-STANDARD payload compression (see GBTCompress.py)")
+    oArgs = oParser.parse_args(aArgs)
+
+    oCompression = None
+    if oArgs.compress != "none":
+        import GBTCompress
+        oCompression = GBTCompress.cCompression(GBTCompress.CP_CHOICES[oArgs.compress])
+    payload = bytes(range(256)) * (oArgs.payload // 256) + bytes(oArgs.payload % 256)
+    print("Payload %d bytes, block %d, compression %s" % (len(payload), oArgs.block_size, oArgs.compress))
+    print("%8s %-8s | %10s | %12s | %14s" % ("sessions", "cache", "setup (s)", "memory (MB)", "per session (kB)"))
+    for sSessions in oArgs.sessions.split(','):
+        iSessions = int(sSessions)
+        for oCache in (None, cBlockCache(oArgs.budget)):
+            oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, oBlockCache=oCache,
+                                                      oCompression=oCompression)
+            t, iMemory = BenchSetup(iSessions, payload, oConfig)
+            print("%8d %-8s | %10.3f | %12.1f | %14.1f" %
+                  (iSessions, ("no", "yes")[oCache is not None], t, iMemory / 1e6, iMemory / 1e3 / iSessions))
+            if oCache is not None:
+                d = oCache.GetStats()
+                print("%8s %-8s   %d hits, %d misses, %d entries, %.1f MB cached" %
+                      ("", "", d['iHits'], d['iMisses'], d['iEntries'], d['iBytes'] / 1e6))
+
+if __name__ == '__main__':
+    GBTBlockCacheMain()
@@ -0,0 +1,179 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Per-block latency tracking
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+import bisect
+import GBTWatchdog
+
+# Upper edges of the latency histogram bins in seconds. Latencies above the
+# last edge go in an extra bin.
+BLOCK_LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+###############################################################################
+# Class : cBlockRecord
+#
+# Lifecycle of one block
+###############################################################################
+
+class cBlockRecord():
+    def __init__(self, fFirstSend):
+        self.fFirstSend = fFirstSend
+        self.fLastSend = fFirstSend
+        self.iSends = 1
+        self.fAck = None
+
+    def GetLatency(self):
+        '''Time from first send to acknowledgement, None if not acknowledged.'''
+        if self.fAck is None:
+            return None
+        return self.fAck - self.fFirstSend
+
+###############################################################################
+# Class : cBlockTracker
+#
+# Tracks the blocks sent in a GBT session
+###############################################################################
+
+class cBlockTracker():
+    '''
+    Block tracker. Records for each block sent in a session when it was
+    first sent, how many times it was sent and when it was acknowledged,
+    i.e. removed from SQ because BNApeer reached it.
+    '''
+
+    # Constructor
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.dBlocks = {} # Keyed by BN
+
+    def Sent(self, bn, fNow):
+        oRecord = self.dBlocks.get(bn)
+        if oRecord is None:
+            self.dBlocks[bn] = cBlockRecord(fNow)
+        else:
+            oRecord.iSends += 1
+            oRecord.fLastSend = fNow
+
+    def Acked(self, bn, fNow):
+        oRecord = self.dBlocks.get(bn)
+        if (oRecord is not None) and (oRecord.fAck is None):
+            oRecord.fAck = fNow
+
+    def GetLatencies(self):
+        return sorted(oRecord.GetLatency() for oRecord in self.dBlocks.values() if oRecord.fAck is not None)
+
+    def GetRetransmissions(self):
+        return sum(oRecord.iSends - 1 for oRecord in self.dBlocks.values())
+
+    def GetHistogram(self, aEdges=BLOCK_LATENCY_BINS):
+        '''Counts of acknowledged blocks in each latency bin, with an extra bin for latencies above the last edge.'''
+        aCounts = [0] * (len(aEdges) + 1)
+        for fLatency in self.GetLatencies():
+            aCounts[bisect.bisect_left(aEdges, fLatency)] += 1
+        return aCounts
+
+    def GetWorstStalls(self, iCount=5):
+        '''
+        The blocks which held up the session the longest. Acknowledgement is
+        cumulative, so blocks waiting behind a lost block share its latency.
+        Consecutive blocks sent the same number of times and acknowledged
+        together are one stall. Stalls with blocks never acknowledged come
+        first, then those with blocks which had to be resent, then the rest,
+        each by latency.
+        Returns a list of (list of BNs, latency or None, retransmissions).
+        '''
+        aStalls = []
+        for bn in sorted(self.dBlocks):
+            oRecord = self.dBlocks[bn]
+            if aStalls and (aStalls[-1][0][-1] == bn - 1) and (aStalls[-1][2] == oRecord.iSends - 1) and \
+               (self.dBlocks[bn - 1].fAck == oRecord.fAck):
+                aStalls[-1][0].append(bn)
+                if oRecord.fAck is not None:
+                    aStalls[-1][1] = max(aStalls[-1][1], oRecord.GetLatency())
+            else:
+                aStalls.append([[bn], oRecord.GetLatency(), oRecord.iSends - 1])
+        aStalls.sort(key=lambda t: (t[1] is not None, t[2] == 0, -(t[1] or 0.0), t[0][0]))
+        return [tuple(t) for t in aStalls[:iCount]]
+
+    def GetSummary(self):
+        aLatencies = self.GetLatencies()
+        if not aLatencies:
+            return "no blocks acknowledged"
+        return "%d blocks, %d retransmissions, latency mean %.3f s, p50 %.3f s, p95 %.3f s, max %.3f s" % \
+               (len(self.dBlocks), self.GetRetransmissions(), sum(aLatencies) / len(aLatencies),
+                aLatencies[len(aLatencies) // 2], aLatencies[int(0.95 * (len(aLatencies) - 1))], aLatencies[-1])
+
+###############################################################################
+# Function : FormatHistogram
+#
+# Format a latency histogram as text, one line per non-empty bin
+###############################################################################
+
+def FormatHistogram(aCounts, aEdges=BLOCK_LATENCY_BINS, iWidth=40):
+    iMax = max(aCounts) if aCounts else 0
+    aLines = []
+    for i, iCount in enumerate(aCounts):
+        if iCount == 0:
+            continue
+        sBin = ("<= %g s" % aEdges[i]) if i < len(aEdges) else ("> %g s" % aEdges[-1])
+        aLines.append("%10s %6d %s" % (sBin, iCount, '#' * max(1, iCount * iWidth // iMax)))
+    return "\n".join(aLines)
+
+###############################################################################
+# Function : FormatStalls
+#
+# Format the worst stalls as text
+###############################################################################
+
+def FormatStalls(aStalls):
+    aItems = []
+    for aBNs, fLatency, iResends in aStalls:
+        sLatency = "not acknowledged" if fLatency is None else "%.3f s" % fLatency
+        aItems.append("BN %s (%s, %d resends)" % (GBTWatchdog.FormatBNs(aBNs), sLatency, iResends))
+    return ", ".join(aItems)
+
+###############################################################################
+# Function : GBTBlockTrackerMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTBlockTrackerMain():
+    oTracker = cBlockTracker()
+    for bn in range(1, 7):
+        oTracker.Sent(bn, 0.01 * bn)
+    oTracker.Sent(3, 2.0)
+    for bn in range(1, 7):
+        oTracker.Acked(bn, (0.1, 2.5)[bn >= 3])
+    print(oTracker.GetSummary())
+    print(FormatHistogram(oTracker.GetHistogram()))
+    print(FormatStalls(oTracker.GetWorstStalls(3)))
+
+if __name__ == '__main__':
+    GBTBlockTrackerMain()
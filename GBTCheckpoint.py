@@ -0,0 +1,194 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Session checkpoints
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+import hashlib
+import os
+import struct
+from typing import NamedTuple
+
+# File format. All integers little endian.
+# Header: magic, version, flags, MaxPayload, payload length, payload digest,
+# BNAself, BNApeer, NextBN, STRself, STRpeer, Wself, Wpeer, bits in RQ bitmap
+CP_MAGIC = b'GBTC'
+CP_VERSION = 1
+CP_HEADER = struct.Struct('<4sBBHI16sIIIBBHHI')
+# Then the RQ bitmap (bit n-1 set if BN n is in RQ) and, for each BN in RQ,
+# flags (LB, BD present) and the length of BD, followed by BD itself
+CP_BLOCK = struct.Struct('<BI')
+
+CP_FLAG_CLIENT = 0x01
+CP_FLAG_TEXT = 0x02 # Block data are str rather than bytes
+
+CP_BLOCK_LB = 0x01
+CP_BLOCK_BD = 0x02
+
+CP_DIGEST_SIZE = 16
+
+###############################################################################
+# Class : cGBTCheckpoint
+#
+# GBT session state from which a session can be resumed
+###############################################################################
+
+class cGBTCheckpoint(NamedTuple):
+    '''
+    Checkpoint of one side of a GBT session. BNApeer is the acknowledged
+    prefix: blocks up to it have been removed from SQ and are not sent
+    again on resume. The payload itself is not kept, only its length and
+    digest, so that the sender can check it resumes with the same payload.
+    The digest is all zero if the side was not sending.
+    '''
+    bIsClient: bool
+    MaxPayload: int
+    iPayloadLen: int
+    bDigest: bytes
+    BNAself: int
+    BNApeer: int
+    NextBN: int
+    STRself: int
+    STRpeer: int
+    Wself: int
+    Wpeer: int
+    aRQ: tuple = () # (BN, LB, BD) of each block in RQ, in BN order
+
+###############################################################################
+# Function : GetPayloadRef
+#
+# Reference to a payload: its length and digest
+###############################################################################
+
+def GetPayloadRef(data):
+    if data is None:
+        return 0, bytes(CP_DIGEST_SIZE)
+    bData = data.encode('utf-8') if isinstance(data, str) else bytes(data)
+    return len(data), hashlib.sha256(bData).digest()[:CP_DIGEST_SIZE]
+
+###############################################################################
+# Function : Encode
+#
+# Encode a checkpoint
+###############################################################################
+
+def Encode(oCheckpoint):
+    bText = any(isinstance(BD, str) for bn, LB, BD in oCheckpoint.aRQ)
+    iFlags = (0, CP_FLAG_CLIENT)[oCheckpoint.bIsClient] | (0, CP_FLAG_TEXT)[bText]
+    iBits = oCheckpoint.aRQ[-1][0] if oCheckpoint.aRQ else 0
+    aBitmap = bytearray((iBits + 7) // 8)
+    aBlocks = []
+    for bn, LB, BD in oCheckpoint.aRQ:
+        aBitmap[(bn - 1) // 8] |= 1 << ((bn - 1) % 8)
+        iBlockFlags = (0, CP_BLOCK_LB)[LB == 1]
+        if BD is None:
+            aBlocks.append(CP_BLOCK.pack(iBlockFlags, 0))
+        else:
+            bBD = BD.encode('utf-8') if bText else bytes(BD)
+            aBlocks.append(CP_BLOCK.pack(iBlockFlags | CP_BLOCK_BD, len(bBD)))
+            aBlocks.append(bBD)
+    sHeader = CP_HEADER.pack(CP_MAGIC, CP_VERSION, iFlags, oCheckpoint.MaxPayload, oCheckpoint.iPayloadLen,
+                             oCheckpoint.bDigest, oCheckpoint.BNAself, oCheckpoint.BNApeer, oCheckpoint.NextBN,
+                             oCheckpoint.STRself, oCheckpoint.STRpeer, oCheckpoint.Wself, oCheckpoint.Wpeer, iBits)
+    return b''.join([sHeader, bytes(aBitmap)] + aBlocks)
+
+###############################################################################
+# Function : Decode
+#
+# Decode a checkpoint
+###############################################################################
+
+def Decode(bData):
+    if len(bData) < CP_HEADER.size:
+        raise ValueError("Checkpoint truncated")
+    (sMagic, iVersion, iFlags, MaxPayload, iPayloadLen, bDigest, BNAself, BNApeer, NextBN,
+     STRself, STRpeer, Wself, Wpeer, iBits) = CP_HEADER.unpack_from(bData)
+    if sMagic != CP_MAGIC:
+        raise ValueError("Not a GBT checkpoint")
+    if iVersion != CP_VERSION:
+        raise ValueError("Unsupported checkpoint version %d" % iVersion)
+    bText = bool(iFlags & CP_FLAG_TEXT)
+    iOffset = CP_HEADER.size
+    aBitmap = bData[iOffset:iOffset + (iBits + 7) // 8]
+    iOffset += len(aBitmap)
+    aRQ = []
+    try:
+        for bn in range(1, iBits + 1):
+            if not (aBitmap[(bn - 1) // 8] >> ((bn - 1) % 8)) & 1:
+                continue
+            iBlockFlags, iLength = CP_BLOCK.unpack_from(bData, iOffset)
+            iOffset += CP_BLOCK.size
+            BD = None
+            if iBlockFlags & CP_BLOCK_BD:
+                BD = bytes(bData[iOffset:iOffset + iLength])
+                if len(BD) != iLength:
+                    raise ValueError("Checkpoint truncated")
+                iOffset += iLength
+                if bText:
+                    BD = BD.decode('utf-8')
+            aRQ.append((bn, int(bool(iBlockFlags & CP_BLOCK_LB)), BD))
+    except (IndexError, struct.error):
+        raise ValueError("Checkpoint truncated")
+    return cGBTCheckpoint(bool(iFlags & CP_FLAG_CLIENT), MaxPayload, iPayloadLen, bDigest, BNAself, BNApeer,
+                          NextBN, STRself, STRpeer, Wself, Wpeer, tuple(aRQ))
+
+###############################################################################
+# Function : Save
+#
+# Save a checkpoint to a file
+###############################################################################
+
+def Save(oCheckpoint, sPath):
+    '''Written to a temporary file which then replaces sPath, so an existing checkpoint is never left half written.'''
+    sTmpPath = sPath + '.tmp'
+    with open(sTmpPath, 'wb') as f:
+        f.write(Encode(oCheckpoint))
+    os.replace(sTmpPath, sPath)
+
+###############################################################################
+# Function : Load
+#
+# Load a checkpoint from a file
+###############################################################################
+
+def Load(sPath):
+    with open(sPath, 'rb') as f:
+        return Decode(f.read())
+
+###############################################################################
+# Function : GBTCheckpointMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTCheckpointMain():
+    iPayloadLen, bDigest = GetPayloadRef('x' * 25)
+    oCheckpoint = cGBTCheckpoint(False, 10, iPayloadLen, bDigest, 1, 0, 1, 1, 0, 6, 63,
+                                 ((1, 0, 'x' * 10), (3, 1, 'x' * 5)))
+    bData = Encode(oCheckpoint)
+    print("%d bytes, round trip %s" % (len(bData), Decode(bData) == oCheckpoint))
+
+if __name__ == '__main__':
+    GBTCheckpointMain()
@@ -27,6 +27,7 @@
 ###############################################################################
 
 import GBT
+import GBTTransfer
 import Logger
 
 ###############################################################################
@@ -42,31 +43,60 @@ class cGBTClientThread(GBT.cGBTThread):
     '''
 
     # Constructor
-    def __init__(self):
-        GBT.cGBTThread.__init__(self, GBT.GBT_CLT_BTS, GBT.GBT_CLT_BTW, True)
+    def __init__(self, oConfig=None):
+        # oConfig is a GBT.cGBTConfig. If None, GBT.GetDefaultConfig() is used.
+        GBT.cGBTThread.__init__(self, oConfig, True)
         self.bTimerEnabled = True # OVERRIDE
         self.oThread.name = "Client Thread"
 
-    def InvokeAccessRequest(self, data):
+    def InvokeAccessRequest(self, data, oTransfer=None):
         '''
-        Invoke an ACCESS.request.
+        Invoke an ACCESS.request. Returns the future of the transfer, see
+        GBTTransfer. oTransfer is given if posted by PostAccessRequest().
         '''
+        if oTransfer is None:
+            oTransfer = GBTTransfer.cTransfer(data)
+        oFuture = oTransfer.GetFuture()
+        self.StartAccessRequest(oTransfer)
+        return oFuture
+
+    def StartAccessRequest(self, oTransfer):
+        '''Invoke an ACCESS.request for oTransfer, unless its future was cancelled.'''
+        if not self.StartTransfer(oTransfer):
+            return
         self.oLoggerThread.PostLog(Logger.LOG_CONSOLE_PRINT, "Invoking ACCESS.request")
         self.StartGBT()
-        self.FillSQ(data)
+        self.FillSQ(oTransfer.payload)
         self.SendGBTAPDUStream()
 
+    def PostAccessRequest(self, data, fTimeout=None, bAwaitResponse=False):
+        '''
+        Invoke an ACCESS.request from any thread. Returns the future of the
+        transfer, a concurrent.futures.Future, see GBTTransfer.
+        '''
+        oTransfer = GBTTransfer.cTransfer(data, fTimeout, bAwaitResponse)
+        oFuture = oTransfer.GetFuture()
+        self.SendEvent(GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, oTransfer))
+        return oFuture
+
+    async def AccessRequest(self, data, fTimeout=None, bAwaitResponse=False):
+        '''PostAccessRequest() awaited from asyncio. Returns a GBTTransfer.cTransferResult.'''
+        import asyncio # Slow to import, so only when needed
+        return await asyncio.wrap_future(self.PostAccessRequest(data, fTimeout, bAwaitResponse))
+
     def DropMsgFromServer(self, apdu:GBT.cGBTAPDU):
         '''
         Drop a message from the Server task.
         '''
         self.oLoggerThread.PostLog(Logger.LOG_BOTH_PRINT, self.GetApduStr(apdu, True))
+        self.StoreApdu(apdu, True)
 
     def HandleMsgFromServer(self, apdu:GBT.cGBTAPDU):
         '''
         Handle a message from the Server task.
         '''
         self.oLoggerThread.PostLog(Logger.LOG_BOTH_PRINT, self.GetApduStr(apdu, False))
+        self.StoreApdu(apdu, False)
         # If we are not processing and the incoming APDU has payload, start processing
         if not self.bGBTProcessing:
             if (apdu.BD != None):
@@ -80,16 +110,33 @@ class cGBTClientThread(GBT.cGBTThread):
         Pure virtual method to handle the event obtained from the queue.
         '''
         if event.evtType == GBT.EVT_PEER_MSG:
-            if self.msgCount in GBT.aCltDropMsgs:
+            if self.IsMsgDropped():
+                self.iDropCnt += 1
                 self.DropMsgFromServer(event.data)
             else:
+                self.iRxCnt += 1
                 self.HandleMsgFromServer(event.data)
             self.msgCount += 1
         elif event.evtType == GBT.EVT_CLT_INVOKE_ACC_REQ:
-            self.InvokeAccessRequest(event.data)
+            if isinstance(event.data, GBTTransfer.cTransfer):
+                # Posted by PostAccessRequest()
+                self.StartAccessRequest(event.data)
+            else:
+                # No future is needed
+                self.StartAccessRequest(GBTTransfer.cTransfer(event.data))
+        elif event.evtType == GBT.EVT_TRANSFER_TIMEOUT_MSG:
+            self.TransferTimeout(event.data)
         elif event.evtType == GBT.EVT_TIMER_EXPIRY_MSG:
             self.oLoggerThread.PostLog(Logger.LOG_CONSOLE_PRINT, "Client timer expired")
+            self.TimerExpired()
             self.CheckRQandFillGaps()
+        elif event.evtType == GBT.EVT_PEER_ABORT_MSG:
+            self.HandlePeerAbort(event.data)
+        elif event.evtType == GBT.EVT_RESUME_MSG:
+            self.ResumeGBT(*event.data)
+        # Abort if the session is stuck
+        self.CheckWatchdog()
+        self.CheckTransfer()
 
 ###############################################################################
 # Function : GBTClientThreadMain
@@ -0,0 +1,281 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Payload compression before segmentation
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# NON-STANDARD extension, off by default. With a cCompression in the session
+# configuration (oCompression), FillSQ() compresses the payload before it is
+# split into blocks, and the receiver decompresses the payload reassembled
+# from RQ. Both ends must have the same configuration.
+#
+# Each payload is compressed with each codec of the configuration and the
+# smallest result kept, unless the payload is smaller than iMinSize or no
+# codec reduces it to fMaxRatio of its size, in which case it is sent as
+# it is. The payload sent starts with one byte: the codec identifier (0 =
+# not compressed), plus CP_STR if the payload was a str, so that the
+# receiver restores its type.
+#
+# Codecs are pluggable: any object with an identifier iId (1 to 127), a
+# name sName and Compress() and Decompress() methods of bytes, registered
+# with RegisterCodec() so that receivers can find it by its identifier.
+
+import argparse
+import lzma
+import time
+import zlib
+from typing import NamedTuple
+import GBT
+import GBTSimEngine
+
+# Header flag of a str payload, sent UTF-8 encoded
+CP_STR = 0x80
+
+# Codecs by identifier
+dCodecs = {}
+
+###############################################################################
+# Function : RegisterCodec
+#
+# Register a codec for decompression
+###############################################################################
+
+def RegisterCodec(oCodec):
+    if not (0 < oCodec.iId < CP_STR):
+        raise ValueError("Codec identifier %d not in 1 to %d" % (oCodec.iId, CP_STR - 1))
+    oOther = dCodecs.get(oCodec.iId)
+    if (oOther is not None) and (oOther.sName != oCodec.sName):
+        raise ValueError("Codec identifier %d already used by %s" % (oCodec.iId, oOther.sName))
+    dCodecs[oCodec.iId] = oCodec
+    return oCodec
+
+###############################################################################
+# Class : cZlibCodec
+#
+# zlib (deflate) codec
+###############################################################################
+
+class cZlibCodec(NamedTuple):
+    iLevel: int = 6
+    iId = 1
+    sName = "zlib"
+
+    def Compress(self, bData):
+        return zlib.compress(bData, self.iLevel)
+
+    def Decompress(self, bData):
+        return zlib.decompress(bData)
+
+###############################################################################
+# Class : cLzmaCodec
+#
+# LZMA codec, raw stream to save the container headers
+###############################################################################
+
+class cLzmaCodec(NamedTuple):
+    iPreset: int = 6
+    iId = 2
+    sName = "lzma"
+
+    def GetFilters(self):
+        return [{'id': lzma.FILTER_LZMA2, 'preset': self.iPreset}]
+
+    def Compress(self, bData):
+        return lzma.compress(bData, lzma.FORMAT_RAW, filters=self.GetFilters())
+
+    def Decompress(self, bData):
+        return lzma.decompress(bData, lzma.FORMAT_RAW, filters=self.GetFilters())
+
+RegisterCodec(cZlibCodec())
+RegisterCodec(cLzmaCodec())
+
+###############################################################################
+# Class : cCompression
+#
+# Compression of the payloads of a session
+###############################################################################
+
+class cCompression(NamedTuple):
+    '''
+    Compression configuration, see the top of this file. Immutable, so
+    may be shared by sessions.
+    '''
+    aCodecs: tuple = (cZlibCodec(),)
+    iMinSize: int = 128 # Payloads smaller than this are not compressed
+    fMaxRatio: float = 0.9 # Compressed size at most this fraction of the payload, else not compressed
+
+    def Choose(self, bData):
+        '''Returns the codec chosen for bData and the compressed data, or (None, bData).'''
+        oBest, bBest = None, bData
+        if len(bData) >= self.iMinSize:
+            for oCodec in self.aCodecs:
+                bCompressed = oCodec.Compress(bData)
+                if len(bCompressed) < len(bBest):
+                    oBest, bBest = oCodec, bCompressed
+        if len(bBest) > self.fMaxRatio * len(bData):
+            return None, bData
+        return oBest, bBest
+
+    def Encode(self, data):
+        '''The payload as sent: header byte and, if chosen, compressed.'''
+        if isinstance(data, str):
+            bData, iFlags = data.encode('utf-8'), CP_STR
+        else:
+            bData, iFlags = bytes(data), 0
+        oCodec, bData = self.Choose(bData)
+        if oCodec is not None:
+            iFlags |= oCodec.iId
+        return bytes((iFlags,)) + bData
+
+    def Decode(self, data):
+        '''The payload from the data received.'''
+        if not data:
+            raise ValueError("Compressed payload has no header")
+        iHeader = data[0]
+        bData = bytes(data[1:])
+        iId = iHeader & ~CP_STR
+        if iId != 0:
+            if iId not in dCodecs:
+                raise ValueError("Unknown codec identifier %d" % iId)
+            bData = dCodecs[iId].Decompress(bData)
+        if iHeader & CP_STR:
+            return bData.decode('utf-8')
+        return bData
+
+###############################################################################
+# Function : GetCodecName
+#
+# Name of the codec of an encoded payload
+###############################################################################
+
+def GetCodecName(bEncoded):
+    iId = bEncoded[0] & ~CP_STR
+    return dCodecs[iId].sName if iId else "none"
+
+###############################################################################
+# Function : MeasureCpu
+#
+# CPU time to encode and decode a payload
+###############################################################################
+
+def MeasureCpu(oCompression, payload, iRepeat=5):
+    '''Returns the best of iRepeat times in seconds to encode, and to decode.'''
+    fEncode = fDecode = float('inf')
+    for i in range(iRepeat):
+        t = time.process_time()
+        bEncoded = oCompression.Encode(payload)
+        fEncode = min(fEncode, time.process_time() - t)
+        t = time.process_time()
+        oCompression.Decode(bEncoded)
+        fDecode = min(fDecode, time.process_time() - t)
+    return fEncode, fDecode
+
+###############################################################################
+# Function : GBTCompressMain
+#
+# Main function
+###############################################################################
+
+# Codec choices of the comparison
+CP_CHOICES = {
+    "zlib": (cZlibCodec(),),
+    "lzma": (cLzmaCodec(),),
+    "auto": (cZlibCodec(), cLzmaCodec()),
+}
+
+def GBTCompressMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare GBT transfers of payloads with and without compression.")
+    oGroup = oParser.add_mutually_exclusive_group()
+    oGroup.add_argument("-w", "--workload", default="daily-load-profile-1k-4ch",
+                        help="payloads from a synthetic DLMS workload (see GBTWorkload.py)")
+    oGroup.add_argument("-f", "--payload-file", help="file containing one payload (sent as bytes)")
+    oParser.add_argument("-n", "--payloads", type=int, default=10, help="payloads of the workload compared")
+    oParser.add_argument("--min-size", type=int, default=128, help="payloads smaller than this are not compressed")
+    oParser.add_argument("--max-ratio", type=float, default=0.9, help="compressed size must be at most this fraction")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="response")
+    oParser.add_argument("-b", "--block-size", type=int, default=128, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--window", type=int, default=6, help="GBT BTW of both sides")
+    oParser.add_argument("--latency", type=float, default=0.05, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("-s", "--seed", type=int, default=0, help="workload seed")
+    oArgs = oParser.parse_args(aArgs)
+
+    if oArgs.payload_file is not None:
+        with open(oArgs.payload_file, 'rb') as oFile:
+            aPayloads = [oFile.read()]
+        sSource = oArgs.payload_file
+    else:
+        import GBTWorkload # Imports numpy, so only when needed
+        aPayloads = GBTWorkload.GetPayloads(GBTWorkload.ParseWorkload(oArgs.workload), oArgs.seed)[:oArgs.payloads]
+        sSource = oArgs.workload
+    oBase = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.window, SvrBTW=oArgs.window,
+                                            aCltDropMsgs=(), aSvrDropMsgs=())
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    iBytes = sum(len(payload) for payload in aPayloads)
+    print("%s: %d payloads, mean %.0f bytes, block %d, BTW %d, %.0f bit/s, latency %.3f s" %
+          (sSource, len(aPayloads), iBytes / float(len(aPayloads)), oArgs.block_size, oArgs.window,
+           oArgs.bit_rate, oArgs.latency))
+    print("Means per payload. Saved is against no compression; CPU is encode + decode.")
+    print("%-6s | %7s | %6s | %6s | %8s | %8s | %8s | %10s | %s" %
+          ("codec", "bytes", "blocks", "rounds", "time (s)", "saved(s)", "CPU (ms)", "saved/CPU", "chosen"))
+    dBase = None
+    for sChoice in ("none",) + tuple(CP_CHOICES):
+        if sChoice == "none":
+            oCompression = None
+        else:
+            oCompression = cCompression(CP_CHOICES[sChoice], oArgs.min_size, oArgs.max_ratio)
+        oConfig = oBase._replace(oCompression=oCompression)
+        fTime = fCpu = 0.0
+        iSent = iBlocks = iRounds = 0
+        dChosen = {}
+        for payload in aPayloads:
+            if oCompression is not None:
+                bEncoded = oCompression.Encode(payload)
+                sCodec = GetCodecName(bEncoded)
+                dChosen[sCodec] = dChosen.get(sCodec, 0) + 1
+                fCpu += sum(MeasureCpu(oCompression, payload))
+            else:
+                bEncoded = payload
+            d = GBTSimEngine.RunTransfer(oConfig, payload, oArgs.direction, oLink)
+            if not (d['bComplete'] and d['bVerified']):
+                print("%-6s | transfer failed: %s" % (sChoice, d['sAbortReason']))
+                break
+            iSent += len(bEncoded)
+            iBlocks += -(-len(bEncoded) // oArgs.block_size)
+            iRounds += d['iRounds']
+            fTime += d['fRxTime']
+        else:
+            n = float(len(aPayloads))
+            tRow = (iSent / n, iBlocks / n, iRounds / n, fTime / n, fCpu / n)
+            if dBase is None:
+                dBase = tRow
+            fSaved = dBase[3] - tRow[3]
+            sRatio = ("%10.0f" % (fSaved / tRow[4])) if tRow[4] > 0.0 else "%10s" % "-"
+            print("%-6s | %7.0f | %6.1f | %6.1f | %8.2f | %8.2f | %8.3f | %s | %s" %
+                  ((sChoice,) + tRow[:4] + (fSaved, tRow[4] * 1e3, sRatio,
+                   ", ".join("%s %d" % t for t in sorted(dChosen.items())) or "-")))
+
+if __name__ == '__main__':
+    GBTCompressMain()
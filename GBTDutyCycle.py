@@ -0,0 +1,271 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Duty cycle and airtime budgets of constrained radio links
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Sub-GHz links limit the airtime of each transmitter, which on a slow link
+# decides the transfer time far more than the GBT window does. Each endpoint
+# has an airtime accountant, which holds each GBT APDU back until all of the
+# limits of its budget (cAirtimeBudget) allow it to be sent:
+# - Duty cycle over an observation window: the airtime of the transmissions
+#   started in the last fWindow seconds may not be more than fDutyCycle of
+#   fWindow (e.g. 1% of one hour, 36 s).
+# - Duty cycle as an off time (fWindow = 0): after each transmission of T
+#   seconds the transmitter is silent for T * (1 / fDutyCycle - 1).
+# - Token bucket: fTokenRate bytes per second up to iTokenBurst bytes. An
+#   APDU larger than the bucket waits for a full bucket, and leaves it in
+#   debt.
+# Each transmitted byte also costs fEnergyPerByte joules, which is reported
+# but does not hold APDUs back.
+#
+# cPacedPort stands in for GBTSimEngine.cSimPort, so the pacing is below
+# GBT: the GBT timers run from when the APDUs are handed to the link, and
+# must allow for the time they are held back, or the window is resent.
+# GBT acknowledgements are paced by the receiver's own budget.
+
+import argparse
+import collections
+from typing import NamedTuple
+import GBT
+import GBTSimEngine
+
+###############################################################################
+# Class : cAirtimeBudget
+#
+# Limits on the airtime of one transmitter
+###############################################################################
+
+class cAirtimeBudget(NamedTuple):
+    '''
+    Airtime budget of a transmitter. Each limit is off when 0.
+    '''
+    fDutyCycle: float = 0.0 # Fraction of time transmitting, e.g. 0.01
+    fWindow: float = 3600.0 # Duty cycle observation window in seconds. 0 = off time after each transmission
+    fTokenRate: float = 0.0 # Token bucket rate in bytes per second
+    iTokenBurst: int = 0 # Token bucket size in bytes
+    fEnergyPerByte: float = 0.0 # Joules per transmitted byte
+
+###############################################################################
+# Class : cAirtimeAccountant
+#
+# Accounts for the airtime of one transmitter against its budget
+###############################################################################
+
+class cAirtimeAccountant():
+    '''
+    Airtime accountant of one transmitter. GetStart() gives the earliest
+    time at which a transmission may start, Record() accounts for it.
+    Transmissions must be recorded in order of start time.
+    '''
+
+    # Constructor
+    def __init__(self, oBudget=cAirtimeBudget()):
+        self.oBudget = oBudget
+        self.aWindow = collections.deque() # (start, airtime) of the transmissions in the observation window
+        self.fWindowAirtime = 0.0
+        self.fOffUntil = 0.0
+        self.fTokens = float(oBudget.iTokenBurst)
+        self.fTokenTime = 0.0
+        # Totals
+        self.iTx = 0
+        self.iBytes = 0
+        self.fAirtime = 0.0
+        self.fEnergy = 0.0
+        self.iHeld = 0 # Transmissions held back
+        self.fHeld = 0.0 # Total time held back
+
+    def Expire(self, fTime):
+        while self.aWindow and (self.aWindow[0][0] + self.oBudget.fWindow <= fTime):
+            self.fWindowAirtime -= self.aWindow.popleft()[1]
+
+    def GetStart(self, fReady, fAirtime, iBytes):
+        '''Earliest time from fReady at which fAirtime seconds carrying iBytes may be sent.'''
+        oBudget = self.oBudget
+        fStart = fReady
+        if oBudget.fDutyCycle > 0.0:
+            if oBudget.fWindow > 0.0:
+                # A transmission longer than the whole allowance is sent once the window is empty
+                fAllowance = oBudget.fDutyCycle * oBudget.fWindow
+                self.Expire(fStart)
+                while self.aWindow and (self.fWindowAirtime + fAirtime > fAllowance):
+                    fStart = self.aWindow[0][0] + oBudget.fWindow
+                    self.Expire(fStart)
+            else:
+                fStart = max(fStart, self.fOffUntil)
+        if oBudget.fTokenRate > 0.0:
+            fTokens = min(self.fTokens + (fStart - self.fTokenTime) * oBudget.fTokenRate, oBudget.iTokenBurst)
+            fNeeded = min(iBytes, oBudget.iTokenBurst)
+            if fTokens < fNeeded:
+                fStart += (fNeeded - fTokens) / oBudget.fTokenRate
+        return fStart
+
+    def Record(self, fReady, fStart, fAirtime, iBytes):
+        oBudget = self.oBudget
+        if oBudget.fDutyCycle > 0.0:
+            if oBudget.fWindow > 0.0:
+                self.aWindow.append((fStart, fAirtime))
+                self.fWindowAirtime += fAirtime
+            else:
+                self.fOffUntil = fStart + fAirtime / oBudget.fDutyCycle
+        if oBudget.fTokenRate > 0.0:
+            self.fTokens = min(self.fTokens + (fStart - self.fTokenTime) * oBudget.fTokenRate,
+                               oBudget.iTokenBurst) - iBytes
+            self.fTokenTime = fStart
+        self.iTx += 1
+        self.iBytes += iBytes
+        self.fAirtime += fAirtime
+        self.fEnergy += iBytes * oBudget.fEnergyPerByte
+        if fStart > fReady:
+            self.iHeld += 1
+            self.fHeld += fStart - fReady
+
+    def GetStats(self):
+        return {
+            'iTx': self.iTx,
+            'iBytes': self.iBytes,
+            'fAirtime': self.fAirtime,
+            'fEnergy': self.fEnergy,
+            'iHeld': self.iHeld,
+            'fHeld': self.fHeld,
+        }
+
+###############################################################################
+# Class : cPacedPort
+#
+# Stands in for the peer thread, pacing GBT APDUs by an airtime budget
+###############################################################################
+
+class cPacedPort(GBTSimEngine.cSimPort):
+    '''
+    Port of GBTSimEngine which holds each GBT APDU back until the airtime
+    budget of the sending endpoint allows it to be sent.
+    '''
+    def __init__(self, oEngine, oDest, oLink, oBudget=cAirtimeBudget()):
+        GBTSimEngine.cSimPort.__init__(self, oEngine, oDest, oLink)
+        self.oAccountant = cAirtimeAccountant(oBudget)
+
+    def SendEvent(self, event):
+        if event.evtType != GBT.EVT_PEER_MSG:
+            # Aborts take no airtime
+            return GBTSimEngine.cSimPort.SendEvent(self, event)
+        iBytes = GBTSimEngine.GetApduSize(event.data, self.oLink.iHeader)
+        fAirtime = self.oLink.GetTxTime(iBytes)
+        fReady = max(self.oEngine.fNow, self.fBusyUntil)
+        fStart = self.oAccountant.GetStart(fReady, fAirtime, iBytes)
+        self.oAccountant.Record(fReady, fStart, fAirtime, iBytes)
+        self.iTxBytes += iBytes
+        self.fBusyUntil = fStart + fAirtime
+        self.oEngine.Schedule(self.fBusyUntil + self.oLink.fLatency - self.oEngine.fNow, self.oDest.HandleEvent, event)
+
+###############################################################################
+# Function : RunPaced
+#
+# Run a transfer under airtime budgets and return statistics
+###############################################################################
+
+def RunPaced(oConfig, payload, sDirection, oLink, oCltBudget, oSvrBudget=None, fMaxTime=7 * 86400.0):
+    '''
+    GBTSimEngine.RunTransfer() with the client transmitting under
+    oCltBudget and the server under oSvrBudget (oCltBudget if None).
+    dAirtime in the result has the accountant statistics of each.
+    '''
+    if oSvrBudget is None:
+        oSvrBudget = oCltBudget
+    def CreatePort(oEngine, oDest, oLink):
+        # The port to the client carries what the server transmits
+        return cPacedPort(oEngine, oDest, oLink, oSvrBudget if oDest.bIsClient else oCltBudget)
+    d = GBTSimEngine.RunTransfer(oConfig, payload, sDirection, oLink, fMaxTime, fnPort=CreatePort)
+    d['dAirtime'] = {
+        'client': d['oClient'].oPeerThread.oAccountant.GetStats(),
+        'server': d['oServer'].oPeerThread.oAccountant.GetStats(),
+    }
+    d['iTimeouts'] = d['oClient'].iTimeoutCnt + d['oServer'].iTimeoutCnt
+    return d
+
+###############################################################################
+# Function : ParseList
+#
+# Parse a comma separated list of integers
+###############################################################################
+
+def ParseList(sList):
+    return [int(s) for s in sList.split(',') if s.strip() != '']
+
+###############################################################################
+# Function : GBTDutyCycleMain
+#
+# Main function
+###############################################################################
+
+def GBTDutyCycleMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare GBT block sizes and windows under duty cycle limits.")
+    oParser.add_argument("--duty-cycle", type=float, default=0.01, help="fraction of time transmitting, 0 = no limit")
+    oParser.add_argument("--dc-window", type=float, default=3600.0,
+                         help="duty cycle observation window in seconds, 0 = off time after each transmission")
+    oParser.add_argument("--token-rate", type=float, default=0.0, help="token bucket bytes per second, 0 = none")
+    oParser.add_argument("--token-burst", type=int, default=0, help="token bucket size in bytes")
+    oParser.add_argument("--energy-per-byte", type=float, default=0.0, help="joules per transmitted byte")
+    oParser.add_argument("--block-sizes", type=ParseList, default=[32, 64, 128, 256, 512, 1000],
+                         help="comma separated GBT_MAX_PAYLOAD values")
+    oParser.add_argument("--windows", type=ParseList, default=[1, 4, 16], help="comma separated GBT BTW values")
+    oParser.add_argument("--payload", type=int, default=20000, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="response")
+    oParser.add_argument("--latency", type=float, default=0.05, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=4800.0, help="bit rate")
+    oParser.add_argument("--timeout", type=float, default=3600.0, help="GBT timeout in seconds")
+    oArgs = oParser.parse_args(aArgs)
+
+    oBudget = cAirtimeBudget(oArgs.duty_cycle, oArgs.dc_window, oArgs.token_rate, oArgs.token_burst,
+                             oArgs.energy_per_byte)
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    payload = 'x' * oArgs.payload
+    sSender = ("server", "client")[oArgs.direction == "request"]
+    print("Payload %d bytes %s, %.0f bit/s, latency %.3f s, %s" %
+          (oArgs.payload, oArgs.direction, oArgs.bit_rate, oArgs.latency, oBudget))
+    print("%6s %4s | %10s | %8s | %14s | %14s | %9s | %8s" %
+          ("block", "BTW", "time (s)", "APDUs", "airtime tx/rx", "held tx/rx (s)", "energy(J)", "timeouts"))
+    tBest = None
+    for iBlock in oArgs.block_sizes:
+        for iWindow in oArgs.windows:
+            oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=iBlock, CltBTW=iWindow, SvrBTW=iWindow,
+                                                      aCltDropMsgs=(), aSvrDropMsgs=(),
+                                                      tTimeouts=(oArgs.timeout, oArgs.timeout))
+            d = RunPaced(oConfig, payload, oArgs.direction, oLink, oBudget)
+            if not (d['bComplete'] and d['bVerified']):
+                print("%6d %4d | did not complete: %s" % (iBlock, iWindow, d['sAbortReason']))
+                continue
+            dTx = d['dAirtime'][sSender]
+            dRx = d['dAirtime'][("server", "client")[sSender == "server"]]
+            print("%6d %4d | %10.1f | %8d | %6.1f/%6.1f | %6.0f/%6.0f | %9.3f | %8d" %
+                  (iBlock, iWindow, d['fRxTime'], d['iApdus'], dTx['fAirtime'], dRx['fAirtime'],
+                   dTx['fHeld'], dRx['fHeld'], dTx['fEnergy'] + dRx['fEnergy'], d['iTimeouts']))
+            if (tBest is None) or (d['fRxTime'] < tBest[2]):
+                tBest = (iBlock, iWindow, d['fRxTime'])
+    if tBest is not None:
+        print("Fastest: block %d, BTW %d, %.1f s" % tBest)
+
+if __name__ == '__main__':
+    GBTDutyCycleMain()
@@ -0,0 +1,542 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Exhaustive exploration of drop patterns
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Runs one transfer with the real client and server threads under every
+# pattern of at most k dropped GBT APDUs, and reports the worst case GBT
+# APDUs, rounds and timeouts, and how many patterns end in each outcome:
+# complete, aborted (and why), deadlock (nothing in flight and no timer
+# running), livelock (a state repeats with no drop in between, so the
+# session can go round forever) or the bound on deliveries reached, which
+# is usually a livelock in which block numbers keep growing, so that no
+# state repeats.
+#
+# The link is untimed: GBT APDUs are delivered in the order they were sent,
+# and a timer only expires when nothing is in flight, i.e. timeouts are
+# longer than any round trip. This is the same as GBTSimEngine with a link
+# of no latency and infinite bit rate, which is used to check the drop
+# patterns found (--verify).
+#
+# Each delivery is a choice between delivering and dropping the APDU. The
+# search is depth first, saving and restoring the state of both threads at
+# each choice. Endpoint states are reduced to a canonical key: state
+# variables, the block numbers in SQ and RQ, the timer, the watchdog and the
+# APDUs in flight. Counters and the message numbering are left out, as they
+# do not change what happens next. The result from each (key, drops left)
+# is remembered under a digest of the key, so a state reached by many
+# patterns is explored once. A result holds the worst value of each metric
+# and, for each outcome, the number of patterns and one example. Drop
+# patterns are kept as the ordinals of the dropped deliveries, and
+# converted to client and server drop lists by replaying them. The drop
+# lists count the GBT APDUs each side receives over the whole transfer. While
+# there is one stream they are aCltDropMsgs and aSvrDropMsgs, but those count
+# from 0 again at each stream, e.g. when the receiver takes resent blocks as
+# a new one, so --verify replays the lists counting over the whole
+# transfer (GBTLoss.cContinuousLoss). The patterns giving the worst values
+# are found afterwards by following the worst choice down from the start.
+#
+# The number of states grows about as the number of deliveries to the
+# power k + 1. With the default block size and windows, k = 2 takes about
+# 0.3 s for a 200 byte payload, 30 s for 1000 bytes and several minutes for
+# 2000 bytes, and k = 3 about 4 s for 200 bytes and 10 s for 300 bytes, but
+# more than 10 minutes for 500 bytes. The memo is bounded (--max-memo),
+# least recently used results evicted first, so memory stays within a few
+# hundred MB however long the search; evicted states are explored again
+# when reached again.
+
+import argparse
+import collections
+import copy
+import hashlib
+import sys
+import time
+import GBT
+import GBTClientThread
+import GBTLoss
+import GBTServerThread
+import GBTSimEngine
+
+# Thread attributes saved at each choice. Dictionaries are copied, the
+# state variables and watchdog are copied, the rest are not mutated.
+EX_ATTRS = ('msgCount', 'tSR', 'tPeerSR', 'bGBTProcessing', 'oTimer', 'iSAScnt', 'iPGAcnt', 'iCRFcnt',
+            'iTxCnt', 'iRxCnt', 'iDropCnt', 'iTimeoutCnt', 'rxData', 'txData', 'oCheckpoint',
+            'sAbortReason', 'sAbortSnapshot', 'iAckedBlocks', 'iRxBlocks', 'bnPeerLast')
+
+# Outcomes
+EX_COMPLETE = "complete"
+EX_CORRUPT = "complete, payload differs"
+EX_DEADLOCK = "deadlock"
+EX_LIVELOCK = "livelock"
+EX_BOUND = "delivery bound reached (possible livelock)"
+
+# Worst case metrics
+EX_METRICS = ("GBT APDUs", "rounds", "timeouts")
+
+# Results remembered, about 600 bytes each, and the size in bytes of the
+# digest of a state, which stands in for the state in the memo
+EX_MAX_MEMO = 1 << 19
+EX_DIGEST_SIZE = 16
+
+###############################################################################
+# Class : cNullLogger
+#
+# Discards logs
+###############################################################################
+
+class cNullLogger():
+    def PostLog(self, mask, sLog):
+        pass
+
+###############################################################################
+# Class : cNullTracker
+#
+# Stands in for the block tracker, which is not needed
+###############################################################################
+
+class cNullTracker():
+    def Reset(self):
+        pass
+
+    def Sent(self, bn, fNow):
+        pass
+
+    def Acked(self, bn, fNow):
+        pass
+
+###############################################################################
+# Class : cExplorerTimer
+#
+# Timer which expires when the explorer fires it
+###############################################################################
+
+class cExplorerTimer():
+    def __init__(self, iSeq, fn):
+        self.iSeq = iSeq # Timers started first expire first
+        self.fn = fn
+
+    def start(self):
+        pass
+
+    def cancel(self):
+        pass
+
+###############################################################################
+# Class : cExplorerPort
+#
+# Stands in for the peer thread, putting events in flight
+###############################################################################
+
+class cExplorerPort():
+    def __init__(self, oExplorer, oDest):
+        self.oExplorer = oExplorer
+        self.oDest = oDest
+
+    @property
+    def oGBTStateVars(self):
+        return self.oDest.oGBTStateVars
+
+    def SendEvent(self, event):
+        self.oExplorer.aInFlight.append((self.oDest, event))
+
+###############################################################################
+# Class : cExplorerLoss
+#
+# Loss model which drops what the explorer chooses to drop
+###############################################################################
+
+class cExplorerLoss():
+    def __init__(self, oExplorer, bIsClient):
+        self.oExplorer = oExplorer
+        self.bIsClient = bIsClient
+
+    def IsDropped(self, iMsg):
+        if self.oExplorer.bDrop and (self.oExplorer.aDropped is not None):
+            # Counted over the whole transfer, as msgCount restarts at each stream
+            oThread = (self.oExplorer.oServer, self.oExplorer.oClient)[self.bIsClient]
+            self.oExplorer.aDropped.append((self.bIsClient, oThread.iRxCnt + oThread.iDropCnt))
+        return self.oExplorer.bDrop
+
+    def __repr__(self):
+        return "cExplorerLoss(%s)" % ("server", "client")[self.bIsClient]
+
+###############################################################################
+# Class : cResult
+#
+# Result of exploring from a state
+###############################################################################
+
+class cResult():
+    '''
+    tWorst holds the worst value of each of EX_METRICS and dOutcomes
+    (patterns, drops) for each outcome, where drops is an example drop
+    pattern: the ordinals of the dropped deliveries from the state. The
+    patterns giving the worst values are not kept, see cExplorer.FindWorst().
+    '''
+    __slots__ = ('tWorst', 'dOutcomes')
+
+    def __init__(self, tWorst, dOutcomes):
+        self.tWorst = tWorst
+        self.dOutcomes = dOutcomes
+
+    @classmethod
+    def Terminal(cls, sOutcome):
+        return cls((0,) * len(EX_METRICS), {sOutcome: (1, ())})
+
+    def Shift(self, tCosts, bDrop):
+        '''The result one delivery earlier, which cost tCosts and was dropped if bDrop.'''
+        tFirst = (0,) if bDrop else ()
+        tWorst = tuple(x + iCost for x, iCost in zip(self.tWorst, tCosts))
+        dOutcomes = dict((sOutcome, (iCount, tFirst + tuple(i + 1 for i in tDrops)))
+                         for sOutcome, (iCount, tDrops) in self.dOutcomes.items())
+        return cResult(tWorst, dOutcomes)
+
+    def Merge(self, oOther):
+        tWorst = tuple(max(a, b) for a, b in zip(self.tWorst, oOther.tWorst))
+        dOutcomes = dict(self.dOutcomes)
+        for sOutcome, (iCount, tDrops) in oOther.dOutcomes.items():
+            if sOutcome in dOutcomes:
+                dOutcomes[sOutcome] = (dOutcomes[sOutcome][0] + iCount, dOutcomes[sOutcome][1])
+            else:
+                dOutcomes[sOutcome] = (iCount, tDrops)
+        return cResult(tWorst, dOutcomes)
+
+###############################################################################
+# Class : cExplorer
+#
+# Drop pattern explorer
+###############################################################################
+
+class cExplorer():
+    '''
+    Explores every pattern of at most iMaxDrops dropped GBT APDUs in one
+    transfer of payload. Paths longer than iMaxDeliveries deliveries are
+    cut short. The drop lists and loss models of oConfig are not used.
+    At most iMaxMemo results are remembered, least recently used evicted
+    first; an evicted state is explored again if reached again.
+    '''
+
+    # Constructor
+    def __init__(self, oConfig, payload, sDirection="request", iMaxDrops=2, iMaxDeliveries=500,
+                 iMaxMemo=EX_MAX_MEMO):
+        self.payload = payload
+        self.iMaxDrops = iMaxDrops
+        self.iMaxDeliveries = iMaxDeliveries
+        self.iMaxMemo = iMaxMemo
+        oConfig = oConfig._replace(aCltDropMsgs=(), aSvrDropMsgs=(),
+                                   oCltLoss=cExplorerLoss(self, True), oSvrLoss=cExplorerLoss(self, False))
+        self.oClient = GBTClientThread.cGBTClientThread(oConfig)
+        self.oServer = GBTServerThread.cGBTServerThread(oConfig)
+        self.aThreads = (self.oClient, self.oServer)
+        self.iTimerSeq = 0
+        for oThread in self.aThreads:
+            oThread.oLoggerThread = cNullLogger()
+            oThread.oBlockTracker = cNullTracker()
+            oThread.fnTimer = self.Timer
+            oThread.fnClock = lambda: 0.0
+        self.oClient.SetPeerThread(cExplorerPort(self, self.oServer))
+        self.oServer.SetPeerThread(cExplorerPort(self, self.oClient))
+        if sDirection == "request":
+            self.oSender, self.oReceiver = self.oClient, self.oServer
+        else:
+            self.oSender, self.oReceiver = self.oServer, self.oClient
+        self.aInFlight = []
+        self.bDrop = False
+        self.aDropped = None # Drops recorded when replaying
+        self.dMemo = collections.OrderedDict() # Key digest: cResult, least recently used first
+        self.sStack = set()
+        self.iStates = 0
+        self.iMemoHits = 0
+        self.iEvictions = 0
+        # Start the transfer
+        self.oSender.HandleEvent(GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, payload))
+        self.sStatus = self.Settle()
+        self.tRoot = self.Save()
+        self.tRootCosts = self.GetCosts() # The first window, sent before any choice
+
+    def Timer(self, fInterval, fn):
+        self.iTimerSeq += 1
+        return cExplorerTimer(self.iTimerSeq, fn)
+
+    def Drain(self):
+        bBusy = True
+        while bBusy:
+            bBusy = False
+            for oThread in self.aThreads:
+                while not oThread.oQueue.empty():
+                    oThread.HandleEvent(oThread.oQueue.get())
+                    bBusy = True
+
+    def IsDone(self):
+        return self.oSender.oDoneEvent.is_set() and self.oReceiver.oDoneEvent.is_set()
+
+    def GetOutcome(self):
+        sAbortReason = self.oSender.sAbortReason or self.oReceiver.sAbortReason
+        if sAbortReason is not None:
+            return "aborted: " + sAbortReason
+        return (EX_CORRUPT, EX_COMPLETE)[self.oReceiver.rxData == self.payload]
+
+    def Settle(self):
+        '''
+        Run until the next GBT APDU is to be delivered, returning None, or
+        the transfer has ended, returning the outcome.
+        '''
+        while True:
+            self.Drain()
+            if self.IsDone():
+                return self.GetOutcome()
+            if self.aInFlight:
+                if self.aInFlight[0][1].evtType == GBT.EVT_PEER_MSG:
+                    return None
+                # Aborts are not subject to loss
+                oDest, event = self.aInFlight.pop(0)
+                oDest.HandleEvent(event)
+                continue
+            aRunning = [oThread for oThread in self.aThreads if oThread.oTimer is not None]
+            if not aRunning:
+                return EX_DEADLOCK
+            min(aRunning, key=lambda oThread: oThread.oTimer.iSeq).oTimer.fn()
+
+    def Deliver(self, bDrop):
+        '''Deliver or drop the next GBT APDU, then settle.'''
+        oDest, event = self.aInFlight.pop(0)
+        self.bDrop = bDrop
+        oDest.HandleEvent(event)
+        self.bDrop = False
+        self.sStatus = self.Settle()
+
+    def Save(self):
+        aThreads = []
+        for oThread in self.aThreads:
+            aThreads.append((copy.copy(oThread.oGBTStateVars), dict(oThread.dSQ), dict(oThread.dRQ),
+                             copy.copy(oThread.oWatchdog), oThread.oDoneEvent.is_set(),
+                             tuple(getattr(oThread, sAttr) for sAttr in EX_ATTRS)))
+        return tuple(aThreads), tuple(self.aInFlight), self.sStatus
+
+    def Restore(self, tSaved):
+        aThreads, aInFlight, self.sStatus = tSaved
+        for oThread, (sv, dSQ, dRQ, oWatchdog, bDone, tAttrs) in zip(self.aThreads, aThreads):
+            oThread.oGBTStateVars = copy.copy(sv)
+            oThread.dSQ = dict(dSQ)
+            oThread.dRQ = dict(dRQ)
+            oThread.oWatchdog = copy.copy(oWatchdog)
+            if bDone:
+                oThread.oDoneEvent.set()
+            else:
+                oThread.oDoneEvent.clear()
+            for sAttr, x in zip(EX_ATTRS, tAttrs):
+                setattr(oThread, sAttr, x)
+        self.aInFlight = list(aInFlight)
+
+    def GetKey(self, iDropsLeft):
+        '''
+        Digest of the canonical key of the state of both threads, the APDUs
+        in flight and the drops left. The key itself, with SQ and RQ, is
+        large, so only its digest is remembered.
+        '''
+        aKey = [iDropsLeft]
+        for oThread in self.aThreads:
+            sv = oThread.oGBTStateVars
+            oWatchdog = oThread.oWatchdog
+            aKey.append((oThread.bGBTProcessing, oThread.oDoneEvent.is_set(), oThread.oTimer is not None,
+                         sv.BNAself, sv.STRself, sv.Wself, sv.BNApeer, sv.STRpeer, sv.Wpeer, sv.NextBN,
+                         tuple((bn, blk.LB, blk.BD is None) for bn, blk in oThread.dSQ.items()),
+                         tuple((bn, blk.LB, blk.BD is None) for bn, blk in oThread.dRQ.items()),
+                         oThread.tSR, oThread.tPeerSR, oThread.rxData is None, oThread.sAbortReason,
+                         oThread.iAckedBlocks, oThread.iRxBlocks, oThread.bnPeerLast,
+                         oWatchdog.tProgress, oWatchdog.iStalls, oWatchdog.tWindow, oWatchdog.iRepeats,
+                         oWatchdog.iTimeoutStreak, oWatchdog.sReason))
+        for oDest, event in self.aInFlight:
+            apdu = event.data
+            if event.evtType == GBT.EVT_PEER_MSG:
+                aKey.append((oDest.bIsClient, apdu.LB, apdu.STR, apdu.W, apdu.BN, apdu.BNA, apdu.BD is None, apdu.SR))
+            else:
+                aKey.append((oDest.bIsClient, event.evtType, event.data))
+        return hashlib.blake2b(repr(aKey).encode(), digest_size=EX_DIGEST_SIZE).digest()
+
+    def GetCosts(self):
+        return (self.oClient.iTxCnt + self.oServer.iTxCnt, self.oSender.iSAScnt,
+                self.oClient.iTimeoutCnt + self.oServer.iTimeoutCnt)
+
+    def Visit(self, iDropsLeft, iDepth):
+        '''Explore from the current state, which has settled.'''
+        if self.sStatus is not None:
+            return cResult.Terminal(self.sStatus)
+        if iDepth >= self.iMaxDeliveries:
+            return cResult.Terminal(EX_BOUND)
+        tKey = self.GetKey(iDropsLeft)
+        oResult = self.dMemo.get(tKey)
+        if oResult is not None:
+            self.iMemoHits += 1
+            self.dMemo.move_to_end(tKey)
+            return oResult
+        if tKey in self.sStack:
+            return cResult.Terminal(EX_LIVELOCK)
+        self.iStates += 1
+        self.sStack.add(tKey)
+        tSaved = self.Save() if iDropsLeft > 0 else None
+        oResult = None
+        for bDrop in (False, True)[:1 + (iDropsLeft > 0)]:
+            if bDrop:
+                self.Restore(tSaved)
+            tBefore = self.GetCosts()
+            self.Deliver(bDrop)
+            tCosts = tuple(b - a for a, b in zip(tBefore, self.GetCosts()))
+            oChild = self.Visit(iDropsLeft - bDrop, iDepth + 1).Shift(tCosts, bDrop)
+            oResult = oChild if oResult is None else oResult.Merge(oChild)
+        self.sStack.discard(tKey)
+        self.dMemo[tKey] = oResult
+        if len(self.dMemo) > self.iMaxMemo:
+            self.dMemo.popitem(last=False)
+            self.iEvictions += 1
+        return oResult
+
+    def Explore(self):
+        '''Explore every drop pattern. Returns a cResult.'''
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * self.iMaxDeliveries + 1000))
+        self.Restore(self.tRoot)
+        oResult = self.Visit(self.iMaxDrops, 0)
+        return cResult(tuple(x + iCost for x, iCost in zip(oResult.tWorst, self.tRootCosts)), oResult.dOutcomes)
+
+    def FindWorst(self, iMetric):
+        '''
+        A drop pattern giving the worst value of EX_METRICS[iMetric], found
+        after Explore() by following, from the root, the choice whose
+        result is the worst. Results are taken from the memo, or explored
+        again if evicted.
+        '''
+        self.Restore(self.tRoot)
+        iDropsLeft = self.iMaxDrops
+        aDrops = []
+        iDepth = 0
+        while (self.sStatus is None) and (iDepth < self.iMaxDeliveries):
+            tSaved = self.Save()
+            aChoices = []
+            for bDrop in (False, True)[:1 + (iDropsLeft > 0)]:
+                self.Restore(tSaved)
+                iBefore = self.GetCosts()[iMetric]
+                self.Deliver(bDrop)
+                iCost = self.GetCosts()[iMetric] - iBefore
+                tChild = self.Save()
+                aChoices.append((self.Visit(iDropsLeft - bDrop, iDepth + 1).tWorst[iMetric] + iCost, bDrop, tChild))
+            # Delivering is preferred on a tie, as it is first
+            _, bDrop, tChild = max(aChoices, key=lambda tChoice: tChoice[0])
+            self.Restore(tChild)
+            if bDrop:
+                aDrops.append(iDepth)
+                iDropsLeft -= 1
+            iDepth += 1
+        return tuple(aDrops)
+
+    def Replay(self, tDrops):
+        '''
+        Replay a drop pattern. Returns the outcome, the costs and the drop
+        lists of the client and the server, i.e. the ordinal of each dropped
+        GBT APDU among those received over the transfer by the receiving side.
+        '''
+        self.Restore(self.tRoot)
+        self.aDropped = []
+        iDelivery = 0
+        while (self.sStatus is None) and (iDelivery < self.iMaxDeliveries):
+            self.Deliver(iDelivery in tDrops)
+            iDelivery += 1
+        aDropped, self.aDropped = self.aDropped, None
+        return (self.sStatus or EX_BOUND, self.GetCosts(), [i for bIsClient, i in aDropped if bIsClient],
+                [i for bIsClient, i in aDropped if not bIsClient])
+
+###############################################################################
+# Function : VerifyDrops
+#
+# Run a drop pattern through the simulation engine
+###############################################################################
+
+def VerifyDrops(oConfig, payload, sDirection, aCltDrops, aSvrDrops):
+    '''Returns the GBT APDUs and rounds of the transfer in GBTSimEngine, on a link with no delay.'''
+    oConfig = oConfig._replace(aCltDropMsgs=(), aSvrDropMsgs=(),
+                               oCltLoss=GBTLoss.cContinuousLoss(GBTLoss.cDropListLoss(aCltDrops)),
+                               oSvrLoss=GBTLoss.cContinuousLoss(GBTLoss.cDropListLoss(aSvrDrops)))
+    d = GBTSimEngine.RunTransfer(oConfig, payload, sDirection, GBTSimEngine.cLinkModel(), fMaxTime=1e9)
+    return d['iApdus'], d['iRounds']
+
+###############################################################################
+# Function : GBTExplorerMain
+#
+# Main function
+###############################################################################
+
+def GBTExplorerMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Explore every pattern of up to k dropped GBT APDUs in a transfer.")
+    oParser.add_argument("--payload", type=int, default=200, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="request")
+    oParser.add_argument("-b", "--block-size", type=int, default=GBT.GBT_MAX_PAYLOAD, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--clt-btw", type=int, default=GBT.GBT_CLT_BTW, help="client BTW")
+    oParser.add_argument("--svr-btw", type=int, default=GBT.GBT_SVR_BTW, help="server BTW")
+    oParser.add_argument("--multi-gap", action="store_true", help="enable NON-STANDARD multi-gap recovery")
+    oParser.add_argument("-k", "--drops", type=int, default=2, help="most GBT APDUs dropped")
+    oParser.add_argument("--max-deliveries", type=int, default=500, help="bound on GBT APDUs delivered per pattern")
+    oParser.add_argument("--max-memo", type=int, default=EX_MAX_MEMO,
+                         help="most explored states remembered, least recently used evicted first")
+    oParser.add_argument("--verify", action="store_true",
+                         help="check the example patterns in the simulation engine")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.clt_btw,
+                                              SvrBTW=oArgs.svr_btw, bMultiGap=oArgs.multi_gap)
+    payload = 'x' * oArgs.payload
+    t = time.perf_counter()
+    oExplorer = cExplorer(oConfig, payload, oArgs.direction, oArgs.drops, oArgs.max_deliveries, oArgs.max_memo)
+    oResult = oExplorer.Explore()
+    t = time.perf_counter() - t
+    print("Payload %d bytes %s, block %d, client BTW %d, server BTW %d, up to %d drops" %
+          (oArgs.payload, oArgs.direction, oArgs.block_size, oArgs.clt_btw, oArgs.svr_btw, oArgs.drops))
+    print("%d states explored, %d revisits pruned, %d results evicted, %.1f s" %
+          (oExplorer.iStates, oExplorer.iMemoHits, oExplorer.iEvictions, t))
+
+    aExamples = []
+    print("%-50s %12s  %s" % ("Outcome", "patterns", "example drops (client; server)"))
+    for sOutcome, (iCount, tDrops) in sorted(oResult.dOutcomes.items(), key=lambda item: -item[1][0]):
+        aExamples.append(("outcome " + sOutcome, tDrops))
+        _, _, aClt, aSvr = oExplorer.Replay(tDrops)
+        print("%-50s %12d  %s; %s" % (sOutcome, iCount, aClt, aSvr))
+    print("%-50s %12s  %s" % ("Worst case", "", "drops (client; server)"))
+    for iMetric, (sMetric, x) in enumerate(zip(EX_METRICS, oResult.tWorst)):
+        tDrops = oExplorer.FindWorst(iMetric)
+        aExamples.append(("worst " + sMetric, tDrops))
+        sOutcome, _, aClt, aSvr = oExplorer.Replay(tDrops)
+        print("%-50s %12d  %s; %s (%s)" % (sMetric, x, aClt, aSvr, sOutcome))
+
+    if oArgs.verify:
+        for sName, tDrops in aExamples:
+            sOutcome, tCosts, aClt, aSvr = oExplorer.Replay(tDrops)
+            if sOutcome in (EX_DEADLOCK, EX_LIVELOCK, EX_BOUND):
+                continue # Would run until the time limit
+            iApdus, iRounds = VerifyDrops(oConfig, payload, oArgs.direction, aClt, aSvr)
+            print("Verify %-40s APDUs %d/%d, rounds %d/%d %s" %
+                  (sName, tCosts[0], iApdus, tCosts[1], iRounds,
+                   ("MISMATCH", "ok")[(iApdus, iRounds) == tCosts[:2]]))
+
+if __name__ == '__main__':
+    GBTExplorerMain()
@@ -0,0 +1,299 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Lower layer framing of GBT APDUs: HDLC or wrapper
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# GBT APDUs are not sent on the link as they are: each is encoded (GBTWire)
+# and carried in frames of a lower layer, with its own overhead, window and
+# loss recovery:
+# - HDLC (IEC 62056-46): the APDU, after the LLC header, is segmented into
+#   I-frames with at most iMaxInfo bytes of information field. The sender
+#   sends up to the HDLC window of I-frames, the last with the poll bit,
+#   and waits for an RR. Lost I-frames are resent from the first one lost
+#   (go-back-N); if the poll frame or the RR is lost, the sender waits for
+#   its timeout.
+# - Wrapper over TCP (IEC 62056-47): the APDU, after the wrapper header, is
+#   segmented into TCP segments of at most the MSS, each with IP and TCP
+#   headers, acknowledged once per window, with the same recovery.
+# - Wrapper over UDP: the APDU, after the wrapper header, is sent in one
+#   datagram, fragmented by IP to the MTU. There are no acknowledgements:
+#   if a fragment is lost, so is the APDU, and GBT must recover it.
+# Each frame is lost independently with probability fLoss. An APDU whose
+# frames are still lost after iMaxRetries resends is lost as a whole.
+#
+# cFramedPort stands in for GBTSimEngine.cSimPort. An APDU occupies the link
+# until the acknowledgement of its last window, then the next one starts.
+# Acknowledgements are counted in the wire bytes but do not hold up the
+# link in the other direction.
+
+import argparse
+import functools
+import random
+from typing import NamedTuple
+import GBT
+import GBTSimEngine
+import GBTWire
+
+# Lower layers
+LL_HDLC = "hdlc"
+LL_TCP = "wrapper-tcp"
+LL_UDP = "wrapper-udp"
+LL_KINDS = (LL_HDLC, LL_TCP, LL_UDP)
+
+###############################################################################
+# Class : cLowerLayer
+#
+# Lower layer framing parameters
+###############################################################################
+
+class cLowerLayer(NamedTuple):
+    '''
+    Framing below GBT. Create with HdlcLayer() or WrapperLayer() for the
+    overheads of each.
+    '''
+    sKind: str = LL_HDLC
+    iMaxInfo: int = 128 # Most APDU bytes in a frame
+    iWindow: int = 1 # Frames sent before an acknowledgement. 0 = not acknowledged
+    iFrameOverhead: int = 14 # Bytes added to each frame
+    iFirstOverhead: int = 3 # Bytes added to the APDU before it is segmented
+    iAckSize: int = 12 # Bytes in an acknowledgement
+    fLoss: float = 0.0 # Frame loss probability
+    fTimeout: float = 1.0 # Seconds to wait for a lost acknowledgement
+    iMaxRetries: int = 3 # Resends without progress before the APDU is lost
+
+    def Segment(self, iApduBytes):
+        '''Sizes of the frames which carry an APDU of iApduBytes.'''
+        iBytes = iApduBytes + self.iFirstOverhead
+        aFrames = [self.iMaxInfo + self.iFrameOverhead] * (iBytes // self.iMaxInfo)
+        if iBytes % self.iMaxInfo:
+            aFrames.append(iBytes % self.iMaxInfo + self.iFrameOverhead)
+        return aFrames
+
+###############################################################################
+# Function : HdlcLayer
+#
+# HDLC framing parameters
+###############################################################################
+
+def HdlcLayer(iMaxInfo=128, iWindow=1, fLoss=0.0, fTimeout=1.0, iMaxRetries=3, iServerAddr=4):
+    '''
+    Each I-frame has two flags, the frame format (2), the server address
+    (iServerAddr bytes), the client address (1), the control field and the
+    HCS and FCS (2 each). The LLC header (3) comes before the APDU. An RR
+    has no HCS or information field.
+    '''
+    iAddr = iServerAddr + 1
+    return cLowerLayer(LL_HDLC, iMaxInfo, iWindow, 9 + iAddr, 3, 7 + iAddr, fLoss, fTimeout, iMaxRetries)
+
+###############################################################################
+# Function : WrapperLayer
+#
+# Wrapper framing parameters
+###############################################################################
+
+def WrapperLayer(iMtu=1500, bTcp=True, iWindow=10, fLoss=0.0, fTimeout=1.0, iMaxRetries=3):
+    '''
+    The wrapper header (8) comes before the APDU. Over TCP each segment has
+    IPv4 and TCP headers (40) and at most iMtu - 40 bytes; an acknowledgement
+    is a segment with no data. Over UDP each IPv4 fragment has an IP header
+    (20, and 8 more for UDP counted once with the wrapper header).
+    '''
+    if bTcp:
+        return cLowerLayer(LL_TCP, iMtu - 40, iWindow, 40, 8, 40, fLoss, fTimeout, iMaxRetries)
+    return cLowerLayer(LL_UDP, (iMtu - 20) // 8 * 8, 0, 20, 16, 0, fLoss, fTimeout, 0)
+
+###############################################################################
+# Class : cFramedPort
+#
+# Stands in for the peer thread, delivering GBT APDUs in lower layer frames
+###############################################################################
+
+class cFramedPort(GBTSimEngine.cSimPort):
+    '''
+    Port of GBTSimEngine which carries each GBT APDU in the frames of
+    oLower over oLink. iTxBytes counts every byte on the wire in this
+    direction, acknowledgements included.
+    '''
+    def __init__(self, oEngine, oDest, oLink, oLower=cLowerLayer(), iSeed=0):
+        GBTSimEngine.cSimPort.__init__(self, oEngine, oDest, oLink)
+        self.oLower = oLower
+        self.oRandom = random.Random(2 * iSeed + oDest.bIsClient)
+        self.iApduBytes = 0 # Encoded GBT APDUs
+        self.iFrames = 0
+        self.iResent = 0 # Frames sent again
+        self.iAcks = 0
+        self.iLostApdus = 0 # Lost by the lower layer
+
+    def IsLost(self):
+        return (self.oLower.fLoss > 0.0) and (self.oRandom.random() < self.oLower.fLoss)
+
+    def SendEvent(self, event):
+        if event.evtType != GBT.EVT_PEER_MSG:
+            # Aborts are not framed
+            return GBTSimEngine.cSimPort.SendEvent(self, event)
+        oLower, oLink = self.oLower, self.oLink
+        iApduBytes = len(GBTWire.EncodeApdu(event.data))
+        self.iApduBytes += iApduBytes
+        aFrames = oLower.Segment(iApduBytes)
+        fTime = max(self.oEngine.fNow, self.fBusyUntil)
+        i = 0 # First frame not acknowledged
+        iRetries = 0
+        fDelivered = None
+        iSent = 0 # Frames sent at least once
+        while i < len(aFrames):
+            iWindow = oLower.iWindow or len(aFrames)
+            aWindow = aFrames[i:i + iWindow]
+            iFirstLost = None
+            for j, iSize in enumerate(aWindow):
+                fTime += oLink.GetTxTime(iSize)
+                self.iTxBytes += iSize
+                self.iFrames += 1
+                if i + j < iSent:
+                    self.iResent += 1
+                if self.IsLost() and iFirstLost is None:
+                    iFirstLost = j
+            iSent = max(iSent, i + len(aWindow))
+            if oLower.iWindow == 0:
+                # Not acknowledged, any fragment lost loses the APDU
+                if iFirstLost is None:
+                    fDelivered = fTime + oLink.fLatency
+                break
+            if (iFirstLost is None) and (i + len(aWindow) == len(aFrames)):
+                fDelivered = fTime + oLink.fLatency
+            # The acknowledgement, unless the poll frame was lost
+            bAcked = iFirstLost != len(aWindow) - 1
+            if bAcked:
+                self.iTxBytes += oLower.iAckSize
+                self.iAcks += 1
+                bAcked = not self.IsLost()
+            if bAcked:
+                fTime += oLink.fLatency + oLink.GetTxTime(oLower.iAckSize) + oLink.fLatency
+                iDone = len(aWindow) if iFirstLost is None else iFirstLost
+            else:
+                # Frames already received are acknowledged when the sender polls again
+                fTime += oLower.fTimeout
+                iDone = len(aWindow) - 1 if iFirstLost is None else iFirstLost
+            i += iDone
+            iRetries = 0 if iDone > 0 else iRetries + 1
+            if iRetries > oLower.iMaxRetries:
+                break
+        self.fBusyUntil = fTime
+        if fDelivered is None:
+            self.iLostApdus += 1
+            return
+        self.oEngine.Schedule(fDelivered - self.oEngine.fNow, self.oDest.HandleEvent, event)
+
+###############################################################################
+# Function : RunFramed
+#
+# Run a transfer over a lower layer and return statistics
+###############################################################################
+
+def RunFramed(oConfig, payload, sDirection, oLink, oLower, iSeed=0, fMaxTime=3600.0):
+    '''
+    GBTSimEngine.RunTransfer() over oLower. iBytes in the result is the
+    wire bytes in both directions; iApduBytes the encoded GBT APDUs.
+    '''
+    d = GBTSimEngine.RunTransfer(oConfig, payload, sDirection, oLink, fMaxTime,
+                                 fnPort=functools.partial(cFramedPort, oLower=oLower, iSeed=iSeed))
+    aPorts = (d['oClient'].oPeerThread, d['oServer'].oPeerThread)
+    for sKey in ('iApduBytes', 'iFrames', 'iResent', 'iLostApdus'):
+        d[sKey] = sum(getattr(oPort, sKey) for oPort in aPorts)
+    return d
+
+###############################################################################
+# Function : ParseList
+#
+# Parse a comma separated list of integers
+###############################################################################
+
+def ParseList(sList):
+    return [int(s) for s in sList.split(',') if s.strip() != '']
+
+###############################################################################
+# Function : GBTFramingMain
+#
+# Main function
+###############################################################################
+
+def GBTFramingMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Find the best GBT block size for each lower layer MTU.")
+    oParser.add_argument("--layer", choices=LL_KINDS, default=LL_HDLC)
+    oParser.add_argument("--mtu", type=ParseList, default=[64, 128, 256, 512],
+                         help="comma separated HDLC max info field sizes, or IP MTUs for the wrapper")
+    oParser.add_argument("--ll-window", type=int, default=1, help="HDLC window, or TCP segments per acknowledgement")
+    oParser.add_argument("--frame-loss", type=float, default=0.0, help="frame loss probability")
+    oParser.add_argument("--ll-timeout", type=float, default=1.0, help="lower layer timeout in seconds")
+    oParser.add_argument("--block-sizes", type=ParseList, default=[16, 32, 64, 100, 128, 200, 256, 500, 1000],
+                         help="comma separated GBT_MAX_PAYLOAD values")
+    oParser.add_argument("--payload", type=int, default=4000, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="response")
+    oParser.add_argument("--window", type=int, default=6, help="GBT BTW of both sides")
+    oParser.add_argument("--latency", type=float, default=0.05, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("--timeout", type=float, default=30.0, help="GBT timeout in seconds")
+    oParser.add_argument("--runs", type=int, default=5, help="runs per point")
+    oArgs = oParser.parse_args(aArgs)
+
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    payload = 'x' * oArgs.payload
+    print("%s, payload %d bytes %s, GBT window %d, latency %.3f s, %.0f bit/s, frame loss %.3f, %d runs" %
+          (oArgs.layer, oArgs.payload, oArgs.direction, oArgs.window, oArgs.latency, oArgs.bit_rate,
+           oArgs.frame_loss, oArgs.runs))
+    print("%6s %6s | %8s | %10s | %10s | %6s | %6s" %
+          ("MTU", "block", "time (s)", "wire bytes", "APDU bytes", "frames", "resent"))
+    aBest = []
+    for iMtu in oArgs.mtu:
+        if oArgs.layer == LL_HDLC:
+            oLower = HdlcLayer(iMtu, oArgs.ll_window, oArgs.frame_loss, oArgs.ll_timeout)
+        else:
+            oLower = WrapperLayer(iMtu, oArgs.layer == LL_TCP, oArgs.ll_window, oArgs.frame_loss, oArgs.ll_timeout)
+        tBest = None
+        for iBlock in oArgs.block_sizes:
+            oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=iBlock, CltBTW=oArgs.window, SvrBTW=oArgs.window,
+                                                      aCltDropMsgs=(), aSvrDropMsgs=(),
+                                                      tTimeouts=(oArgs.timeout, oArgs.timeout))
+            aRuns = [RunFramed(oConfig, payload, oArgs.direction, oLink, oLower, iRun) for iRun in range(oArgs.runs)]
+            aDone = [d for d in aRuns if d['bComplete'] and d['bVerified']]
+            if not aDone:
+                print("%6d %6d | no run completed" % (iMtu, iBlock))
+                continue
+            iDone = float(len(aDone))
+            tRow = (sum(d['fRxTime'] for d in aDone) / iDone, sum(d['iBytes'] for d in aDone) / iDone,
+                    sum(d['iApduBytes'] for d in aDone) / iDone, sum(d['iFrames'] for d in aDone) / iDone,
+                    sum(d['iResent'] for d in aDone) / iDone)
+            print("%6d %6d | %8.2f | %10.0f | %10.0f | %6.0f | %6.0f" % ((iMtu, iBlock) + tRow))
+            if (tBest is None) or (tRow[0] < tBest[1][0]):
+                tBest = (iBlock, tRow)
+        if tBest is not None:
+            aBest.append((iMtu, tBest))
+    print("Best block size for each MTU:")
+    for iMtu, (iBlock, tRow) in aBest:
+        print("%6d %6d | %8.2f s, %.0f wire bytes, %.3f wire bytes per payload byte" %
+              (iMtu, iBlock, tRow[0], tRow[1], tRow[1] / oArgs.payload))
+
+if __name__ == '__main__':
+    GBTFramingMain()
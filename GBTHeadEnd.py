@@ -0,0 +1,413 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Head-end polling scheduler for many simulated meters
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# The head-end
+# ------------
+# A head-end reads many meters. Each read is an ACCESS.request from the
+# head-end (client) followed by an ACCESS.response from the meter (server),
+# both using GBT, over the link of that meter. Each read attempt runs in its
+# own client and server threads (an association), all in one simulated time
+# engine (GBTSimEngine).
+#
+# Scheduling:
+# - At most iMaxConcurrent reads are in progress, and at most the group
+#   limit for each group of meters (e.g. a pool of modems or a
+#   concentrator).
+# - Reads waiting to start are queued per group. Groups are served by
+#   deficit round robin, with the cost of a read being its payload bytes,
+#   so each group gets a fair share of the bytes read whatever its payload
+#   sizes.
+# - Each read has a deadline relative to its release. A read still queued at
+#   its deadline expires, a read in progress at its deadline is aborted.
+# - An attempt which is aborted, or takes longer than fAttemptTimeout, is
+#   retried up to iRetries times if the deadline has not passed.
+
+import argparse
+import collections
+import random
+import time
+import zlib
+from typing import NamedTuple
+import GBT
+import GBTClientThread
+import GBTLoss
+import GBTServerThread
+import GBTSimEngine
+
+# Results of a read
+READ_OK = "ok"
+READ_FAILED = "failed" # Attempts used up
+READ_MISSED = "missed" # Aborted in progress at the deadline
+READ_EXPIRED = "expired" # Still queued at the deadline
+
+###############################################################################
+# Class : cMeter
+#
+# A simulated meter
+###############################################################################
+
+class cMeter(NamedTuple):
+    sName: str
+    sGroup: str
+    iPayload: int # ACCESS.response size in bytes
+    oLink: GBTSimEngine.cLinkModel = GBTSimEngine.cLinkModel()
+    fLoss: float = 0.0 # Loss probability in each direction
+    fBurst: float = 1.0 # Mean loss burst length
+    fProcessing: float = 0.0 # Time for the meter to prepare its response
+
+###############################################################################
+# Class : cRead
+#
+# A read of a meter and its progress
+###############################################################################
+
+class cRead():
+    def __init__(self, oMeter, fRelease, fDeadline):
+        self.oMeter = oMeter
+        self.fRelease = fRelease
+        self.fDeadline = fDeadline # Absolute time
+        self.fStart = None # Start of first attempt
+        self.fEnd = None
+        self.iAttempts = 0
+        self.sResult = None
+        self.sAbortReason = None
+        # Current attempt
+        self.oClient = None
+        self.oServer = None
+        self.bResponding = False
+        self.aEvents = [] # Timeout and deadline events to cancel when the attempt ends
+
+###############################################################################
+# Function : Percentile
+#
+# Percentile of a sorted list, nearest rank
+###############################################################################
+
+def Percentile(aSorted, fPercent):
+    if not aSorted:
+        return float('nan')
+    i = int(round(fPercent / 100.0 * (len(aSorted) - 1)))
+    return aSorted[i]
+
+###############################################################################
+# Class : cHeadEnd
+#
+# Polling scheduler
+###############################################################################
+
+class cHeadEnd():
+    '''
+    Head-end polling scheduler. Reads are added with AddRead() and run in
+    simulated time by Run(), which returns aggregate statistics.
+    oConfig is the GBT configuration of all associations. Loss is set per
+    meter.
+    '''
+
+    # Constructor
+    def __init__(self, oConfig=None, iMaxConcurrent=16, dGroupLimits=None, fDeadline=3600.0,
+                 fAttemptTimeout=120.0, iRetries=2, iRequest=20, iQuantum=None, bVerbose=False):
+        if oConfig is None:
+            oConfig = GBT.GetDefaultConfig()
+        self.oConfig = oConfig._replace(aCltDropMsgs=(), aSvrDropMsgs=())
+        self.iMaxConcurrent = iMaxConcurrent
+        self.dGroupLimits = dGroupLimits or {}
+        self.fDeadline = fDeadline
+        self.fAttemptTimeout = fAttemptTimeout
+        self.iRetries = iRetries
+        self.request = 'r' * iRequest
+        self.iQuantum = iQuantum
+        self.oEngine = GBTSimEngine.cSimEngine()
+        self.oEngine.fnHandled = self.Handled
+        self.oLogger = GBTSimEngine.cSimLogger(self.oEngine, bVerbose)
+        # Queues and deficit round robin state
+        self.dQueues = {}
+        self.dDeficit = {}
+        self.dActive = {}
+        self.aGroups = []
+        self.iNext = 0
+        self.bVisiting = False
+        self.iActive = 0
+        # Reads
+        self.aReads = []
+        self.dReadByThread = {}
+        self.iPeakActive = 0
+
+    def AddRead(self, oMeter, fRelease=0.0):
+        '''Add a read of a meter, released at fRelease.'''
+        oRead = cRead(oMeter, fRelease, fRelease + self.fDeadline)
+        self.aReads.append(oRead)
+        if oMeter.sGroup not in self.dQueues:
+            self.dQueues[oMeter.sGroup] = collections.deque()
+            self.dDeficit[oMeter.sGroup] = 0
+            self.dActive[oMeter.sGroup] = 0
+            self.aGroups.append(oMeter.sGroup)
+        self.oEngine.Schedule(fRelease, self.Release, oRead)
+        return oRead
+
+    def GetCost(self, oRead):
+        return len(self.request) + oRead.oMeter.iPayload
+
+    def IsEligible(self, sGroup):
+        return len(self.dQueues[sGroup]) > 0 and self.dActive[sGroup] < self.dGroupLimits.get(sGroup, self.iMaxConcurrent)
+
+    def Release(self, oRead):
+        self.dQueues[oRead.oMeter.sGroup].append(oRead)
+        self.Dispatch()
+
+    def Dispatch(self):
+        '''Start queued reads while there is capacity, by deficit round robin over the groups.'''
+        if self.iQuantum is None:
+            self.iQuantum = max(self.GetCost(oRead) for oRead in self.aReads)
+        while self.iActive < self.iMaxConcurrent and any(self.IsEligible(s) for s in self.aGroups):
+            sGroup = self.aGroups[self.iNext]
+            aQueue = self.dQueues[sGroup]
+            if not self.IsEligible(sGroup):
+                if not aQueue:
+                    self.dDeficit[sGroup] = 0
+                self.iNext = (self.iNext + 1) % len(self.aGroups)
+                self.bVisiting = False
+                continue
+            if not self.bVisiting:
+                self.dDeficit[sGroup] += self.iQuantum
+                self.bVisiting = True
+            while self.iActive < self.iMaxConcurrent and self.IsEligible(sGroup) and self.GetCost(aQueue[0]) <= self.dDeficit[sGroup]:
+                oRead = aQueue.popleft()
+                if self.oEngine.fNow >= oRead.fDeadline:
+                    self.SetResult(oRead, READ_EXPIRED)
+                    continue
+                self.dDeficit[sGroup] -= self.GetCost(oRead)
+                self.StartAttempt(oRead)
+            if self.iActive >= self.iMaxConcurrent and self.IsEligible(sGroup) and self.GetCost(aQueue[0]) <= self.dDeficit[sGroup]:
+                # Out of capacity part way through this group's turn
+                return
+            self.iNext = (self.iNext + 1) % len(self.aGroups)
+            self.bVisiting = False
+
+    def StartAttempt(self, oRead):
+        oMeter = oRead.oMeter
+        iSeed = zlib.crc32(oMeter.sName.encode()) + (oRead.iAttempts << 32) # Repeatable loss for each meter and attempt
+        oConfig = self.oConfig._replace(oCltLoss=GBTLoss.CreateLoss(oMeter.fLoss, oMeter.fBurst, 2 * iSeed),
+                                        oSvrLoss=GBTLoss.CreateLoss(oMeter.fLoss, oMeter.fBurst, 2 * iSeed + 1))
+        oRead.oClient = GBTClientThread.cGBTClientThread(oConfig)
+        oRead.oServer = GBTServerThread.cGBTServerThread(oConfig)
+        for oThread in (oRead.oClient, oRead.oServer):
+            self.oEngine.AddEndpoint(oThread, self.oLogger)
+            self.dReadByThread[oThread] = oRead
+        self.oEngine.Connect(oRead.oClient, oRead.oServer, oMeter.oLink)
+        oRead.bResponding = False
+        oRead.iAttempts += 1
+        if oRead.fStart is None:
+            oRead.fStart = self.oEngine.fNow
+        oRead.aEvents = [self.oEngine.Schedule(self.fAttemptTimeout, self.AttemptTimeout, oRead),
+                         self.oEngine.Schedule(oRead.fDeadline - self.oEngine.fNow, self.DeadlineReached, oRead)]
+        self.iActive += 1
+        self.dActive[oMeter.sGroup] += 1
+        self.iPeakActive = max(self.iPeakActive, self.iActive)
+        oRead.oClient.HandleEvent(GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, self.request))
+
+    def EndAttempt(self, oRead):
+        for oEvent in oRead.aEvents:
+            oEvent.bCancelled = True
+        for oThread in (oRead.oClient, oRead.oServer):
+            oThread.StopTimer()
+            self.oEngine.RemoveEndpoint(oThread)
+            del self.dReadByThread[oThread]
+        oRead.oClient = oRead.oServer = None
+        self.iActive -= 1
+        self.dActive[oRead.oMeter.sGroup] -= 1
+
+    def Handled(self, oOwner):
+        '''Called by the engine after each event to follow the progress of reads.'''
+        oRead = self.dReadByThread.get(oOwner)
+        if oRead is None:
+            return
+        oClient, oServer = oRead.oClient, oRead.oServer
+        sAbortReason = oClient.sAbortReason or oServer.sAbortReason
+        if sAbortReason is not None:
+            oRead.sAbortReason = sAbortReason
+            self.AttemptFailed(oRead)
+        elif not oRead.bResponding:
+            # The meter responds once it has the request and the request has been acknowledged
+            if oServer.rxData == self.request and oClient.oDoneEvent.is_set():
+                oRead.bResponding = True
+                oClient.rxData = None
+                self.oEngine.Schedule(oRead.oMeter.fProcessing, oServer.HandleEvent,
+                                      GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, 'x' * oRead.oMeter.iPayload))
+        elif oClient.rxData is not None and len(oClient.rxData) == oRead.oMeter.iPayload:
+            self.EndAttempt(oRead)
+            self.Finish(oRead, READ_OK)
+
+    def AttemptTimeout(self, oRead):
+        oRead.sAbortReason = "attempt timed out"
+        oRead.oClient.AbortGBT(oRead.sAbortReason)
+        self.AttemptFailed(oRead)
+
+    def AttemptFailed(self, oRead):
+        self.EndAttempt(oRead)
+        if oRead.iAttempts <= self.iRetries and self.oEngine.fNow < oRead.fDeadline:
+            # Retry ahead of reads which have not started
+            self.dQueues[oRead.oMeter.sGroup].appendleft(oRead)
+            self.Dispatch()
+        else:
+            self.Finish(oRead, READ_FAILED)
+
+    def DeadlineReached(self, oRead):
+        oRead.sAbortReason = "deadline reached"
+        oRead.oClient.AbortGBT(oRead.sAbortReason)
+        self.EndAttempt(oRead)
+        self.Finish(oRead, READ_MISSED)
+
+    def SetResult(self, oRead, sResult):
+        oRead.sResult = sResult
+        oRead.fEnd = self.oEngine.fNow
+
+    def Finish(self, oRead, sResult):
+        '''Record the result of a read which has ended and start others in its place. Not for use in Dispatch().'''
+        self.SetResult(oRead, sResult)
+        self.Dispatch()
+
+    def Run(self, fMaxTime=float('inf')):
+        '''Run all reads and return statistics.'''
+        self.oEngine.Run(None, fMaxTime)
+        # Anything still queued has expired
+        for oRead in self.aReads:
+            if oRead.sResult is None:
+                oRead.sResult = READ_EXPIRED
+                oRead.fEnd = oRead.fDeadline
+        return self.GetStats()
+
+    def GetStats(self, aReads=None):
+        if aReads is None:
+            aReads = self.aReads
+        aOk = [oRead for oRead in aReads if oRead.sResult == READ_OK]
+        fMakespan = max([oRead.fEnd for oRead in aOk], default=0.0)
+        aQueueing = sorted(oRead.fStart - oRead.fRelease for oRead in aReads if oRead.fStart is not None)
+        aCompletion = sorted(oRead.fEnd - oRead.fRelease for oRead in aOk)
+        dResults = collections.Counter(oRead.sResult for oRead in aReads)
+        return {
+            'iReads': len(aReads),
+            'iOk': dResults[READ_OK],
+            'iFailed': dResults[READ_FAILED],
+            'iMissed': dResults[READ_MISSED],
+            'iExpired': dResults[READ_EXPIRED],
+            'iAttempts': sum(oRead.iAttempts for oRead in aReads),
+            'iPeakActive': self.iPeakActive,
+            'fMakespan': fMakespan,
+            'fReadsPerHour': 3600.0 * len(aOk) / fMakespan if fMakespan > 0.0 else 0.0,
+            'fQueueP50': Percentile(aQueueing, 50),
+            'fQueueP95': Percentile(aQueueing, 95),
+            'fCompletionP50': Percentile(aCompletion, 50),
+            'fCompletionP95': Percentile(aCompletion, 95),
+            'fCompletionP99': Percentile(aCompletion, 99),
+            'fCompletionMax': Percentile(aCompletion, 100),
+        }
+
+###############################################################################
+# Function : CreateMeters
+#
+# Create a population of meters on a few kinds of link
+###############################################################################
+
+# Meter groups: name, share of meters, payload range, latency, bit rate, loss, burst
+HE_GROUPS = (
+    ("plc", 0.5, (200, 2000), 0.3, 2400.0, 0.05, 2.0),
+    ("rf", 0.3, (200, 4000), 0.1, 9600.0, 0.02, 1.0),
+    ("cellular", 0.2, (500, 8000), 0.2, 64000.0, 0.005, 1.0),
+)
+
+def CreateMeters(iMeters, iSeed=0):
+    oRandom = random.Random(iSeed)
+    aMeters = []
+    for sGroup, fShare, (iMin, iMax), fLatency, fBitRate, fLoss, fBurst in HE_GROUPS:
+        for i in range(int(round(iMeters * fShare))):
+            aMeters.append(cMeter("%s%05d" % (sGroup, i), sGroup, oRandom.randint(iMin, iMax),
+                                  GBTSimEngine.cLinkModel(fLatency * oRandom.uniform(0.5, 1.5), fBitRate),
+                                  fLoss, fBurst, oRandom.uniform(0.05, 0.5)))
+    return aMeters
+
+###############################################################################
+# Function : ParseGroupLimits
+#
+# Parse group limits, e.g. plc=4,rf=8
+###############################################################################
+
+def ParseGroupLimits(sLimits):
+    dLimits = {}
+    for sItem in sLimits.split(','):
+        sGroup, sLimit = sItem.split('=')
+        dLimits[sGroup.strip()] = int(sLimit)
+    return dLimits
+
+###############################################################################
+# Function : GBTHeadEndMain
+#
+# Main function
+###############################################################################
+
+def GBTHeadEndMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Poll many simulated meters from one head-end and report "
+                                      "throughput and latency as concurrency scales.")
+    oParser.add_argument("-n", "--meters", type=int, default=500, help="number of meters")
+    oParser.add_argument("-c", "--concurrency", default="1,4,16,64", help="comma separated concurrency limits to run")
+    oParser.add_argument("--group-limits", type=ParseGroupLimits, default=None, help="per group limits, e.g. plc=8,rf=16")
+    oParser.add_argument("--deadline", type=float, default=3600.0, help="deadline of each read in seconds")
+    oParser.add_argument("--attempt-timeout", type=float, default=120.0, help="time allowed for each attempt in seconds")
+    oParser.add_argument("--retries", type=int, default=2, help="retries of a failed attempt")
+    oParser.add_argument("-b", "--block-size", type=int, default=128, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--btw", type=int, default=16, help="client and server BTW")
+    oParser.add_argument("--timeout", type=float, default=5.0, help="GBT timeout in seconds")
+    oParser.add_argument("-s", "--seed", type=int, default=0, help="seed for the meter population")
+    oArgs = oParser.parse_args(aArgs)
+
+    aMeters = CreateMeters(oArgs.meters, oArgs.seed)
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.btw, SvrBTW=oArgs.btw,
+                                              tTimeouts=(oArgs.timeout, oArgs.timeout))
+    print("%d meters: %s" % (len(aMeters), ", ".join("%d %s" % (n, s) for s, n in
+                                                       collections.Counter(o.sGroup for o in aMeters).items())))
+    print("%5s %6s %6s %6s %6s %8s %8s | %8s %8s | %8s %8s %8s %8s | %7s" %
+          ("conc", "ok", "fail", "miss", "exp", "makespan", "reads/h", "queue50", "queue95",
+           "compl50", "compl95", "compl99", "max", "run (s)"))
+    for sConcurrency in oArgs.concurrency.split(','):
+        oHeadEnd = cHeadEnd(oConfig, int(sConcurrency), oArgs.group_limits, oArgs.deadline,
+                            oArgs.attempt_timeout, oArgs.retries)
+        for oMeter in aMeters:
+            oHeadEnd.AddRead(oMeter)
+        t = time.perf_counter()
+        d = oHeadEnd.Run()
+        t = time.perf_counter() - t
+        print("%5s %6d %6d %6d %6d %8.0f %8.0f | %8.1f %8.1f | %8.1f %8.1f %8.1f %8.1f | %7.2f" %
+              (sConcurrency, d['iOk'], d['iFailed'], d['iMissed'], d['iExpired'], d['fMakespan'], d['fReadsPerHour'],
+               d['fQueueP50'], d['fQueueP95'], d['fCompletionP50'], d['fCompletionP95'], d['fCompletionP99'],
+               d['fCompletionMax'], t))
+        for sGroup in oHeadEnd.aGroups:
+            dGroup = oHeadEnd.GetStats([o for o in oHeadEnd.aReads if o.oMeter.sGroup == sGroup])
+            print("%5s   %-8s ok %5d of %5d, completion p50 %8.1f p95 %8.1f" %
+                  ("", sGroup, dGroup['iOk'], dGroup['iReads'], dGroup['fCompletionP50'], dGroup['fCompletionP95']))
+
+if __name__ == '__main__':
+    GBTHeadEndMain()
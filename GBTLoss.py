@@ -0,0 +1,202 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Simulated message loss models
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+import random
+import threading
+
+# Mask for 64 bit arithmetic
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+###############################################################################
+# Function : SplitMix64
+#
+# Hash a 64 bit value. Used to derive a repeatable pseudo random value
+# from a seed and a message sequence number.
+###############################################################################
+
+def SplitMix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+###############################################################################
+# Class : cDropListLoss
+#
+# Drop messages by sequence number
+###############################################################################
+
+class cDropListLoss():
+    '''
+    Drop list loss model. Drops the messages whose sequence numbers
+    (0 = first, 1 = second etc.) are in the list. This is the same
+    behaviour as aCltDropMsgs and aSvrDropMsgs in GBT.py.
+    '''
+    def __init__(self, aDropMsgs):
+        self.sDropMsgs = frozenset(aDropMsgs)
+
+    def IsDropped(self, iMsg):
+        return iMsg in self.sDropMsgs
+
+    def __repr__(self):
+        return "cDropListLoss(%s)" % sorted(self.sDropMsgs)
+
+###############################################################################
+# Class : cBernoulliLoss
+#
+# Independent random loss
+###############################################################################
+
+class cBernoulliLoss():
+    '''
+    Bernoulli loss model. Each message is dropped independently with
+    probability fLoss. Whether a message is dropped is a pure function of
+    the seed and the message sequence number, so the same seed always
+    gives the same loss pattern.
+    '''
+    def __init__(self, fLoss, iSeed=0):
+        self.fLoss = fLoss
+        self.iSeed = iSeed
+        # Compare against a 64 bit threshold rather than converting to float
+        self.iThreshold = int(fLoss * (1 << 64))
+
+    def IsDropped(self, iMsg):
+        return SplitMix64((self.iSeed << 32) ^ iMsg) < self.iThreshold
+
+    def __repr__(self):
+        return "cBernoulliLoss(%g, %d)" % (self.fLoss, self.iSeed)
+
+###############################################################################
+# Class : cGilbertElliottLoss
+#
+# Bursty loss using two state Markov chain
+###############################################################################
+
+class cGilbertElliottLoss():
+    '''
+    Gilbert-Elliott loss model. A two state (Good, Bad) Markov chain moves
+    from Good to Bad with probability fP and from Bad to Good with
+    probability fR on each message. Messages are lost with probability
+    fLossGood in the Good state and fLossBad in the Bad state.
+    The mean burst length is 1/fR.
+
+    The chain is generated on demand from the seed and remembered, so
+    whether a message is dropped is a function of the seed and the message
+    sequence number only.
+    '''
+    def __init__(self, fP, fR, fLossGood=0.0, fLossBad=1.0, iSeed=0):
+        self.fP = fP
+        self.fR = fR
+        self.fLossGood = fLossGood
+        self.fLossBad = fLossBad
+        self.iSeed = iSeed
+        self.oRandom = random.Random(iSeed)
+        self.bBad = False
+        self.baDropped = bytearray()
+        self.oLock = threading.Lock()
+
+    @classmethod
+    def FromMeanLoss(cls, fLoss, fBurst, iSeed=0):
+        '''Create from an average loss rate and a mean burst length.'''
+        fR = 1.0 / fBurst
+        # Steady state P(Bad) = p / (p + r) = fLoss
+        fP = fLoss * fR / (1.0 - fLoss)
+        return cls(min(fP, 1.0), fR, 0.0, 1.0, iSeed)
+
+    def IsDropped(self, iMsg):
+        if iMsg >= len(self.baDropped):
+            with self.oLock:
+                while iMsg >= len(self.baDropped):
+                    if self.bBad:
+                        self.bBad = self.oRandom.random() >= self.fR
+                    else:
+                        self.bBad = self.oRandom.random() < self.fP
+                    fLoss = (self.fLossGood, self.fLossBad)[self.bBad]
+                    self.baDropped.append(self.oRandom.random() < fLoss)
+        return self.baDropped[iMsg] == 1
+
+    def __repr__(self):
+        return "cGilbertElliottLoss(%g, %g, %g, %g, %d)" % (self.fP, self.fR, self.fLossGood, self.fLossBad, self.iSeed)
+
+###############################################################################
+# Class : cContinuousLoss
+#
+# Number messages over a whole run rather than from each stream
+###############################################################################
+
+class cContinuousLoss():
+    '''
+    Wraps a loss model so that messages are numbered from the first one
+    received by the session, rather than from the start of each stream as
+    the msgCount passed in, which restarts at each StartGBT(). A transfer
+    restarted or resumed then meets new losses instead of replaying those
+    at its start. Counts the calls, so needs a new instance for each run.
+    '''
+    def __init__(self, oLoss):
+        self.oLoss = oLoss
+        self.iCount = 0
+
+    def IsDropped(self, iMsg):
+        bDropped = self.oLoss.IsDropped(self.iCount)
+        self.iCount += 1
+        return bDropped
+
+    def __repr__(self):
+        return "cContinuousLoss(%r)" % self.oLoss
+
+###############################################################################
+# Function : CreateLoss
+#
+# Create a random loss model from an average loss rate and burst length
+###############################################################################
+
+def CreateLoss(fLoss, fBurst=1.0, iSeed=0):
+    '''
+    Returns None for no loss, a Bernoulli model for a mean burst length of 1
+    or less and a Gilbert-Elliott model for longer bursts.
+    '''
+    if fLoss <= 0.0:
+        return None
+    if fBurst > 1.0:
+        return cGilbertElliottLoss.FromMeanLoss(fLoss, fBurst, iSeed)
+    return cBernoulliLoss(fLoss, iSeed)
+
+###############################################################################
+# Function : GBTLossMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTLossMain():
+    iCount = 100000
+    for oLoss in (cBernoulliLoss(0.1, 1), cGilbertElliottLoss.FromMeanLoss(0.1, 4.0, 1)):
+        iDropped = sum(oLoss.IsDropped(i) for i in range(iCount))
+        print("%s: %f" % (oLoss, iDropped / iCount))
+
+if __name__ == '__main__':
+    GBTLossMain()
@@ -0,0 +1,355 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Analytical model of confirmed GBT transfer time
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# The model
+# ---------
+# A confirmed GBT transfer of N blocks is sent in windows of W blocks, where
+# W is the BTW of the receiver. Each window, and each gap recovered by
+# CheckRQandFillGaps, is a "round" of g blocks:
+#
+# - The sender sends the g blocks. Each is lost independently with
+#   probability p. If the last block (STR = 0) is lost, or the receiver's
+#   acknowledgement is lost (probability pa), the sender times out and
+#   resends the round. Blocks received in an earlier attempt are kept in RQ,
+#   so after k attempts a block is missing with probability p^k.
+# - Once the acknowledgement is received, CheckRQandFillGaps recovers the
+#   gaps one at a time, first gap first. Each gap of h missing blocks among
+#   the first g - 1 blocks is itself a round of h blocks.
+#
+# The rounds form a Markov chain whose state is the size of the round being
+# sent, 1..W, with the gaps left by a round as its successors. Every round
+# only leads to smaller rounds, so the expected total cost m of a round of
+# each size satisfies m = c + A m, where A[g, h] is the expected number of
+# gaps of size h left by a round of size g and c is the expected cost of
+# the round itself. The variances satisfy V = b + A V in the same way.
+# Both are solved with numpy.linalg.solve, batched over a whole grid of
+# parameters. Windows are independent, so a transfer of n full windows and
+# a residual window of r blocks costs n * m[W] + m[r], and similarly for V.
+#
+# The cost can be time, GBT APDUs sent or rounds sent.
+
+import math
+import numpy as np
+import GBTSimEngine
+
+# Largest number of attempts of a round considered
+MODEL_MAX_ATTEMPTS = 200
+
+# Probability of more attempts than this is ignored
+MODEL_ATTEMPT_EPSILON = 1e-12
+
+###############################################################################
+# Function : ExpectedRuns
+#
+# Expected number of runs of exactly h losses in n independent trials
+###############################################################################
+
+def ExpectedRuns(q, iMaxW):
+    '''
+    Returns an array of shape q.shape + (iMaxW, iMaxW + 1). Element [..., n, h]
+    is the expected number of maximal runs of exactly h lost blocks among n
+    blocks, each lost with probability q. n = 0..iMaxW - 1, h = 0..iMaxW.
+    '''
+    q = q[..., None, None]
+    n = np.arange(iMaxW)[:, None]
+    h = np.arange(iMaxW + 1)[None, :]
+    qh = q ** h
+    # A run of h < n losses is bounded by a received block on one side
+    # (at either end) or both sides (in the middle)
+    aInner = qh * (2.0 * (1.0 - q) + (n - h - 1) * (1.0 - q) ** 2)
+    a = np.where(h < n, aInner, np.where(h == n, qh, 0.0))
+    a[..., 0] = 0.0 # Runs of 0 are not runs
+    return a
+
+###############################################################################
+# Function : RunMoments
+#
+# Mean and variance of the sum of m[len] over runs of losses
+###############################################################################
+
+def RunMoments(q, m, iMaxW):
+    '''
+    For n = 0..iMaxW - 1 blocks each lost with probability q, returns the mean
+    and variance of S = sum of m[h] over all runs of h lost blocks. Arrays are
+    of shape q.shape + (iMaxW,). Computed by stepping along the blocks with
+    the length of the current run of losses as the state.
+    '''
+    q = q[..., None]
+    tShape = np.broadcast_shapes(q.shape, m.shape)
+    P = np.zeros(tShape)  # P(current run length = r)
+    E1 = np.zeros(tShape) # E[S; current run length = r]
+    E2 = np.zeros(tShape) # E[S^2; current run length = r]
+    P[..., 0] = 1.0
+    aMean = np.empty(tShape[:-1] + (iMaxW,))
+    aVar = np.empty(tShape[:-1] + (iMaxW,))
+    for n in range(iMaxW):
+        # A received block (or the end) completes the current run
+        R0 = P.sum(axis=-1)
+        R1 = (E1 + m * P).sum(axis=-1)
+        R2 = (E2 + 2.0 * m * E1 + m * m * P).sum(axis=-1)
+        aMean[..., n] = R1
+        aVar[..., n] = R2 - R1 * R1
+        # Next block lost: run grows. Received: run completes.
+        P[..., 1:] = q * P[..., :-1]
+        E1[..., 1:] = q * E1[..., :-1]
+        E2[..., 1:] = q * E2[..., :-1]
+        P[..., 0] = (1.0 - q[..., 0]) * R0
+        E1[..., 0] = (1.0 - q[..., 0]) * R1
+        E2[..., 0] = (1.0 - q[..., 0]) * R2
+    return aMean, np.maximum(aVar, 0.0)
+
+###############################################################################
+# Function : SolveRounds
+#
+# Solve the chain for the mean and variance of the cost of a round
+###############################################################################
+
+def SolveRounds(p, pa, Cs, Cf, iMaxW):
+    '''
+    p, pa: block and acknowledgement loss probabilities, shape G
+    Cs, Cf: cost of a successful and of a failed (timed out) attempt of a
+    round of each size g = 0..iMaxW, shape G + (iMaxW + 1,)
+    Returns the mean and variance of the total cost of a round of each size
+    including the recovery of its gaps, shape G + (iMaxW + 1,)
+    '''
+    s = (1.0 - p) * (1.0 - pa) # Attempt succeeds
+    f = 1.0 - s
+    fMaxF = float(np.max(f))
+    if fMaxF <= 0.0:
+        iAttempts = 1
+    elif fMaxF >= 1.0:
+        raise ValueError("Loss probability of 1 never completes")
+    else:
+        iAttempts = min(MODEL_MAX_ATTEMPTS, int(math.ceil(math.log(MODEL_ATTEMPT_EPSILON) / math.log(fMaxF))) + 1)
+    k = np.arange(1, iAttempts + 1)
+    Pk = s[..., None] * f[..., None] ** (k - 1)
+    Pk /= Pk.sum(axis=-1, keepdims=True)
+    qk = p[..., None] ** k # Block still missing after k attempts
+
+    # A[g, h] = E[number of gaps of size h left by a round of size g]
+    A = np.zeros(p.shape + (iMaxW + 1, iMaxW + 1))
+    A[..., 1:, :] = np.einsum('...k,...knh->...nh', Pk, ExpectedRuns(qk, iMaxW))
+    I = np.eye(iMaxW + 1)
+
+    # Mean
+    Ek1 = (Pk * (k - 1)).sum(axis=-1)
+    c = Ek1[..., None] * Cf + Cs
+    c[..., 0] = 0.0
+    m = np.linalg.solve(I - A, c[..., None])[..., 0]
+
+    # Variance: variance of the gaps' costs given the number of attempts,
+    # plus the variance of the mean cost over the number of attempts
+    ZMean, ZVar = RunMoments(qk, m[..., None, :], iMaxW) # G + (k, n)
+    XMean = np.zeros(p.shape + (iAttempts, iMaxW + 1))
+    XMean[..., 1:] = (k - 1)[:, None] * Cf[..., None, 1:] + Cs[..., None, 1:] + ZMean
+    b = np.zeros(p.shape + (iMaxW + 1,))
+    b[..., 1:] = np.einsum('...k,...kn->...n', Pk, ZVar)
+    b += np.einsum('...k,...kg->...g', Pk, XMean ** 2) - np.einsum('...k,...kg->...g', Pk, XMean) ** 2
+    b[..., 0] = 0.0
+    V = np.linalg.solve(I - A, np.maximum(b, 0.0)[..., None])[..., 0]
+    return m, V
+
+###############################################################################
+# Function : ModelTransfer
+#
+# Expected completion time, APDUs and rounds of a confirmed GBT transfer
+###############################################################################
+
+def ModelTransfer(iPayload, iMaxPayload, iWindow, fLoss, fAckLoss=None, fLatency=0.0, fBitRate=0.0,
+                  fTimeout=10.0, iHeader=GBTSimEngine.GBT_APDU_HEADER_SIZE):
+    '''
+    All arguments may be scalars or arrays, which are broadcast against each
+    other, so a whole grid of parameters is solved at once.
+    iPayload: payload size in bytes
+    iMaxPayload: GBT_MAX_PAYLOAD
+    iWindow: BTW of the receiver, i.e. the sender's window
+    fLoss, fAckLoss: loss probability of a block and of an acknowledgement
+    fLatency, fBitRate, iHeader: link model as GBTSimEngine.cLinkModel
+    fTimeout: sender timeout in seconds
+    Returns a dictionary of arrays: fTimeMean, fTimeStd, fApdusMean,
+    fApdusStd, fRoundsMean, fRoundsStd.
+    '''
+    if fAckLoss is None:
+        fAckLoss = fLoss
+    aArgs = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in
+                                  (iPayload, iMaxPayload, iWindow, fLoss, fAckLoss, fLatency, fBitRate, fTimeout, iHeader)])
+    tShape = aArgs[0].shape
+    iPayload, iMaxPayload, iWindow, p, pa, fLatency, fBitRate, fTimeout, iHeader = [x.ravel() for x in aArgs]
+    iWindow = iWindow.astype(int)
+    iMaxW = int(iWindow.max())
+
+    iBlocks = np.ceil(iPayload / iMaxPayload).astype(int)
+    iFull = iBlocks // iWindow
+    iResidual = iBlocks % iWindow
+    g = np.arange(iMaxW + 1)
+
+    # Time. Blocks are taken as their mean size.
+    with np.errstate(divide='ignore'):
+        fBitTime = np.where(fBitRate > 0.0, 8.0 / fBitRate, 0.0)
+    fBlockTime = (iPayload / iBlocks + iHeader) * fBitTime
+    fAckTime = iHeader * fBitTime
+    CsTime = g * fBlockTime[:, None] + (fAckTime + 2.0 * fLatency)[:, None]
+    CfTime = np.broadcast_to(fTimeout[:, None], CsTime.shape) # Timer runs from when the window is sent
+    # GBT APDUs. A failed attempt has an acknowledgement if the last block arrived.
+    s = (1.0 - p) * (1.0 - pa)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fFailAck = np.where(s < 1.0, (1.0 - p) * pa / (1.0 - s), 0.0)
+    CsApdus = g + np.ones_like(p)[:, None]
+    CfApdus = g + fFailAck[:, None]
+    # Rounds
+    CRounds = np.ones_like(CsTime)
+
+    dResult = {}
+    for sName, Cs, Cf in (('Time', CsTime, CfTime), ('Apdus', CsApdus, CfApdus), ('Rounds', CRounds, CRounds)):
+        m, V = SolveRounds(p, pa, Cs, Cf, iMaxW)
+        rows = np.arange(len(p))
+        fMean = iFull * m[rows, iWindow] + m[rows, iResidual]
+        fVar = iFull * V[rows, iWindow] + V[rows, iResidual]
+        dResult['f%sMean' % sName] = fMean.reshape(tShape)
+        dResult['f%sStd' % sName] = np.sqrt(fVar).reshape(tShape)
+    return dResult
+
+###############################################################################
+# Function : ValidateModel
+#
+# Compare the model against simulated runs
+###############################################################################
+
+def ValidateModel(iRuns=200, bVerbose=True):
+    '''
+    Run the GBT procedures in simulated time (GBTSimEngine) with random loss
+    for a few configurations and compare the mean and standard deviation of
+    completion time, GBT APDUs and rounds against the model.
+    Client to server (ACCESS.request) transfers are used, as the client is
+    the side with the timer. Returns the worst relative error of the means.
+    The simulated means are themselves uncertain, so each error is also
+    given in standard errors of the simulated mean: with few runs, most of
+    the error is sampling noise.
+
+    Note that in the simulator a lost final acknowledgement leaves the
+    sender resending blocks which the receiver, having finished, takes as
+    a new stream. Those runs are aborted by the watchdog and left out, so
+    cases with acknowledgement loss are biased towards faster runs.
+    '''
+    import GBT
+    import GBTLoss
+    aCases = [
+        # Payload, block size, server BTW, block loss, ack loss, latency, bit rate, timeout
+        (1000, 10, 6, 0.0, 0.0, 0.05, 9600.0, 2.0),
+        (1000, 10, 6, 0.05, 0.0, 0.05, 9600.0, 2.0),
+        (2000, 50, 6, 0.1, 0.0, 0.1, 2400.0, 5.0),
+        (1000, 20, 16, 0.1, 0.0, 0.02, 19200.0, 1.0),
+        (500, 10, 63, 0.2, 0.0, 0.05, 9600.0, 3.0),
+        (1000, 10, 6, 0.05, 0.05, 0.05, 9600.0, 2.0),
+    ]
+    fWorst = 0.0
+    for iPayload, iMaxPayload, iWindow, fLoss, fAckLoss, fLatency, fBitRate, fTimeout in aCases:
+        oLink = GBTSimEngine.cLinkModel(fLatency, fBitRate)
+        aSim = []
+        for iRun in range(iRuns):
+            oLoss = None
+            oAckLoss = None
+            if fLoss > 0.0:
+                oLoss = GBTLoss.cBernoulliLoss(fLoss, 2 * iRun)
+            if fAckLoss > 0.0:
+                oAckLoss = GBTLoss.cBernoulliLoss(fAckLoss, 2 * iRun + 1)
+            oConfig = GBT.cGBTConfig(MaxPayload=iMaxPayload, SvrBTW=iWindow, CltBTW=63,
+                                     aCltDropMsgs=(), aSvrDropMsgs=(), oSvrLoss=oLoss, oCltLoss=oAckLoss,
+                                     tTimeouts=(fTimeout, fTimeout))
+            dStats = GBTSimEngine.RunTransfer(oConfig, 'x' * iPayload, "request", oLink)
+            if dStats['bComplete']:
+                aSim.append((dStats['fTime'], dStats['iApdus'], dStats['iRounds']))
+        aSim = np.array(aSim)
+        dModel = ModelTransfer(iPayload, iMaxPayload, iWindow, fLoss, fAckLoss, fLatency, fBitRate, fTimeout)
+        if bVerbose:
+            print("Payload %d, block %d, W %d, loss %.2f/%.2f, latency %.3f, rate %.0f, timeout %.1f: %d/%d complete" %
+                  (iPayload, iMaxPayload, iWindow, fLoss, fAckLoss, fLatency, fBitRate, fTimeout, len(aSim), iRuns))
+        for i, sName in enumerate(('Time', 'Apdus', 'Rounds')):
+            fSimMean = aSim[:, i].mean()
+            fModelMean = float(dModel['f%sMean' % sName])
+            fErr = abs(fModelMean - fSimMean) / fSimMean
+            fWorst = max(fWorst, fErr)
+            fStdErr = aSim[:, i].std() / np.sqrt(len(aSim))
+            if bVerbose:
+                sStdErrs = ("%4.1f" % (abs(fModelMean - fSimMean) / fStdErr)) if fStdErr > 1e-9 * abs(fSimMean) else "   -"
+                print("    %-6s: simulated %10.3f +/- %8.3f, model %10.3f +/- %8.3f, error %5.1f%% (%s standard errors)" %
+                      (sName, fSimMean, aSim[:, i].std(), fModelMean, float(dModel['f%sStd' % sName]), 100.0 * fErr,
+                       sStdErrs))
+    return fWorst
+
+###############################################################################
+# Function : ParseList
+#
+# Parse a comma separated list of numbers
+###############################################################################
+
+def ParseList(sList):
+    return [float(s) for s in sList.split(',')]
+
+###############################################################################
+# Function : GBTModelMain
+#
+# Main function
+###############################################################################
+
+def GBTModelMain():
+    import argparse
+    import itertools
+    import time
+    oParser = argparse.ArgumentParser(description="Analytical model of confirmed GBT transfer time. "
+                                      "Comma separated lists are expanded to a grid.")
+    oParser.add_argument("--payload", type=ParseList, default=[1000.0], help="payload size(s) in bytes")
+    oParser.add_argument("--block-size", type=ParseList, default=[10.0], help="GBT_MAX_PAYLOAD value(s)")
+    oParser.add_argument("--window", type=ParseList, default=[6.0], help="receiver BTW value(s)")
+    oParser.add_argument("--loss", type=ParseList, default=[0.0], help="loss probability value(s)")
+    oParser.add_argument("--latency", type=ParseList, default=[0.05], help="one way latency value(s) in seconds")
+    oParser.add_argument("--bit-rate", type=ParseList, default=[9600.0], help="bit rate value(s), 0 = infinite")
+    oParser.add_argument("--timeout", type=ParseList, default=[10.0], help="sender timeout value(s) in seconds")
+    oParser.add_argument("--validate", action="store_true", help="compare the model against simulated runs")
+    oParser.add_argument("--runs", type=int, default=200, help="simulated runs per case for --validate")
+    oArgs = oParser.parse_args()
+
+    if oArgs.validate:
+        print("Worst error of means: %.1f%%" % (100.0 * ValidateModel(oArgs.runs)))
+        return
+
+    aNames = ('payload', 'block_size', 'window', 'loss', 'latency', 'bit_rate', 'timeout')
+    aGrid = np.array(list(itertools.product(*[getattr(oArgs, s) for s in aNames])))
+    t = time.perf_counter()
+    dResult = ModelTransfer(aGrid[:, 0], aGrid[:, 1], aGrid[:, 2], aGrid[:, 3], aGrid[:, 3],
+                            aGrid[:, 4], aGrid[:, 5], aGrid[:, 6])
+    t = time.perf_counter() - t
+    print("%8s %6s %4s %6s %7s %8s %7s | %10s %9s %9s %8s" %
+          ('payload', 'block', 'W', 'loss', 'latency', 'bitrate', 'timeout', 'time (s)', 'std', 'APDUs', 'rounds'))
+    for i, aRow in enumerate(aGrid):
+        print("%8d %6d %4d %6.3f %7.3f %8.0f %7.1f | %10.3f %9.3f %9.1f %8.1f" %
+              (tuple(aRow) + (dResult['fTimeMean'][i], dResult['fTimeStd'][i], dResult['fApdusMean'][i], dResult['fRoundsMean'][i])))
+    print("%d points solved in %.1f ms" % (len(aGrid), 1e3 * t))
+
+if __name__ == '__main__':
+    GBTModelMain()
@@ -0,0 +1,381 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Search for the best GBT block size and windows
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# The search
+# ----------
+# Each candidate is a (GBT_MAX_PAYLOAD, client BTW, server BTW) triple. A
+# candidate is evaluated by running an exchange, an ACCESS.request followed
+# by an ACCESS.response, in simulated time (GBTSimEngine) over the link
+# profile. Run i of every candidate uses the same loss seeds, so candidates
+# are compared on the same loss patterns.
+#
+# Successive halving: all candidates are evaluated with a few runs, the best
+# 1/eta of them (by the objective) and the Pareto front of completion time
+# versus GBT APDUs are kept, and the survivors are evaluated with eta times
+# as many runs. This repeats until few candidates are left or the maximum
+# number of runs is reached. Runs already done are never repeated: results
+# are cached by candidate, link profile, exchange and seed, and the cache
+# can be kept between searches in a GBTResultCache database.
+
+import argparse
+import concurrent.futures
+import itertools
+import math
+import os
+import time
+from typing import NamedTuple
+import GBT
+import GBTLoss
+import GBTResultCache
+import GBTSimEngine
+
+# Default search space
+OPT_BLOCK_SIZES = (16, 32, 64, 128, 256, 512)
+OPT_WINDOWS = (1, 2, 4, 8, 16, 32, 63)
+
+###############################################################################
+# Class : cLinkProfile
+#
+# Link and loss over which candidates are evaluated
+###############################################################################
+
+class cLinkProfile(NamedTuple):
+    fLatency: float = 0.05 # One way latency in seconds
+    fBitRate: float = 9600.0 # Bits per second. 0 = infinite
+    fLoss: float = 0.0 # Loss probability in each direction
+    fBurst: float = 1.0 # Mean loss burst length
+    fTimeout: float = 2.0 # Client and server timeout in seconds
+
+    def GetLink(self):
+        return GBTSimEngine.cLinkModel(self.fLatency, self.fBitRate)
+
+###############################################################################
+# Class : cCandidate
+#
+# GBT parameters being searched
+###############################################################################
+
+class cCandidate(NamedTuple):
+    MaxPayload: int
+    CltBTW: int
+    SvrBTW: int
+
+    def __str__(self):
+        return "block %4d, client BTW %2d, server BTW %2d" % self
+
+###############################################################################
+# Function : GetExchangeConfig
+#
+# Session configuration of one direction of an exchange
+###############################################################################
+
+def GetExchangeConfig(oCandidate, oProfile, iSeed, i):
+    '''i is 0 for the request, 1 for the response.'''
+    return GBT.GetDefaultConfig()._replace(
+        MaxPayload=oCandidate.MaxPayload,
+        CltBTW=oCandidate.CltBTW,
+        SvrBTW=oCandidate.SvrBTW,
+        aCltDropMsgs=(),
+        aSvrDropMsgs=(),
+        oCltLoss=GBTLoss.CreateLoss(oProfile.fLoss, oProfile.fBurst, 4 * iSeed + 2 * i),
+        oSvrLoss=GBTLoss.CreateLoss(oProfile.fLoss, oProfile.fBurst, 4 * iSeed + 2 * i + 1),
+        tTimeouts=(oProfile.fTimeout, oProfile.fTimeout))
+
+###############################################################################
+# Function : RunExchange
+#
+# Run one request/response exchange for a candidate in simulated time
+###############################################################################
+
+def RunExchange(oCandidate, oProfile, iRequest, iResponse, iSeed, fPenalty):
+    '''
+    Returns (fTime, iApdus, iBytes, bComplete). fTime is the time until each
+    receiver has its payload. An exchange which does not complete is
+    charged fPenalty seconds.
+    '''
+    fTime = 0.0
+    iApdus = 0
+    iBytes = 0
+    bComplete = True
+    for i, (sDirection, iSize) in enumerate((("request", iRequest), ("response", iResponse))):
+        if iSize <= 0:
+            continue
+        oConfig = GetExchangeConfig(oCandidate, oProfile, iSeed, i)
+        dStats = GBTSimEngine.RunTransfer(oConfig, 'x' * iSize, sDirection, oProfile.GetLink(), fPenalty)
+        iApdus += dStats['iApdus']
+        iBytes += dStats['iBytes']
+        if dStats['bVerified'] and dStats['fRxTime'] is not None:
+            fTime += dStats['fRxTime']
+        else:
+            fTime += fPenalty
+            bComplete = False
+    return (fTime, iApdus, iBytes, bComplete)
+
+###############################################################################
+# Function : RunCandidate
+#
+# Run a candidate for a list of seeds. Runs in a worker process.
+###############################################################################
+
+def RunCandidate(oCandidate, oProfile, iRequest, iResponse, aSeeds, fPenalty):
+    return [RunExchange(oCandidate, oProfile, iRequest, iResponse, iSeed, fPenalty) for iSeed in aSeeds]
+
+###############################################################################
+# Function : ParetoFront
+#
+# Indices of the points not dominated in both coordinates
+###############################################################################
+
+def ParetoFront(aPoints):
+    '''
+    aPoints is a list of (x, y) pairs, both to be minimised. Returns the
+    indices of the Pareto front, in order of increasing x.
+    '''
+    aFront = []
+    fBestY = float('inf')
+    for i in sorted(range(len(aPoints)), key=lambda i: aPoints[i]):
+        if aPoints[i][1] < fBestY:
+            aFront.append(i)
+            fBestY = aPoints[i][1]
+    return aFront
+
+###############################################################################
+# Class : cGBTOptimizer
+#
+# Successive halving search over GBT parameters
+###############################################################################
+
+class cGBTOptimizer():
+    '''
+    Successive halving search over GBT_MAX_PAYLOAD, client BTW and server
+    BTW for a link profile. sObjective is "time" (mean completion time of
+    the exchange) or "airtime" (mean time the link is busy sending, i.e.
+    bytes sent at the bit rate).
+    '''
+
+    # Constructor
+    def __init__(self, oProfile, iRequest=100, iResponse=2000, sObjective="time", fPenalty=30.0,
+                 iWorkers=None, sCacheFile=None):
+        self.oProfile = oProfile
+        self.iRequest = iRequest
+        self.iResponse = iResponse
+        self.sObjective = sObjective
+        self.fPenalty = fPenalty
+        self.iWorkers = iWorkers or os.cpu_count() or 1
+        self.dCache = {}
+        self.iCacheHits = 0
+        self.iRunsDone = 0
+        # Runs are also kept in a GBTResultCache database if given
+        self.oResultCache = None
+        if sCacheFile is not None:
+            self.oResultCache = GBTResultCache.cResultCache(sCacheFile)
+
+    def GetCanonical(self, oCandidate):
+        '''
+        A window larger than the number of blocks sent in it behaves the same
+        as one of exactly that size, so such candidates share cache entries.
+        The server BTW is the window for the request, the client BTW for the
+        response.
+        '''
+        iReqBlocks = -(-self.iRequest // oCandidate.MaxPayload)
+        iRspBlocks = -(-self.iResponse // oCandidate.MaxPayload)
+        return oCandidate._replace(CltBTW=max(1, min(oCandidate.CltBTW, iRspBlocks)),
+                                   SvrBTW=max(1, min(oCandidate.SvrBTW, iReqBlocks)))
+
+    def GetScenario(self, oCandidate, iSeed):
+        '''
+        Scenario of a run in the result cache. It includes the session
+        configuration of each direction, so defaults changed at run time
+        (e.g. GBT.GBT_MULTI_GAP) give new keys.
+        '''
+        oCandidate = self.GetCanonical(oCandidate)
+        return {'sRun': "GBTOptimizer.RunExchange", 'oCandidate': oCandidate._asdict(),
+                'oProfile': self.oProfile._asdict(), 'iRequest': self.iRequest, 'iResponse': self.iResponse,
+                'fPenalty': self.fPenalty, 'iSeed': iSeed,
+                'aConfigs': [GBTResultCache.GetConfigScenario(GetExchangeConfig(oCandidate, self.oProfile, iSeed, i))
+                             for i in (0, 1)]}
+
+    def GetKey(self, oCandidate, iSeed):
+        '''Key of a run in the memory cache, the rest of the scenario being fixed for a search.'''
+        return (self.GetCanonical(oCandidate), iSeed)
+
+    def LoadCached(self, dTodo):
+        '''Fill in the runs to do from the result cache, if any, and remove them from dTodo.'''
+        if self.oResultCache is None:
+            return
+        aTodo = [(oCandidate, iSeed) for oCandidate, aSeeds in dTodo.items() for iSeed in aSeeds]
+        aResults = self.oResultCache.GetMany([self.GetScenario(*t) for t in aTodo])
+        for (oCandidate, iSeed), result in zip(aTodo, aResults):
+            if result is not None:
+                self.dCache[self.GetKey(oCandidate, iSeed)] = result
+                dTodo[oCandidate].remove(iSeed)
+                if not dTodo[oCandidate]:
+                    del dTodo[oCandidate]
+
+    def Evaluate(self, aCandidates, iRuns):
+        '''
+        Evaluate each candidate with seeds 0..iRuns - 1, running only what is
+        not already in the cache. Returns a dictionary of statistics per
+        candidate.
+        '''
+        dTodo = {}
+        for oCandidate in dict.fromkeys(self.GetCanonical(o) for o in aCandidates):
+            aSeeds = [iSeed for iSeed in range(iRuns) if self.GetKey(oCandidate, iSeed) not in self.dCache]
+            if aSeeds:
+                dTodo[oCandidate] = aSeeds
+        self.LoadCached(dTodo)
+        self.iCacheHits += len(aCandidates) * iRuns - sum(len(a) for a in dTodo.values())
+
+        tArgs = (self.oProfile, self.iRequest, self.iResponse)
+        if self.iWorkers > 1 and len(dTodo) > 1:
+            with concurrent.futures.ProcessPoolExecutor(self.iWorkers) as oPool:
+                dFutures = {oCandidate: oPool.submit(RunCandidate, oCandidate, *tArgs, aSeeds, self.fPenalty)
+                            for oCandidate, aSeeds in dTodo.items()}
+                dResults = {oCandidate: oFuture.result() for oCandidate, oFuture in dFutures.items()}
+        else:
+            dResults = {oCandidate: RunCandidate(oCandidate, *tArgs, aSeeds, self.fPenalty)
+                        for oCandidate, aSeeds in dTodo.items()}
+        aNew = []
+        for oCandidate, aResults in dResults.items():
+            for iSeed, tResult in zip(dTodo[oCandidate], aResults):
+                self.dCache[self.GetKey(oCandidate, iSeed)] = list(tResult)
+                aNew.append((self.GetScenario(oCandidate, iSeed), list(tResult)))
+                self.iRunsDone += 1
+        if (self.oResultCache is not None) and aNew:
+            self.oResultCache.PutMany(aNew)
+
+        fBitTime = 8.0 / self.oProfile.fBitRate if self.oProfile.fBitRate > 0.0 else 0.0
+        dStats = {}
+        for oCandidate in aCandidates:
+            aResults = [self.dCache[self.GetKey(oCandidate, iSeed)] for iSeed in range(iRuns)]
+            fTime = sum(r[0] for r in aResults) / iRuns
+            fApdus = sum(r[1] for r in aResults) / iRuns
+            fBytes = sum(r[2] for r in aResults) / iRuns
+            dStats[oCandidate] = {
+                'fTime': fTime,
+                'fApdus': fApdus,
+                'fBytes': fBytes,
+                'fAirtime': fBytes * fBitTime,
+                'fComplete': sum(r[3] for r in aResults) / iRuns,
+                'iRuns': iRuns,
+            }
+        return dStats
+
+    def GetObjective(self, dStats):
+        return dStats[('fTime', 'fAirtime')[self.sObjective == "airtime"]]
+
+    def Search(self, aCandidates, iMinRuns=2, iMaxRuns=54, iEta=3, iKeep=8, bVerbose=True):
+        '''
+        Run the search. Returns the best candidate, the statistics of the
+        candidates left in the last round and the Pareto front of completion
+        time versus GBT APDUs among them. Candidates are reported with their
+        windows limited to the number of blocks sent in them.
+        '''
+        # Equivalent candidates are searched once
+        aCandidates = list(dict.fromkeys(self.GetCanonical(o) for o in aCandidates))
+        iRuns = iMinRuns
+        while True:
+            t = time.perf_counter()
+            dStats = self.Evaluate(aCandidates, iRuns)
+            if bVerbose:
+                print("%4d candidates x %3d runs: %.1f s, %d runs done, %d cache hits" %
+                      (len(aCandidates), iRuns, time.perf_counter() - t, self.iRunsDone, self.iCacheHits))
+            if len(aCandidates) <= iKeep or iRuns >= iMaxRuns:
+                break
+            aRanked = sorted(aCandidates, key=lambda o: self.GetObjective(dStats[o]))
+            aPoints = [(dStats[o]['fTime'], dStats[o]['fApdus']) for o in aCandidates]
+            aFront = [aCandidates[i] for i in ParetoFront(aPoints)]
+            iNext = max(iKeep, int(math.ceil(len(aCandidates) / iEta)))
+            aCandidates = list(dict.fromkeys(aRanked[:iNext] + aFront))
+            iRuns = min(iMaxRuns, iRuns * iEta)
+
+        oBest = min(aCandidates, key=lambda o: self.GetObjective(dStats[o]))
+        aPoints = [(dStats[o]['fTime'], dStats[o]['fApdus']) for o in aCandidates]
+        aFront = [aCandidates[i] for i in ParetoFront(aPoints)]
+        return oBest, dStats, aFront
+
+###############################################################################
+# Function : ParseIntList
+#
+# Parse a comma separated list of integers
+###############################################################################
+
+def ParseIntList(sList):
+    return [int(s) for s in sList.split(',')]
+
+###############################################################################
+# Function : GBTOptimizerMain
+#
+# Main function
+###############################################################################
+
+def GBTOptimizerMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Search for the GBT block size and windows which minimise "
+                                      "completion time or airtime over a link.")
+    oParser.add_argument("--latency", type=float, default=0.05, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("-l", "--loss", type=float, default=0.05, help="loss probability in each direction")
+    oParser.add_argument("--burst", type=float, default=1.0, help="mean loss burst length")
+    oParser.add_argument("--timeout", type=float, default=2.0, help="client and server timeout in seconds")
+    oParser.add_argument("--request", type=int, default=100, help="ACCESS.request payload size in bytes")
+    oParser.add_argument("--response", type=int, default=2000, help="ACCESS.response payload size in bytes")
+    oParser.add_argument("--block-sizes", type=ParseIntList, default=list(OPT_BLOCK_SIZES), help="GBT_MAX_PAYLOAD values")
+    oParser.add_argument("--clt-btw", type=ParseIntList, default=list(OPT_WINDOWS), help="client BTW values")
+    oParser.add_argument("--svr-btw", type=ParseIntList, default=list(OPT_WINDOWS), help="server BTW values")
+    oParser.add_argument("-o", "--objective", choices=("time", "airtime"), default="time")
+    oParser.add_argument("--min-runs", type=int, default=2, help="runs per candidate in the first round")
+    oParser.add_argument("--max-runs", type=int, default=54, help="runs per candidate in the last round")
+    oParser.add_argument("--eta", type=int, default=3, help="1/eta of the candidates are kept each round")
+    oParser.add_argument("--keep", type=int, default=8, help="stop when this many candidates are left")
+    oParser.add_argument("--penalty", type=float, default=30.0,
+                         help="time in seconds charged for an exchange which does not complete")
+    oParser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    oParser.add_argument("--cache", default=None, help="SQLite database (GBTResultCache) in which to keep evaluated runs")
+    oArgs = oParser.parse_args(aArgs)
+
+    oProfile = cLinkProfile(oArgs.latency, oArgs.bit_rate, oArgs.loss, oArgs.burst, oArgs.timeout)
+    oOptimizer = cGBTOptimizer(oProfile, oArgs.request, oArgs.response, oArgs.objective, oArgs.penalty,
+                               oArgs.workers, oArgs.cache)
+    aCandidates = [cCandidate(*t) for t in itertools.product(oArgs.block_sizes, oArgs.clt_btw, oArgs.svr_btw)]
+    t = time.perf_counter()
+    oBest, dStats, aFront = oOptimizer.Search(aCandidates, oArgs.min_runs, oArgs.max_runs, oArgs.eta, oArgs.keep)
+    print("Search took %.1f s with %d workers" % (time.perf_counter() - t, oOptimizer.iWorkers))
+
+    print("\n%-44s %10s %9s %10s %9s %6s" % ("Candidate", "time (s)", "APDUs", "airtime", "complete", "runs"))
+    for oCandidate in sorted(dStats, key=lambda o: oOptimizer.GetObjective(dStats[o])):
+        d = dStats[oCandidate]
+        print("%-44s %10.3f %9.1f %10.3f %8.1f%% %6d %s" %
+              (oCandidate, d['fTime'], d['fApdus'], d['fAirtime'], 100.0 * d['fComplete'], d['iRuns'],
+               ("", "Pareto")[oCandidate in aFront]))
+    print("\nBest (%s): %s" % (oArgs.objective, oBest))
+    print("Pareto front of completion time versus GBT APDUs:")
+    for oCandidate in aFront:
+        print("    %s: %.3f s, %.1f APDUs" % (oCandidate, dStats[oCandidate]['fTime'], dStats[oCandidate]['fApdus']))
+
+if __name__ == '__main__':
+    GBTOptimizerMain()
@@ -0,0 +1,455 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Link impairment proxy
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# A TCP proxy which sits between a client and a server running as separate
+# processes and impairs the GBT APDUs (GBTWire encoding) between them, as
+# the drop lists and loss models do in process: loss, delay, jitter, a bit
+# rate limit and reordering, separately in each direction.
+#
+# The stream is split into APDUs as it arrives. APDUs due straight away are
+# written together, others are held in a heap keyed by the time they are
+# due and written by a single timer per direction, so the cost per APDU is
+# a few dictionary and heap operations. Reading from one side is paused
+# while the other side cannot keep up.
+#
+#   python GBTProxy.py --listen 127.0.0.1:4061 --upstream 127.0.0.1:4059 --delay 0.05 --loss 0.02
+#   python GBTProxy.py --bench 200000
+
+import argparse
+import asyncio
+import heapq
+import multiprocessing
+import random
+import socket
+import struct
+import time
+from typing import NamedTuple
+import GBTLoss
+import GBTWire
+
+# Due APDUs within this many seconds of each other are written together
+PROXY_FLUSH_SLACK = 0.0005
+
+###############################################################################
+# Class : cImpairment
+#
+# Impairment of one direction
+###############################################################################
+
+class cImpairment(NamedTuple):
+    fDelay: float = 0.0 # One way delay in seconds
+    fJitter: float = 0.0 # Extra delay, uniform between 0 and fJitter seconds. Does not reorder.
+    fBitRate: float = 0.0 # Bits per second. 0 = infinite
+    fReorder: float = 0.0 # Probability that an APDU is held back by fReorderDelay and overtaken
+    fReorderDelay: float = 0.01
+    fLoss: float = 0.0 # Loss probability, see GBTLoss.CreateLoss()
+    fBurst: float = 1.0 # Mean loss burst length
+    iSeed: int = 0
+
+    def IsTransparent(self):
+        return (self.fDelay <= 0.0) and (self.fJitter <= 0.0) and (self.fBitRate <= 0.0) and \
+               (self.fReorder <= 0.0) and (self.fLoss <= 0.0)
+
+###############################################################################
+# Class : cImpairedDirection
+#
+# One direction through the proxy
+###############################################################################
+
+class cImpairedDirection():
+    '''
+    Splits the bytes from one side into APDUs, impairs them and writes
+    them to oTransport, the other side.
+    '''
+
+    # Constructor
+    def __init__(self, oLoop, oImpairment, iSeed):
+        self.oLoop = oLoop
+        self.oImpairment = oImpairment
+        self.bTransparent = oImpairment.IsTransparent()
+        self.oLoss = GBTLoss.CreateLoss(oImpairment.fLoss, oImpairment.fBurst, iSeed)
+        self.oRandom = random.Random(iSeed)
+        self.oTransport = None
+        self.baBuffer = bytearray()
+        self.aHeap = [] # (due time, sequence, APDU)
+        self.iSeq = 0
+        self.oTimer = None
+        self.fTimerAt = None
+        self.fBusyUntil = 0.0
+        self.fLastDue = 0.0
+        # Statistics
+        self.iApdus = 0
+        self.iBytes = 0
+        self.iDropped = 0
+        self.iReordered = 0
+        self.iMaxHeld = 0
+
+    def DataReceived(self, bData):
+        self.baBuffer += bData
+        aApdus, iUsed = GBTWire.SplitApdus(self.baBuffer)
+        if iUsed == 0:
+            return
+        del self.baBuffer[:iUsed]
+        self.iBytes += iUsed
+        if self.bTransparent:
+            self.iApdus += len(aApdus)
+            self.oTransport.write(self.baBuffer[:0].join(aApdus))
+            return
+        oImp = self.oImpairment
+        fNow = self.oLoop.time()
+        aNow = []
+        for bApdu in aApdus:
+            iMsg = self.iApdus
+            self.iApdus += 1
+            if (self.oLoss is not None) and self.oLoss.IsDropped(iMsg):
+                self.iDropped += 1
+                continue
+            fDue = fNow
+            if oImp.fBitRate > 0.0:
+                fDue = max(fDue, self.fBusyUntil) + len(bApdu) * 8.0 / oImp.fBitRate
+                self.fBusyUntil = fDue
+            fDue += oImp.fDelay
+            if oImp.fJitter > 0.0:
+                fDue += self.oRandom.random() * oImp.fJitter
+            if (oImp.fReorder > 0.0) and (self.oRandom.random() < oImp.fReorder):
+                fDue += oImp.fReorderDelay
+                self.iReordered += 1
+            else:
+                # Jitter alone keeps the order
+                fDue = max(fDue, self.fLastDue)
+                self.fLastDue = fDue
+            if (fDue <= fNow) and not self.aHeap:
+                aNow.append(bApdu)
+            else:
+                heapq.heappush(self.aHeap, (fDue, self.iSeq, bApdu))
+                self.iSeq += 1
+        if aNow:
+            self.oTransport.write(b''.join(aNow))
+        self.iMaxHeld = max(self.iMaxHeld, len(self.aHeap))
+        self.ArmTimer()
+
+    def ArmTimer(self):
+        if not self.aHeap:
+            return
+        fDue = self.aHeap[0][0]
+        if (self.oTimer is not None) and (self.fTimerAt <= fDue):
+            return
+        if self.oTimer is not None:
+            self.oTimer.cancel()
+        self.fTimerAt = fDue
+        self.oTimer = self.oLoop.call_at(fDue, self.Flush)
+
+    def Flush(self):
+        self.oTimer = None
+        fLimit = self.oLoop.time() + PROXY_FLUSH_SLACK
+        aDue = []
+        while self.aHeap and (self.aHeap[0][0] <= fLimit):
+            aDue.append(heapq.heappop(self.aHeap)[2])
+        if aDue and not self.oTransport.is_closing():
+            self.oTransport.write(b''.join(aDue))
+        self.ArmTimer()
+
+    def Close(self):
+        if self.oTimer is not None:
+            self.oTimer.cancel()
+            self.oTimer = None
+
+    def GetStats(self):
+        return {'iApdus': self.iApdus, 'iBytes': self.iBytes, 'iDropped': self.iDropped,
+                'iReordered': self.iReordered, 'iMaxHeld': self.iMaxHeld, 'iHeld': len(self.aHeap)}
+
+###############################################################################
+# Class : cProxyProtocol
+#
+# One side of a proxied connection
+###############################################################################
+
+class cProxyProtocol(asyncio.Protocol):
+    def __init__(self, oDirection, fnMade=None):
+        self.oDirection = oDirection # Impairs what this side receives
+        self.fnMade = fnMade # Called once connected
+        self.oPeer = None
+        self.oTransport = None
+
+    def connection_made(self, oTransport):
+        self.oTransport = oTransport
+        oTransport.set_write_buffer_limits(high=1 << 20)
+        if self.fnMade is not None:
+            self.fnMade()
+
+    def data_received(self, bData):
+        try:
+            self.oDirection.DataReceived(bData)
+        except ValueError as e:
+            print("Proxy: %s, closing" % e)
+            self.oTransport.close()
+
+    def connection_lost(self, oException):
+        self.oDirection.Close()
+        if (self.oPeer is not None) and (self.oPeer.oTransport is not None):
+            self.oPeer.oTransport.close()
+
+    # The other side cannot keep up with what is written to this side
+    def pause_writing(self):
+        self.oPeer.oTransport.pause_reading()
+
+    def resume_writing(self):
+        self.oPeer.oTransport.resume_reading()
+
+###############################################################################
+# Class : cGBTProxy
+#
+# Impairment proxy
+###############################################################################
+
+class cGBTProxy():
+    '''
+    Accepts connections from clients and connects each to the upstream
+    server. oUpImpairment applies to APDUs from the client to the server,
+    oDownImpairment to those from the server to the client.
+    '''
+
+    # Constructor
+    def __init__(self, sUpHost, iUpPort, oUpImpairment=cImpairment(), oDownImpairment=None):
+        self.sUpHost = sUpHost
+        self.iUpPort = iUpPort
+        self.oUpImpairment = oUpImpairment
+        self.oDownImpairment = oUpImpairment if oDownImpairment is None else oDownImpairment
+        self.aDirections = [] # (up, down) of each connection
+        self.oServer = None
+
+    async def Start(self, sHost, iPort):
+        oLoop = asyncio.get_running_loop()
+        self.oServer = await oLoop.create_server(self.Accept, sHost, iPort)
+        return self.oServer.sockets[0].getsockname()[1]
+
+    def Accept(self):
+        oLoop = asyncio.get_running_loop()
+        iConnection = len(self.aDirections)
+        oUp = cImpairedDirection(oLoop, self.oUpImpairment, self.oUpImpairment.iSeed + 2 * iConnection)
+        oDown = cImpairedDirection(oLoop, self.oDownImpairment, self.oDownImpairment.iSeed + 2 * iConnection + 1)
+        self.aDirections.append((oUp, oDown))
+        oServerSide = cProxyProtocol(oDown)
+        oClientSide = cProxyProtocol(oUp, lambda: self.Connect(oClientSide, oServerSide))
+        oClientSide.oPeer, oServerSide.oPeer = oServerSide, oClientSide
+        return oClientSide
+
+    def Connect(self, oClientSide, oServerSide):
+        # Nothing is read from the client until the server is connected
+        oClientSide.oTransport.pause_reading()
+        asyncio.get_running_loop().create_task(self.ConnectUpstream(oClientSide, oServerSide))
+
+    async def ConnectUpstream(self, oClientSide, oServerSide):
+        oLoop = asyncio.get_running_loop()
+        try:
+            await oLoop.create_connection(lambda: oServerSide, self.sUpHost, self.iUpPort)
+        except OSError as e:
+            print("Proxy: cannot connect to %s:%d (%s)" % (self.sUpHost, self.iUpPort, e))
+            oClientSide.oTransport.close()
+            return
+        oClientSide.oDirection.oTransport = oServerSide.oTransport
+        oServerSide.oDirection.oTransport = oClientSide.oTransport
+        oClientSide.oTransport.resume_reading()
+
+    def GetStats(self):
+        '''Totals over all connections, per direction.'''
+        dStats = {}
+        for sName, i in (("up", 0), ("down", 1)):
+            dTotals = {}
+            for tDirections in self.aDirections:
+                for sKey, x in tDirections[i].GetStats().items():
+                    dTotals[sKey] = dTotals.get(sKey, 0) + x
+            dStats[sName] = dTotals
+        return dStats
+
+    def Close(self):
+        if self.oServer is not None:
+            self.oServer.close()
+
+###############################################################################
+# Bench: a sender and a sink in a child process, connected either directly
+# or through the proxy in this process. Each APDU carries the time it was
+# sent, so the sink measures the latency on the same clock. Throughput is
+# measured sending as fast as possible, latency sending at BENCH_PACE.
+###############################################################################
+
+BENCH_BATCH = 1000
+BENCH_PACE = 10000 # APDUs per second
+BENCH_PACE_BATCH = 10
+BENCH_BD_SIZE = 16
+BENCH_IDLE = 0.5 # Seconds without an APDU after which the rest are taken as lost
+
+class cBenchSink(asyncio.Protocol):
+    def __init__(self, iApdus, oDone):
+        self.iApdus = iApdus
+        self.oDone = oDone
+        self.baBuffer = bytearray()
+        self.aLatencies = []
+        self.fLastRx = None
+
+    def data_received(self, bData):
+        fNow = time.perf_counter()
+        self.fLastRx = fNow
+        self.baBuffer += bData
+        aApdus, iUsed = GBTWire.SplitApdus(self.baBuffer)
+        del self.baBuffer[:iUsed]
+        iOffset = GBTWire.WIRE_HEADER.size + 1
+        for bApdu in aApdus:
+            self.aLatencies.append(fNow - struct.unpack_from('>d', bApdu, iOffset)[0])
+        if (len(self.aLatencies) >= self.iApdus) and not self.oDone.done():
+            self.oDone.set_result(None)
+
+async def RunBenchEndpoints(iSinkPort, iConnectPort, iApdus, fPace):
+    oLoop = asyncio.get_running_loop()
+    oDone = oLoop.create_future()
+    oSink = cBenchSink(iApdus, oDone)
+    oServer = await oLoop.create_server(lambda: oSink, '127.0.0.1', iSinkPort)
+    oReader, oWriter = await asyncio.open_connection('127.0.0.1', iConnectPort)
+    bHeader = GBTWire.WIRE_HEADER.pack(GBTWire.GBT_TAG, 0x40 | 16, 1, 0) + GBTWire.EncodeLength(BENCH_BD_SIZE)
+    bPad = bytes(BENCH_BD_SIZE - 8)
+    iBatch = BENCH_BATCH if fPace <= 0.0 else BENCH_PACE_BATCH
+    fStart = time.perf_counter()
+    iSent = 0
+    while iSent < iApdus:
+        if fPace > 0.0:
+            await asyncio.sleep(max(0.0, fStart + iSent / fPace - time.perf_counter()))
+        iCount = min(iBatch, iApdus - iSent)
+        oWriter.write((bHeader + struct.pack('>d', time.perf_counter()) + bPad) * iCount)
+        await oWriter.drain()
+        iSent += iCount
+    # Wait for all the APDUs, or until they stop coming if some were lost
+    iReceived = -1
+    while (not oDone.done()) and (len(oSink.aLatencies) != iReceived):
+        iReceived = len(oSink.aLatencies)
+        await asyncio.wait([oDone], timeout=BENCH_IDLE)
+    oWriter.close()
+    oServer.close()
+    fRate = len(oSink.aLatencies) / (oSink.fLastRx - fStart) if oSink.fLastRx is not None else 0.0
+    return fRate, sorted(oSink.aLatencies)
+
+def BenchEndpoints(iSinkPort, iConnectPort, iApdus, fPace, oConn):
+    oConn.send(asyncio.run(RunBenchEndpoints(iSinkPort, iConnectPort, iApdus, fPace)))
+
+def GetFreePort():
+    with socket.socket() as oSocket:
+        oSocket.bind(('127.0.0.1', 0))
+        return oSocket.getsockname()[1]
+
+async def RunBenchRoute(iApdus, fPace, oUpImpairment):
+    '''
+    One bench run, through the proxy if oUpImpairment is not None.
+    Returns APDUs received per second, sorted latencies and proxy CPU seconds.
+    '''
+    oLoop = asyncio.get_running_loop()
+    iSinkPort = GetFreePort()
+    iConnectPort = iSinkPort
+    oProxy = None
+    if oUpImpairment is not None:
+        oProxy = cGBTProxy('127.0.0.1', iSinkPort, oUpImpairment, cImpairment())
+        iConnectPort = await oProxy.Start('127.0.0.1', 0)
+    oParentConn, oChildConn = multiprocessing.Pipe()
+    oProcess = multiprocessing.Process(target=BenchEndpoints, args=(iSinkPort, iConnectPort, iApdus, fPace, oChildConn))
+    fCpu = time.process_time()
+    oProcess.start()
+    fRate, aLatencies = await oLoop.run_in_executor(None, oParentConn.recv)
+    fCpu = time.process_time() - fCpu
+    oProcess.join()
+    if oProxy is not None:
+        oProxy.Close()
+    return fRate, aLatencies, fCpu
+
+async def RunBench(iApdus, oUpImpairment):
+    '''Returns [throughput run, paced run] for [direct, through the proxy].'''
+    aResults = []
+    for oImpairment in (None, oUpImpairment):
+        aResults.append([await RunBenchRoute(iApdus, 0.0, oImpairment),
+                         await RunBenchRoute(min(iApdus, 5 * BENCH_PACE), BENCH_PACE, oImpairment)])
+    return aResults
+
+###############################################################################
+# Function : ParseAddress
+#
+# Parse host:port
+###############################################################################
+
+def ParseAddress(sAddress):
+    sHost, _, sPort = sAddress.rpartition(':')
+    return (sHost or '127.0.0.1'), int(sPort)
+
+###############################################################################
+# Function : GBTProxyMain
+#
+# Main function
+###############################################################################
+
+def GBTProxyMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Impair GBT APDUs between a client and a server.")
+    oParser.add_argument("--listen", type=ParseAddress, default=('127.0.0.1', 4061), help="host:port to accept clients on")
+    oParser.add_argument("--upstream", type=ParseAddress, default=('127.0.0.1', 4059), help="host:port of the server")
+    oParser.add_argument("--delay", type=float, default=0.0, help="one way delay in seconds")
+    oParser.add_argument("--jitter", type=float, default=0.0, help="extra delay, uniform up to this many seconds")
+    oParser.add_argument("--bit-rate", type=float, default=0.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("--reorder", type=float, default=0.0, help="probability of holding an APDU back")
+    oParser.add_argument("--reorder-delay", type=float, default=0.01, help="how long an APDU is held back")
+    oParser.add_argument("-l", "--loss", type=float, default=0.0, help="loss probability")
+    oParser.add_argument("--burst", type=float, default=1.0, help="mean loss burst length")
+    oParser.add_argument("-s", "--seed", type=int, default=0, help="seed for loss, jitter and reordering")
+    oParser.add_argument("--bench", type=int, metavar="N", default=0,
+                         help="measure throughput and added latency with N APDUs instead of proxying")
+    oArgs = oParser.parse_args(aArgs)
+    oImpairment = cImpairment(oArgs.delay, oArgs.jitter, oArgs.bit_rate, oArgs.reorder, oArgs.reorder_delay,
+                              oArgs.loss, oArgs.burst, oArgs.seed)
+
+    if oArgs.bench > 0:
+        aResults = asyncio.run(RunBench(oArgs.bench, oImpairment))
+        print("%-6s | %12s | %-47s | %s" % ("", "APDU/s", "latency at %d APDU/s: mean, p50, p99 (us)" % BENCH_PACE,
+                                            "received"))
+        for sName, ((fRate, aBlast, fCpu), (fPaced, aLatencies, fPacedCpu)) in zip(("direct", "proxy"), aResults):
+            print("%-6s | %12.0f | %15.1f %15.1f %15.1f | %d, %d" %
+                  (sName, fRate, 1e6 * sum(aLatencies) / len(aLatencies), 1e6 * aLatencies[len(aLatencies) // 2],
+                   1e6 * aLatencies[int(0.99 * (len(aLatencies) - 1))], len(aBlast), len(aLatencies)))
+        fMean = [sum(a[1][1]) / len(a[1][1]) for a in aResults]
+        print("Proxy overhead: %.1f us added latency (mean), %.2f us CPU per APDU" %
+              (1e6 * (fMean[1] - fMean[0]), 1e6 * aResults[1][0][2] / oArgs.bench))
+        return
+
+    async def Serve():
+        oProxy = cGBTProxy(oArgs.upstream[0], oArgs.upstream[1], oImpairment)
+        await oProxy.Start(*oArgs.listen)
+        print("Proxying %s:%d -> %s:%d with %s" % (oArgs.listen + oArgs.upstream + (oImpairment,)))
+        try:
+            await oProxy.oServer.serve_forever()
+        finally:
+            print(oProxy.GetStats())
+    try:
+        asyncio.run(Serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    GBTProxyMain()
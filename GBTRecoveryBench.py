@@ -0,0 +1,116 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Compare standard and multi-gap recovery
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Runs the same transfers, with the same loss patterns, with the standard
+# CheckRQandFillGaps procedure and with the NON-STANDARD multi-gap recovery
+# (GBT.GBT_MULTI_GAP), and reports the round trips, completion time, GBT
+# APDUs and bytes saved. Runs which do not complete in both modes are left
+# out of the comparison and counted.
+
+import argparse
+import GBT
+import GBTLoss
+import GBTSimEngine
+
+# Loss scenarios: name, loss probability, mean burst length
+RB_SCENARIOS = (
+    ("random 2%", 0.02, 1.0),
+    ("random 5%", 0.05, 1.0),
+    ("random 10%", 0.10, 1.0),
+    ("bursty 5%, burst 3", 0.05, 3.0),
+    ("bursty 10%, burst 3", 0.10, 3.0),
+)
+
+###############################################################################
+# Function : RunScenario
+#
+# Run one loss scenario in both modes
+###############################################################################
+
+def RunScenario(oConfig, oLink, iPayload, fLoss, fBurst, iRuns):
+    '''
+    Returns the mean rounds, completion time, APDUs and bytes in each mode
+    over the runs which completed in both, and the number of those runs.
+    '''
+    aTotals = {False: [0.0, 0.0, 0.0, 0.0], True: [0.0, 0.0, 0.0, 0.0]}
+    iBoth = 0
+    for iRun in range(iRuns):
+        dRuns = {}
+        for bMultiGap in (False, True):
+            oRunConfig = oConfig._replace(bMultiGap=bMultiGap, aCltDropMsgs=(), aSvrDropMsgs=(),
+                                          oCltLoss=GBTLoss.CreateLoss(fLoss, fBurst, 2 * iRun),
+                                          oSvrLoss=GBTLoss.CreateLoss(fLoss, fBurst, 2 * iRun + 1))
+            dRuns[bMultiGap] = GBTSimEngine.RunTransfer(oRunConfig, 'x' * iPayload, "request", oLink)
+        if all(d['bComplete'] and d['bVerified'] for d in dRuns.values()):
+            iBoth += 1
+            for bMultiGap, d in dRuns.items():
+                for i, x in enumerate((d['iRounds'], d['fRxTime'], d['iApdus'], d['iBytes'])):
+                    aTotals[bMultiGap][i] += x
+    if iBoth == 0:
+        return None, None, 0
+    return [x / iBoth for x in aTotals[False]], [x / iBoth for x in aTotals[True]], iBoth
+
+###############################################################################
+# Function : GBTRecoveryBenchMain
+#
+# Main function
+###############################################################################
+
+def GBTRecoveryBenchMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare standard and NON-STANDARD multi-gap GBT recovery "
+                                      "under random and bursty loss.")
+    oParser.add_argument("--payload", type=int, default=4000, help="payload size in bytes")
+    oParser.add_argument("-b", "--block-size", type=int, default=32, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--window", type=int, default=16, help="server BTW, i.e. the window of the request")
+    oParser.add_argument("--latency", type=float, default=0.1, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("--timeout", type=float, default=2.0, help="client timeout in seconds")
+    oParser.add_argument("--runs", type=int, default=200, help="runs per scenario")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, SvrBTW=oArgs.window,
+                                              tTimeouts=(oArgs.timeout, oArgs.timeout))
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    print("Payload %d bytes, block %d, window %d, latency %.3f s, %.0f bit/s, timeout %.1f s, %d runs" %
+          (oArgs.payload, oArgs.block_size, oArgs.window, oArgs.latency, oArgs.bit_rate, oArgs.timeout, oArgs.runs))
+    print("%-20s %5s | %-22s | %-25s | %-22s | %-22s" %
+          ("Scenario", "runs", "rounds std/multi/saved", "time (s) std/multi/saved", "APDUs std/multi/saved",
+           "bytes std/multi/saved"))
+    for sName, fLoss, fBurst in RB_SCENARIOS:
+        aStd, aMulti, iBoth = RunScenario(oConfig, oLink, oArgs.payload, fLoss, fBurst, oArgs.runs)
+        if iBoth == 0:
+            print("%-20s %5d | no run completed in both modes" % (sName, 0))
+            continue
+        aCols = []
+        for i, sFormat in enumerate(("%6.1f %6.1f", "%7.2f %7.2f", "%6.1f %6.1f", "%6.0f %6.0f")):
+            fSaved = 100.0 * (aStd[i] - aMulti[i]) / aStd[i]
+            aCols.append((sFormat % (aStd[i], aMulti[i])) + " %5.1f%%" % fSaved)
+        print("%-20s %5d | %-22s | %-25s | %-22s | %-22s" % ((sName, iBoth) + tuple(aCols)))
+
+if __name__ == '__main__':
+    GBTRecoveryBenchMain()
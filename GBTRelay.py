@@ -0,0 +1,373 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Gateway relaying GBT between a head-end and a meter
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# The gateway
+# -----------
+# The head-end (client) reaches the meter (server) through a gateway, which
+# terminates GBT on each hop: a server thread towards the head-end and a
+# client thread towards the meter, each with its own configuration (block
+# size, windows, timeouts) and link. A payload received on one hop is sent
+# on again on the other:
+# - Store-and-forward: the whole payload is reassembled, then sent on.
+# - Cut-through: the contiguous prefix of the blocks received is sent on as
+#   it arrives. Blocks are cut again to the block size of the next hop, the
+#   last part being held back until the end of the payload is known, so
+#   that LB can be set. When all the blocks available have been
+#   acknowledged, the sending side waits for more rather than ending the
+#   stream, and does not run its timer.
+# If the session on either hop is aborted, the gateway aborts the other.
+#
+# Buffer occupancy is the payload held by the gateway: the blocks received
+# and not yet sent on, and the blocks sent on and not yet acknowledged. It
+# is counted in whole blocks of each hop.
+
+import argparse
+import GBT
+import GBTClientThread
+import GBTHeadEnd
+import GBTLoss
+import GBTServerThread
+import GBTSimEngine
+
+# Relay modes
+RELAY_STORE_AND_FORWARD = "store-and-forward"
+RELAY_CUT_THROUGH = "cut-through"
+RELAY_MODES = (RELAY_STORE_AND_FORWARD, RELAY_CUT_THROUGH)
+
+###############################################################################
+# Class : cRelaySender
+#
+# Sends a stream whose blocks are added as they arrive
+###############################################################################
+
+class cRelaySender():
+    '''
+    Mixin for the gateway threads. StartRelay() starts a stream to which
+    AddData() adds the payload in parts. Until the last part has been
+    added, the stream is pending: an empty SQ means waiting for more, not
+    that the stream has been sent.
+    '''
+
+    def InitRelay(self):
+        self.bTxPending = False
+        self.bTxStalled = False # Waiting for blocks to send
+        self.txPart = None # Part of a block held back
+        self.aTxParts = []
+
+    def IsTxPending(self):
+        return self.bTxPending
+
+    def StartRelay(self):
+        self.StartGBT()
+        self.bTxPending = True
+        self.bTxStalled = True
+        self.txPart = None
+        self.aTxParts = []
+
+    def AddData(self, data, bLast):
+        '''Add a part of the payload, the last part if bLast.'''
+        self.aTxParts.append(data)
+        if self.txPart is not None:
+            data = self.txPart + data
+        maxPayload = self.oConfig.MaxPayload
+        # Hold back at least one byte until the last part, which decides LB
+        iBlocks = -(-len(data) // maxPayload) if bLast else (len(data) - 1) // maxPayload
+        bn = self.oGBTStateVars.NextBN
+        for i in range(iBlocks):
+            BD = data[i * maxPayload:(i + 1) * maxPayload]
+            self.dSQ[bn] = GBT.cGBTBlock(int(bLast and (i == iBlocks - 1)), bn, BD)
+            bn += 1
+        self.oGBTStateVars.NextBN = bn
+        self.txPart = data[iBlocks * maxPayload:]
+        if bLast:
+            self.bTxPending = False
+            self.txData = data[:0].join(self.aTxParts)
+        if (iBlocks > 0) and self.bTxStalled and self.bGBTProcessing:
+            self.bTxStalled = False
+            self.SendGBTAPDUStream()
+
+    def SendGBTAPDUStream(self):
+        if self.bTxPending and (len(self.dSQ) == 0):
+            # Nothing to send yet. Sent when AddData() adds blocks.
+            self.bTxStalled = True
+            return
+        GBT.cGBTThread.SendGBTAPDUStream(self)
+
+    def StartTimer(self):
+        # No response is awaited while waiting for blocks to send
+        if not self.bTxStalled:
+            GBT.cGBTThread.StartTimer(self)
+
+    def DecodePayload(self, data):
+        # The gateway forwards the stream as it was carried, the far end decodes it
+        return data
+
+    def GetHeldBytes(self):
+        '''Payload held for sending: blocks in SQ and the part held back.'''
+        iHeld = sum(1 for blk in self.dSQ.values() if blk.BD is not None) * self.oConfig.MaxPayload
+        if self.bTxPending and (self.txPart is not None):
+            iHeld += len(self.txPart)
+        return iHeld
+
+###############################################################################
+# Class : cRelayServerThread
+#
+# Gateway thread towards the head-end
+###############################################################################
+
+class cRelayServerThread(cRelaySender, GBTServerThread.cGBTServerThread):
+    def __init__(self, oConfig=None):
+        GBTServerThread.cGBTServerThread.__init__(self, oConfig)
+        self.oThread.name = "Relay Server Thread"
+        self.InitRelay()
+
+###############################################################################
+# Class : cRelayClientThread
+#
+# Gateway thread towards the meter
+###############################################################################
+
+class cRelayClientThread(cRelaySender, GBTClientThread.cGBTClientThread):
+    def __init__(self, oConfig=None):
+        GBTClientThread.cGBTClientThread.__init__(self, oConfig)
+        self.oThread.name = "Relay Client Thread"
+        self.InitRelay()
+
+###############################################################################
+# Class : cGBTRelay
+#
+# Head-end, gateway and meter in simulated time
+###############################################################################
+
+class cGBTRelay():
+    '''
+    Runs one transfer between a head-end and a meter through a gateway in
+    simulated time. oHeadEndConfig and oHeadEndLink are for the hop between
+    the head-end and the gateway, oMeterConfig and oMeterLink for the hop
+    between the gateway and the meter.
+    '''
+
+    # Constructor
+    def __init__(self, oHeadEndConfig, oMeterConfig, sMode=RELAY_STORE_AND_FORWARD,
+                 oHeadEndLink=GBTSimEngine.cLinkModel(), oMeterLink=GBTSimEngine.cLinkModel(), bVerbose=False):
+        if sMode not in RELAY_MODES:
+            raise ValueError("Unknown relay mode %s" % sMode)
+        self.sMode = sMode
+        self.oEngine = GBTSimEngine.cSimEngine()
+        self.oEngine.fnHandled = self.Handled
+        oLogger = GBTSimEngine.cSimLogger(self.oEngine, bVerbose)
+        self.oHeadEnd = GBTClientThread.cGBTClientThread(oHeadEndConfig)
+        self.oRelayServer = cRelayServerThread(oHeadEndConfig)
+        self.oRelayClient = cRelayClientThread(oMeterConfig)
+        self.oMeter = GBTServerThread.cGBTServerThread(oMeterConfig)
+        for oThread in (self.oHeadEnd, self.oRelayServer, self.oRelayClient, self.oMeter):
+            self.oEngine.AddEndpoint(oThread, oLogger)
+        self.oEngine.Connect(self.oHeadEnd, self.oRelayServer, oHeadEndLink)
+        self.oEngine.Connect(self.oRelayClient, self.oMeter, oMeterLink)
+
+    def Forward(self):
+        '''Send on what the gateway has received and may forward.'''
+        oIn, oOut = self.oIn, self.oOut
+        bLast = oIn.rxData is not None
+        if bLast:
+            # RQ has been cleared, the rest is in the payload
+            aParts = [oIn.rxData[self.iFwdBytes:]]
+        elif self.sMode == RELAY_CUT_THROUGH:
+            aParts = []
+            bn = self.iFwdBlocks + 1
+            while (bn in oIn.dRQ) and (oIn.dRQ[bn].BD is not None):
+                aParts.append(oIn.dRQ[bn].BD)
+                bn += 1
+            self.iFwdBlocks = bn - 1
+        else:
+            return
+        if not aParts or (not bLast and not aParts[0]):
+            return
+        data = aParts[0][:0].join(aParts)
+        if not oOut.bTxPending:
+            oOut.StartRelay()
+            self.fFirstOut = self.oEngine.fNow
+        self.iFwdBytes += len(data)
+        oOut.AddData(data, bLast)
+        if bLast:
+            self.fRelayRx = self.oEngine.fNow
+            self.bInDone = True
+
+    def GetHeldBytes(self):
+        iHeld = 0
+        if not self.bInDone:
+            iHeld += max(0, len(self.oIn.dRQ) - self.iFwdBlocks) * self.oIn.oConfig.MaxPayload
+        if self.oOut.bGBTProcessing:
+            iHeld += self.oOut.GetHeldBytes()
+        return iHeld
+
+    def Handled(self, oOwner):
+        fNow = self.oEngine.fNow
+        self.fArea += self.iHeld * (fNow - self.fLast)
+        self.fLast = fNow
+        if not self.bInDone:
+            self.Forward()
+        # An abort on one hop aborts the other
+        for oThread, oOther in ((self.oRelayServer, self.oRelayClient), (self.oRelayClient, self.oRelayServer)):
+            if (oThread.sAbortReason is not None) and oOther.bGBTProcessing:
+                oOther.bTxPending = False
+                oOther.AbortGBT("Relay: %s" % oThread.sAbortReason)
+        if (self.fRxTime is None) and (self.oReceiver.rxData is not None):
+            self.fRxTime = fNow
+        self.iHeld = self.GetHeldBytes()
+        self.iPeakHeld = max(self.iPeakHeld, self.iHeld)
+
+    def IsDone(self):
+        return all(oThread.oDoneEvent.is_set() for oThread in (self.oSender, self.oIn, self.oOut, self.oReceiver)) \
+               and (self.bInDone or (self.oIn.sAbortReason is not None))
+
+    def Run(self, payload, sDirection="request", fMaxTime=3600.0):
+        '''
+        Run the transfer of payload, a request from the head-end or a
+        response from the meter. Returns a dictionary of statistics.
+        fRxTime is the end-to-end latency, the time at which the final
+        receiver had the whole payload (None if it never did).
+        '''
+        if sDirection == "request":
+            self.oSender, self.oIn, self.oOut, self.oReceiver = \
+                self.oHeadEnd, self.oRelayServer, self.oRelayClient, self.oMeter
+            oEvt = GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, payload)
+        else:
+            self.oSender, self.oIn, self.oOut, self.oReceiver = \
+                self.oMeter, self.oRelayClient, self.oRelayServer, self.oHeadEnd
+            oEvt = GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, payload)
+        self.iFwdBlocks = 0
+        self.iFwdBytes = 0
+        self.bInDone = False
+        self.fFirstOut = None
+        self.fRelayRx = None
+        self.fRxTime = None
+        self.iHeld = 0
+        self.iPeakHeld = 0
+        self.fArea = 0.0
+        self.fLast = 0.0
+        self.oEngine.Schedule(0.0, self.oSender.HandleEvent, oEvt)
+        bDone = self.oEngine.Run(self.IsDone, fMaxTime)
+        aThreads = (self.oSender, self.oIn, self.oOut, self.oReceiver)
+        sAbortReason = next((oThread.sAbortReason for oThread in aThreads if oThread.sAbortReason is not None), None)
+        dHops = {}
+        for sHop, oClient, oServer in (("head-end", self.oHeadEnd, self.oRelayServer),
+                                       ("meter", self.oRelayClient, self.oMeter)):
+            dHops[sHop] = {
+                'iCltApdus': oClient.iTxCnt,
+                'iSvrApdus': oServer.iTxCnt,
+                'iBytes': oClient.oPeerThread.iTxBytes + oServer.oPeerThread.iTxBytes,
+                'iRounds': oClient.iSAScnt + oServer.iSAScnt,
+                'iTimeouts': oClient.iTimeoutCnt + oServer.iTimeoutCnt,
+            }
+        fTime = self.oEngine.fNow
+        return {
+            'bComplete': bDone and (sAbortReason is None),
+            'bVerified': self.oReceiver.rxData == payload,
+            'fTime': fTime,
+            'fRxTime': self.fRxTime,
+            'fRelayRx': self.fRelayRx, # Time at which the gateway had the whole payload
+            'fFirstOut': self.fFirstOut, # Time at which the gateway started sending on
+            'iPeakHeld': self.iPeakHeld,
+            'fMeanHeld': self.fArea / fTime if fTime > 0.0 else 0.0,
+            'dHops': dHops,
+            'sAbortReason': sAbortReason,
+        }
+
+###############################################################################
+# Function : GBTRelayMain
+#
+# Main function
+###############################################################################
+
+def GBTRelayMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare store-and-forward and cut-through GBT relaying "
+                                      "through a gateway.")
+    oParser.add_argument("--payload", type=int, default=4000, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="response")
+    oParser.add_argument("--runs", type=int, default=20, help="runs per mode")
+    oParser.add_argument("--timeout", type=float, default=30.0, help="timeout in seconds on both hops")
+    for sHop, fLatency, fBitRate, iBlock, iWindow in (("head-end", 0.1, 64000.0, 256, 16),
+                                                      ("meter", 0.05, 2400.0, 64, 6)):
+        oParser.add_argument("--%s-latency" % sHop, type=float, default=fLatency, help="one way latency in seconds")
+        oParser.add_argument("--%s-bit-rate" % sHop, type=float, default=fBitRate, help="bit rate, 0 = infinite")
+        oParser.add_argument("--%s-loss" % sHop, type=float, default=0.0, help="loss probability in each direction")
+        oParser.add_argument("--%s-block" % sHop, type=int, default=iBlock, help="GBT_MAX_PAYLOAD")
+        oParser.add_argument("--%s-window" % sHop, type=int, default=iWindow, help="BTW of both sides")
+    oArgs = oParser.parse_args(aArgs)
+
+    dHopArgs = {}
+    for sHop in ("head-end", "meter"):
+        sArg = sHop.replace('-', '_')
+        oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=getattr(oArgs, sArg + "_block"),
+                                                  CltBTW=getattr(oArgs, sArg + "_window"),
+                                                  SvrBTW=getattr(oArgs, sArg + "_window"),
+                                                  aCltDropMsgs=(), aSvrDropMsgs=(),
+                                                  tTimeouts=(oArgs.timeout, oArgs.timeout))
+        oLink = GBTSimEngine.cLinkModel(getattr(oArgs, sArg + "_latency"), getattr(oArgs, sArg + "_bit_rate"))
+        dHopArgs[sHop] = (oConfig, oLink, getattr(oArgs, sArg + "_loss"))
+        print("%-8s hop: block %d, window %d, latency %.3f s, %.0f bit/s, loss %.3f" %
+              (sHop, oConfig.MaxPayload, oConfig.SvrBTW, oLink.fLatency, oLink.fBitRate, dHopArgs[sHop][2]))
+    print("Payload %d bytes %s, %d runs" % (oArgs.payload, oArgs.direction, oArgs.runs))
+    print("%-18s %6s | %-23s | %-17s | %-15s | %-15s" %
+          ("Mode", "failed", "latency (s) p50/p90/p99", "held bytes peak/mean", "head-end APDUs", "meter APDUs"))
+
+    payload = 'x' * oArgs.payload
+    for sMode in RELAY_MODES:
+        aTimes = []
+        iPeak = 0
+        fMean = 0.0
+        dApdus = {"head-end": 0, "meter": 0}
+        for iRun in range(oArgs.runs):
+            aConfigs = []
+            for iHop, sHop in enumerate(("head-end", "meter")):
+                oConfig, oLink, fLoss = dHopArgs[sHop]
+                iSeed = 4 * iRun + 2 * iHop
+                aConfigs.append(oConfig._replace(oCltLoss=GBTLoss.CreateLoss(fLoss, 1.0, iSeed),
+                                                 oSvrLoss=GBTLoss.CreateLoss(fLoss, 1.0, iSeed + 1)))
+            oRelay = cGBTRelay(aConfigs[0], aConfigs[1], sMode, dHopArgs["head-end"][1], dHopArgs["meter"][1])
+            d = oRelay.Run(payload, oArgs.direction)
+            if not (d['bComplete'] and d['bVerified']):
+                continue
+            aTimes.append(d['fRxTime'])
+            iPeak = max(iPeak, d['iPeakHeld'])
+            fMean += d['fMeanHeld']
+            for sHop, dHop in d['dHops'].items():
+                dApdus[sHop] += dHop['iCltApdus'] + dHop['iSvrApdus']
+        aTimes.sort()
+        iDone = len(aTimes)
+        if iDone == 0:
+            print("%-18s %6d | no run completed" % (sMode, oArgs.runs))
+            continue
+        print("%-18s %6d | %7.2f %7.2f %7.2f | %8d %8.0f | %15.1f | %15.1f" %
+              (sMode, oArgs.runs - iDone, GBTHeadEnd.Percentile(aTimes, 50), GBTHeadEnd.Percentile(aTimes, 90),
+               GBTHeadEnd.Percentile(aTimes, 99), iPeak, fMean / iDone,
+               dApdus["head-end"] / float(iDone), dApdus["meter"] / float(iDone)))
+
+if __name__ == '__main__':
+    GBTRelayMain()
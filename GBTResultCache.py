@@ -0,0 +1,280 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Content-addressed cache of simulation results
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# A scenario is a JSON serialisable dictionary which fully defines a run:
+# payload (or its size or digest), GBT_MAX_PAYLOAD, windows, link, loss
+# seeds, timeouts and so on. Its key is a hash of the scenario, in canonical
+# JSON, and of the code version, a hash of the source of the modules which
+# determine the results. A session configuration is put in a scenario with
+# GetConfigScenario(), so that defaults changed at run time are in it.
+# Changing any of them gives new keys, so results are never reused across
+# code changes; stale entries are evicted in time.
+#
+# Results are kept in a local SQLite database, looked up by key (the primary
+# key) and evicted least recently used first once the database holds more
+# than a size limit.
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Modules whose source determines simulation results
+RC_CODE_MODULES = ("BaseThread.py", "EvQThread.py", "GBT.py", "GBTClientThread.py", "GBTServerThread.py",
+                   "GBTLoss.py", "GBTWatchdog.py", "GBTBlockTracker.py", "GBTCheckpoint.py", "GBTSimEngine.py",
+                   "GBTCompress.py", "GBTOptimizer.py")
+
+# Default size limit of the database contents in bytes
+RC_MAX_BYTES = 64 * 1024 * 1024
+
+# Keys looked up per query
+RC_BATCH = 500
+
+RC_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    scenario TEXT NOT NULL,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS results_used ON results (used);
+CREATE INDEX IF NOT EXISTS results_code ON results (code);
+'''
+
+gsCodeVersion = None
+
+###############################################################################
+# Function : GetCodeVersion
+#
+# Hash of the source of the modules which determine simulation results
+###############################################################################
+
+def GetCodeVersion():
+    global gsCodeVersion
+    if gsCodeVersion is None:
+        oHash = hashlib.sha256()
+        sDir = os.path.dirname(os.path.abspath(__file__))
+        for sModule in RC_CODE_MODULES:
+            oHash.update(sModule.encode('utf-8'))
+            with open(os.path.join(sDir, sModule), 'rb') as oFile:
+                oHash.update(oFile.read())
+        gsCodeVersion = oHash.hexdigest()[:16]
+    return gsCodeVersion
+
+###############################################################################
+# Function : GetConfigScenario
+#
+# Scenario fields of a session configuration
+###############################################################################
+
+def GetConfigScenario(oConfig):
+    '''
+    A GBT.cGBTConfig as a dictionary. Loss models are given by their repr(),
+    which includes their parameters and seed, as is the compression, a
+    named tuple whose type JSON would drop.
+    '''
+    dScenario = {}
+    for sField, x in oConfig._asdict().items():
+        if sField == 'oBlockCache':
+            continue # Does not change results
+        if (x is not None) and (hasattr(x, '_fields') or not isinstance(x, (bool, int, float, str, tuple, list))):
+            x = repr(x)
+        dScenario[sField] = x
+    return dScenario
+
+###############################################################################
+# Function : GetKey
+#
+# Key of a scenario
+###############################################################################
+
+def GetKey(dScenario, sCode=None):
+    sScenario = json.dumps(dScenario, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(((sCode or GetCodeVersion()) + sScenario).encode('utf-8')).hexdigest(), sScenario
+
+###############################################################################
+# Class : cResultCache
+#
+# SQLite result cache
+###############################################################################
+
+class cResultCache():
+    '''
+    Result cache in the SQLite database sPath, holding at most about
+    iMaxBytes of scenarios and results. Results are anything JSON
+    serialisable; tuples come back as lists.
+    '''
+
+    # Constructor
+    def __init__(self, sPath, iMaxBytes=RC_MAX_BYTES, sCode=None):
+        self.sPath = sPath
+        self.iMaxBytes = iMaxBytes
+        self.sCode = sCode or GetCodeVersion()
+        self.oDb = sqlite3.connect(sPath)
+        self.oDb.executescript(RC_SCHEMA)
+        self.iHits = 0
+        self.iMisses = 0
+        self.iEvicted = 0
+
+    def Close(self):
+        self.oDb.close()
+
+    def GetMany(self, aScenarios):
+        '''Returns a list with the result of each scenario, None if not cached.'''
+        aKeys = [GetKey(dScenario, self.sCode)[0] for dScenario in aScenarios]
+        dFound = {}
+        for i in range(0, len(aKeys), RC_BATCH):
+            aBatch = aKeys[i:i + RC_BATCH]
+            sQuery = "SELECT key, result FROM results WHERE key IN (%s)" % ','.join('?' * len(aBatch))
+            dFound.update(self.oDb.execute(sQuery, aBatch).fetchall())
+        if dFound:
+            with self.oDb:
+                self.oDb.executemany("UPDATE results SET used = ?, hits = hits + 1 WHERE key = ?",
+                                     [(time.time(), sKey) for sKey in dFound])
+        aResults = [json.loads(dFound[sKey]) if sKey in dFound else None for sKey in aKeys]
+        self.iHits += len(dFound)
+        self.iMisses += len(aKeys) - len(dFound)
+        return aResults
+
+    def Get(self, dScenario):
+        return self.GetMany([dScenario])[0]
+
+    def PutMany(self, aItems):
+        '''aItems are (scenario, result) pairs.'''
+        fNow = time.time()
+        aRows = []
+        for dScenario, result in aItems:
+            sKey, sScenario = GetKey(dScenario, self.sCode)
+            sResult = json.dumps(result, separators=(',', ':'))
+            aRows.append((sKey, self.sCode, sScenario, sResult, len(sKey) + len(sScenario) + len(sResult), fNow, fNow))
+        with self.oDb:
+            self.oDb.executemany("INSERT OR REPLACE INTO results (key, code, scenario, result, size, created, used) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)", aRows)
+        self.Evict()
+
+    def Put(self, dScenario, result):
+        self.PutMany([(dScenario, result)])
+
+    def Run(self, aScenarios, fnRunMany):
+        '''
+        Results of the scenarios, running only those not cached.
+        fnRunMany(list of scenarios) returns the list of their results.
+        '''
+        aResults = self.GetMany(aScenarios)
+        aTodo = [i for i, result in enumerate(aResults) if result is None]
+        if aTodo:
+            aNew = fnRunMany([aScenarios[i] for i in aTodo])
+            self.PutMany([(aScenarios[i], result) for i, result in zip(aTodo, aNew)])
+            for i, result in zip(aTodo, aNew):
+                aResults[i] = json.loads(json.dumps(result)) # As if from the cache
+        return aResults
+
+    def Query(self, bAllCode=False, **dMatch):
+        '''
+        (scenario, result) pairs of the cached scenarios whose top level
+        fields equal those given, e.g. Query(MaxPayload=32). Only results
+        of this code version unless bAllCode.
+        '''
+        aWhere = []
+        aArgs = []
+        if not bAllCode:
+            aWhere.append("code = ?")
+            aArgs.append(self.sCode)
+        for sField, x in dMatch.items():
+            aWhere.append("json_extract(scenario, ?) = json_extract(?, '$')")
+            aArgs += ["$." + json.dumps(sField), json.dumps(x, sort_keys=True)]
+        sQuery = "SELECT scenario, result FROM results"
+        if aWhere:
+            sQuery += " WHERE " + " AND ".join(aWhere)
+        return [(json.loads(s), json.loads(r)) for s, r in self.oDb.execute(sQuery, aArgs)]
+
+    def Evict(self):
+        '''
+        Evict entries of other code versions, which can no longer be hit,
+        least recently used first, then entries of this code version, least
+        recently used first, until under iMaxBytes.
+        '''
+        iBytes = self.oDb.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if iBytes <= self.iMaxBytes:
+            return
+        # Aim a little under the limit, so that eviction is not needed on every put
+        iExcess = iBytes - int(0.9 * self.iMaxBytes)
+        aKeys = []
+        for sKey, iSize in self.oDb.execute("SELECT key, size FROM results ORDER BY code = ?, used", (self.sCode,)):
+            if iExcess <= 0:
+                break
+            aKeys.append((sKey,))
+            iExcess -= iSize
+        with self.oDb:
+            self.oDb.executemany("DELETE FROM results WHERE key = ?", aKeys)
+        self.iEvicted += len(aKeys)
+
+    def GetStats(self):
+        iEntries, iBytes, iCurrent = self.oDb.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(code = ?), 0) FROM results", (self.sCode,)).fetchone()
+        return {'iEntries': iEntries, 'iBytes': iBytes, 'iCurrent': iCurrent, 'iHits': self.iHits,
+                'iMisses': self.iMisses, 'iEvicted': self.iEvicted}
+
+###############################################################################
+# Function : GBTResultCacheMain
+#
+# Main function
+###############################################################################
+
+def GBTResultCacheMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Inspect a GBT simulation result cache.")
+    oParser.add_argument("database", help="SQLite database")
+    oParser.add_argument("--query", nargs='*', metavar="FIELD=VALUE",
+                         help="print the cached scenarios and results matching all the fields (JSON values)")
+    oParser.add_argument("--all-code", action="store_true", help="include results of other code versions")
+    oArgs = oParser.parse_args(aArgs)
+
+    oCache = cResultCache(oArgs.database)
+    d = oCache.GetStats()
+    print("Code version %s: %d entries (%d of this version), %d bytes" %
+          (oCache.sCode, d['iEntries'], d['iCurrent'], d['iBytes']))
+    if oArgs.query is not None:
+        dMatch = {}
+        for sItem in oArgs.query:
+            sField, _, sValue = sItem.partition('=')
+            try:
+                dMatch[sField] = json.loads(sValue)
+            except ValueError:
+                dMatch[sField] = sValue
+        for dScenario, result in oCache.Query(oArgs.all_code, **dMatch):
+            print("%s -> %s" % (json.dumps(dScenario, sort_keys=True), json.dumps(result)))
+    oCache.Close()
+
+if __name__ == '__main__':
+    GBTResultCacheMain()
@@ -0,0 +1,167 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Compare restarting and resuming interrupted transfers
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Runs a transfer in simulated time which the sender aborts at regular
+# intervals, e.g. because the link goes down. After each abort the transfer
+# is either restarted from BN 1 or resumed from the checkpoints of both
+# sides (GBTCheckpoint). Reports the time and the total bytes sent, next to
+# those of an uninterrupted transfer. The loss models number the GBT APDUs
+# over the whole run (GBTLoss.cContinuousLoss), so a restart does not replay
+# the losses at the start of the transfer; with loss, each run therefore
+# meets different losses and only the totals are compared.
+
+import argparse
+import GBT
+import GBTCheckpoint
+import GBTClientThread
+import GBTLoss
+import GBTServerThread
+import GBTSimEngine
+
+###############################################################################
+# Function : GetRunConfig
+#
+# Configuration with loss models for one run
+###############################################################################
+
+def GetRunConfig(oConfig, fLoss):
+    '''oConfig with new loss models numbering GBT APDUs over the whole run, None if no loss.'''
+    aLoss = [GBTLoss.CreateLoss(fLoss, 1.0, iSeed) for iSeed in (0, 1)]
+    aLoss = [None if oLoss is None else GBTLoss.cContinuousLoss(oLoss) for oLoss in aLoss]
+    return oConfig._replace(oCltLoss=aLoss[0], oSvrLoss=aLoss[1])
+
+###############################################################################
+# Function : RunInterrupted
+#
+# Run a transfer with forced aborts
+###############################################################################
+
+def RunInterrupted(oConfig, payload, oLink, fInterval, iAborts, bResume, sDirection="request", fMaxTime=36000.0):
+    '''
+    Run a transfer which the sender aborts every fInterval seconds, at most
+    iAborts times. After an abort, once nothing is left in flight, the
+    transfer is resumed from checkpoints if bResume, otherwise restarted.
+    Checkpoints go through the file encoding, as if saved and loaded.
+    Returns a dictionary of statistics.
+    '''
+    oEngine = GBTSimEngine.cSimEngine()
+    oLogger = GBTSimEngine.cSimLogger(oEngine)
+    oClient = GBTClientThread.cGBTClientThread(oConfig)
+    oServer = GBTServerThread.cGBTServerThread(oConfig)
+    oEngine.AddEndpoint(oClient, oLogger)
+    oEngine.AddEndpoint(oServer, oLogger)
+    oEngine.Connect(oClient, oServer, oLink)
+
+    if sDirection == "request":
+        oSender, oReceiver = oClient, oServer
+        oEvt = GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, payload)
+    else:
+        oSender, oReceiver = oServer, oClient
+        oEvt = GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, payload)
+
+    oEngine.Schedule(0.0, oSender.HandleEvent, oEvt)
+    iAborted = 0
+    iResumed = 0
+    iCheckpointBytes = 0
+    while True:
+        fLimit = fMaxTime if iAborted == iAborts else min(oEngine.fNow + fInterval, fMaxTime)
+        if oEngine.Run(lambda: oReceiver.rxData is not None, fLimit) or (fLimit >= fMaxTime):
+            break
+        # Forced abort, then let everything in flight arrive
+        oEngine.Schedule(0.0, oSender.AbortGBT, "Forced")
+        oEngine.Run()
+        iAborted += 1
+        if bResume and (oSender.oCheckpoint is not None) and (oReceiver.oCheckpoint is not None):
+            aEncoded = [GBTCheckpoint.Encode(o.oCheckpoint) for o in (oReceiver, oSender)]
+            iCheckpointBytes = max(iCheckpointBytes, *(len(b) for b in aEncoded))
+            oEngine.Schedule(0.0, oReceiver.HandleEvent,
+                             GBT.cEvt(GBT.EVT_RESUME_MSG, (GBTCheckpoint.Decode(aEncoded[0]), None)))
+            oEngine.Schedule(0.0, oSender.HandleEvent,
+                             GBT.cEvt(GBT.EVT_RESUME_MSG, (GBTCheckpoint.Decode(aEncoded[1]), payload)))
+            iResumed += 1
+        else:
+            oEngine.Schedule(0.0, oSender.HandleEvent, oEvt)
+    return {
+        'bVerified': oReceiver.rxData == payload,
+        'fRxTime': oEngine.fNow if oReceiver.rxData is not None else None,
+        'iAborts': iAborted,
+        'iResumed': iResumed,
+        'iBytes': oClient.oPeerThread.iTxBytes + oServer.oPeerThread.iTxBytes,
+        'iCheckpointBytes': iCheckpointBytes,
+    }
+
+###############################################################################
+# Function : GBTResumeBenchMain
+#
+# Main function
+###############################################################################
+
+def GBTResumeBenchMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Compare restarting and resuming GBT transfers "
+                                      "interrupted by forced aborts.")
+    oParser.add_argument("--payload", type=int, default=200000, help="payload size in bytes")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="response")
+    oParser.add_argument("-b", "--block-size", type=int, default=128, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--window", type=int, default=16, help="BTW of the receiver")
+    oParser.add_argument("--latency", type=float, default=0.1, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("-l", "--loss", type=float, default=0.0, help="random loss probability in each direction")
+    oParser.add_argument("--timeout", type=float, default=5.0, help="timeout in seconds")
+    oParser.add_argument("--aborts", default="1,2,4,8",
+                         help="comma separated numbers of aborts, spread evenly over an uninterrupted transfer")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.window,
+                                              SvrBTW=oArgs.window, aCltDropMsgs=(), aSvrDropMsgs=(),
+                                              tTimeouts=(oArgs.timeout, oArgs.timeout))
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    payload = 'x' * oArgs.payload
+    dClean = GBTSimEngine.RunTransfer(GetRunConfig(oConfig, oArgs.loss), payload, oArgs.direction, oLink)
+    if dClean['fRxTime'] is None:
+        print("Uninterrupted transfer did not complete")
+        return
+    fClean, iClean = dClean['fRxTime'], dClean['iBytes']
+    print("Payload %d bytes %s, block %d, window %d, latency %.3f s, %.0f bit/s, loss %.3f" %
+          (oArgs.payload, oArgs.direction, oArgs.block_size, oArgs.window, oArgs.latency, oArgs.bit_rate, oArgs.loss))
+    print("Uninterrupted: %.1f s, %d bytes" % (fClean, iClean))
+    print("%6s | %-22s | %-22s | %s" % ("aborts", "restart: time, bytes", "resume: time, bytes",
+                                        "largest checkpoint"))
+    for iAborts in [int(s) for s in oArgs.aborts.split(',')]:
+        fInterval = fClean / (iAborts + 1)
+        aCols = []
+        for bResume in (False, True):
+            d = RunInterrupted(GetRunConfig(oConfig, oArgs.loss), payload, oLink, fInterval, iAborts, bResume,
+                               oArgs.direction)
+            if not d['bVerified']:
+                aCols.append("%-22s" % "incomplete")
+                continue
+            aCols.append("%8.1f s %11d" % (d['fRxTime'], d['iBytes']))
+        print("%6d | %-22s | %-22s | %d bytes" % (iAborts, aCols[0], aCols[1], d['iCheckpointBytes']))
+
+if __name__ == '__main__':
+    GBTResumeBenchMain()
@@ -27,6 +27,7 @@
 ###############################################################################
 
 import GBT
+import GBTTransfer
 import Logger
 
 ###############################################################################
@@ -42,31 +43,60 @@ class cGBTServerThread(GBT.cGBTThread):
     '''
 
     # Constructor
-    def __init__(self):
-        GBT.cGBTThread.__init__(self, GBT.GBT_SVR_BTS, GBT.GBT_SVR_BTW, False)
+    def __init__(self, oConfig=None):
+        # oConfig is a GBT.cGBTConfig. If None, GBT.GetDefaultConfig() is used.
+        GBT.cGBTThread.__init__(self, oConfig, False)
         self.bTimerEnabled = False # OVERRIDE
         self.oThread.name = "Server Thread"
 
-    def InvokeAccessResponse(self, data):
+    def InvokeAccessResponse(self, data, oTransfer=None):
         '''
-        Invoke an ACCESS.response.
+        Invoke an ACCESS.response. Returns the future of the transfer, see
+        GBTTransfer. oTransfer is given if posted by PostAccessResponse().
         '''
+        if oTransfer is None:
+            oTransfer = GBTTransfer.cTransfer(data)
+        oFuture = oTransfer.GetFuture()
+        self.StartAccessResponse(oTransfer)
+        return oFuture
+
+    def StartAccessResponse(self, oTransfer):
+        '''Invoke an ACCESS.response for oTransfer, unless its future was cancelled.'''
+        if not self.StartTransfer(oTransfer):
+            return
         self.oLoggerThread.PostLog(Logger.LOG_CONSOLE_PRINT, "Invoking ACCESS.response")
         self.StartGBT()
-        self.FillSQ(data)
+        self.FillSQ(oTransfer.payload)
         self.SendGBTAPDUStream()
 
+    def PostAccessResponse(self, data, fTimeout=None, bAwaitResponse=False):
+        '''
+        Invoke an ACCESS.response from any thread. Returns the future of the
+        transfer, a concurrent.futures.Future, see GBTTransfer.
+        '''
+        oTransfer = GBTTransfer.cTransfer(data, fTimeout, bAwaitResponse)
+        oFuture = oTransfer.GetFuture()
+        self.SendEvent(GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, oTransfer))
+        return oFuture
+
+    async def AccessResponse(self, data, fTimeout=None, bAwaitResponse=False):
+        '''PostAccessResponse() awaited from asyncio. Returns a GBTTransfer.cTransferResult.'''
+        import asyncio # Slow to import, so only when needed
+        return await asyncio.wrap_future(self.PostAccessResponse(data, fTimeout, bAwaitResponse))
+
     def DropMsgFromClient(self, apdu:GBT.cGBTAPDU):
         '''
         Drop a message from the Client task.
         '''
         self.oLoggerThread.PostLog(Logger.LOG_BOTH_PRINT, self.GetApduStr(apdu, True))
+        self.StoreApdu(apdu, True)
 
     def HandleMsgFromClient(self, apdu:GBT.cGBTAPDU):
         '''
         Handle a message from the Client task.
         '''
         self.oLoggerThread.PostLog(Logger.LOG_BOTH_PRINT, self.GetApduStr(apdu, False))
+        self.StoreApdu(apdu, False)
         # If we are not processing and the incoming APDU has payload, start processing
         if not self.bGBTProcessing:
             if (apdu.BD != None):
@@ -80,16 +110,33 @@ class cGBTServerThread(GBT.cGBTThread):
         Pure virtual method to handle the event obtained from the queue.
         '''
         if event.evtType == GBT.EVT_PEER_MSG:
-            if self.msgCount in GBT.aSvrDropMsgs:
+            if self.IsMsgDropped():
+                self.iDropCnt += 1
                 self.DropMsgFromClient(event.data)
             else:
+                self.iRxCnt += 1
                 self.HandleMsgFromClient(event.data)
             self.msgCount += 1
         elif event.evtType == GBT.EVT_SVR_INVOKE_ACC_RSP:
-            self.InvokeAccessResponse(event.data)
+            if isinstance(event.data, GBTTransfer.cTransfer):
+                # Posted by PostAccessResponse()
+                self.StartAccessResponse(event.data)
+            else:
+                # No future is needed
+                self.StartAccessResponse(GBTTransfer.cTransfer(event.data))
+        elif event.evtType == GBT.EVT_TRANSFER_TIMEOUT_MSG:
+            self.TransferTimeout(event.data)
         elif event.evtType == GBT.EVT_TIMER_EXPIRY_MSG:
             self.oLoggerThread.PostLog(Logger.LOG_CONSOLE_PRINT, "Server timer expired")
+            self.TimerExpired()
             self.CheckRQandFillGaps()
+        elif event.evtType == GBT.EVT_PEER_ABORT_MSG:
+            self.HandlePeerAbort(event.data)
+        elif event.evtType == GBT.EVT_RESUME_MSG:
+            self.ResumeGBT(*event.data)
+        # Abort if the session is stuck
+        self.CheckWatchdog()
+        self.CheckTransfer()
 
 ###############################################################################
 # Function : GBTClientThreadMain
@@ -0,0 +1,342 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Discrete event engine to run GBT in simulated time
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+import heapq
+from typing import NamedTuple
+import GBT
+import GBTClientThread
+import GBTServerThread
+import Logger
+
+# Approximate size of GBT APDU header in bytes:
+# tag, block control, BN (2), BNA (2), length
+GBT_APDU_HEADER_SIZE = 7
+
+###############################################################################
+# Class : cLinkModel
+#
+# Link between client and server
+###############################################################################
+
+class cLinkModel(NamedTuple):
+    '''
+    Link model used in simulated time. Each direction is a separate link
+    which serialises GBT APDUs at fBitRate then delays them by fLatency.
+    '''
+    fLatency: float = 0.0 # One way latency in seconds
+    fBitRate: float = 0.0 # Bits per second. 0 = infinite
+    iHeader: int = GBT_APDU_HEADER_SIZE # Bytes added to the block data of each GBT APDU
+
+    def GetTxTime(self, iBytes):
+        if self.fBitRate <= 0.0:
+            return 0.0
+        return iBytes * 8.0 / self.fBitRate
+
+###############################################################################
+# Function : GetApduSize
+#
+# Size in bytes of a GBT APDU on the link
+###############################################################################
+
+def GetApduSize(apdu, iHeader=GBT_APDU_HEADER_SIZE):
+    iSize = iHeader
+    if apdu.BD is not None:
+        iSize += len(apdu.BD)
+    if apdu.SR is not None:
+        # NON-STANDARD selective recovery: highest BN and count, then each missing BN
+        iSize += 3 + 2 * len(apdu.SR[1])
+    return iSize
+
+###############################################################################
+# Class : cSimEvent
+#
+# Scheduled event
+###############################################################################
+
+class cSimEvent():
+    def __init__(self, fTime, fn, args):
+        self.fTime = fTime
+        self.fn = fn
+        self.args = args
+        self.bCancelled = False
+
+###############################################################################
+# Class : cSimTimer
+#
+# Timer in simulated time with the same interface as threading.Timer
+###############################################################################
+
+class cSimTimer():
+    def __init__(self, oEngine, fInterval, fn):
+        self.oEngine = oEngine
+        self.fInterval = fInterval
+        self.fn = fn
+        self.oEvent = None
+
+    def start(self):
+        self.oEvent = self.oEngine.Schedule(self.fInterval, self.fn)
+
+    def cancel(self):
+        if self.oEvent is not None:
+            self.oEvent.bCancelled = True
+
+###############################################################################
+# Class : cSimPort
+#
+# Stands in for the peer thread, delivering events over a link
+###############################################################################
+
+class cSimPort():
+    '''
+    Stands in for the peer thread of a GBT thread. Events sent to it are
+    delivered to the real peer after the link delay.
+    '''
+    def __init__(self, oEngine, oDest, oLink):
+        self.oEngine = oEngine
+        self.oDest = oDest
+        self.oLink = oLink
+        self.fBusyUntil = 0.0 # Link is serialising until this time
+        self.iTxBytes = 0
+
+    @property
+    def oGBTStateVars(self):
+        # Read by SetPeerThread(), StartGBT() and StopGBT() for the a priori Wpeer
+        return self.oDest.oGBTStateVars
+
+    def SendEvent(self, event):
+        fTxTime = 0.0
+        if event.evtType == GBT.EVT_PEER_MSG:
+            iBytes = GetApduSize(event.data, self.oLink.iHeader)
+            self.iTxBytes += iBytes
+            fTxTime = self.oLink.GetTxTime(iBytes)
+        fStart = max(self.oEngine.fNow, self.fBusyUntil)
+        self.fBusyUntil = fStart + fTxTime
+        self.oEngine.Schedule(self.fBusyUntil + self.oLink.fLatency - self.oEngine.fNow, self.oDest.HandleEvent, event)
+
+###############################################################################
+# Class : cSimLogger
+#
+# Stands in for the logger thread
+###############################################################################
+
+class cSimLogger():
+    def __init__(self, oEngine, bVerbose=False):
+        self.oEngine = oEngine
+        self.bVerbose = bVerbose
+
+    def PostLog(self, mask, sLog):
+        if self.bVerbose and (mask & Logger.LOG_CONSOLE_PRINT):
+            print("%10.6f %s" % (self.oEngine.fNow, sLog))
+
+###############################################################################
+# Class : cSimEngine
+#
+# Discrete event engine
+###############################################################################
+
+class cSimEngine():
+    '''
+    Discrete event engine. Runs GBT threads without starting them: events
+    are handled in simulated time by calling HandleEvent() directly, and
+    timers are replaced by events in simulated time. Anything a thread
+    posts to its own queue (e.g. timer expiry) is handled straight away.
+    If set, fnHandled(oOwner) is called after each event, where oOwner is
+    the object whose method handled the event (None for plain functions).
+    '''
+
+    # Constructor
+    def __init__(self):
+        self.fNow = 0.0
+        self.aHeap = []
+        self.iSeq = 0 # Keeps events at the same time in order
+        self.dEndpoints = {} # Used as an ordered set
+        self.fnHandled = None
+
+    def Schedule(self, fDelay, fn, *args):
+        oEvent = cSimEvent(self.fNow + fDelay, fn, args)
+        heapq.heappush(self.aHeap, (oEvent.fTime, self.iSeq, oEvent))
+        self.iSeq += 1
+        return oEvent
+
+    def GetTime(self):
+        return self.fNow
+
+    def Timer(self, fInterval, fn):
+        return cSimTimer(self, fInterval, fn)
+
+    def AddEndpoint(self, oThread, oLogger):
+        oThread.fnTimer = self.Timer
+        oThread.fnClock = self.GetTime
+        oThread.oLoggerThread = oLogger
+        oThread.bSimRemoved = False
+        self.dEndpoints[oThread] = None
+
+    def RemoveEndpoint(self, oThread):
+        '''
+        Remove a thread which has finished. Events still in flight to it,
+        including its timers, are discarded.
+        '''
+        oThread.bSimRemoved = True
+        self.dEndpoints.pop(oThread, None)
+
+    def Connect(self, oThreadA, oThreadB, oLink, fnPort=None):
+        '''
+        Connect two threads over a link, one port in each direction.
+        fnPort(oEngine, oDest, oLink) creates the ports instead of cSimPort,
+        e.g. to model the layers below GBT as in GBTFraming.
+        '''
+        if fnPort is None:
+            fnPort = cSimPort
+        oThreadA.SetPeerThread(fnPort(self, oThreadB, oLink))
+        oThreadB.SetPeerThread(fnPort(self, oThreadA, oLink))
+
+    def Drain(self, aThreads=None):
+        if aThreads is None:
+            aThreads = list(self.dEndpoints)
+        bBusy = True
+        while bBusy:
+            bBusy = False
+            for oThread in aThreads:
+                while not oThread.oQueue.empty():
+                    oThread.HandleEvent(oThread.oQueue.get())
+                    bBusy = True
+
+    def Run(self, fnDone=None, fMaxTime=float('inf')):
+        '''
+        Run until fnDone() returns True, there is nothing left to do,
+        or simulated time reaches fMaxTime. Returns True if fnDone()
+        returned True.
+        '''
+        while self.aHeap:
+            fTime, iSeq, oEvent = heapq.heappop(self.aHeap)
+            if oEvent.bCancelled:
+                continue
+            if fTime > fMaxTime:
+                # Keep the event so that Run() can be called again to carry on
+                heapq.heappush(self.aHeap, (fTime, iSeq, oEvent))
+                self.fNow = fMaxTime
+                return False
+            self.fNow = fTime
+            oOwner = getattr(oEvent.fn, '__self__', None)
+            if getattr(oOwner, 'bSimRemoved', False):
+                continue
+            oEvent.fn(*oEvent.args)
+            # A thread only posts to its own queue, so only its queue needs draining
+            if oOwner in self.dEndpoints:
+                self.Drain((oOwner,))
+            else:
+                self.Drain()
+            if self.fnHandled is not None:
+                self.fnHandled(oOwner)
+            if (fnDone is not None) and fnDone():
+                return True
+        return False
+
+###############################################################################
+# Function : RunTransfer
+#
+# Run a single transfer in simulated time and return statistics
+###############################################################################
+
+def RunTransfer(oConfig, payload, sDirection="request", oLink=cLinkModel(), fMaxTime=3600.0, bVerbose=False,
+                fnCreate=None, fnPort=None):
+    '''
+    Run a single transfer between a client and a server in simulated time.
+    Returns a dictionary of statistics. fTime is the simulated time at
+    which both sides had finished, fRxTime the time at which the receiver
+    had the whole payload (None if it never did). fnCreate(oConfig,
+    bIsClient) creates the threads instead of the GBT client and server,
+    e.g. to run the baselines in GBTArq. fnPort creates the ports of the
+    link, see cSimEngine.Connect().
+    '''
+    oEngine = cSimEngine()
+    oLogger = cSimLogger(oEngine, bVerbose)
+    if fnCreate is None:
+        oClient = GBTClientThread.cGBTClientThread(oConfig)
+        oServer = GBTServerThread.cGBTServerThread(oConfig)
+    else:
+        oClient = fnCreate(oConfig, True)
+        oServer = fnCreate(oConfig, False)
+    oEngine.AddEndpoint(oClient, oLogger)
+    oEngine.AddEndpoint(oServer, oLogger)
+    oEngine.Connect(oClient, oServer, oLink, fnPort)
+
+    if sDirection == "request":
+        oSender, oReceiver = oClient, oServer
+        oEvt = GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, payload)
+    else:
+        oSender, oReceiver = oServer, oClient
+        oEvt = GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, payload)
+
+    oEngine.Schedule(0.0, oSender.HandleEvent, oEvt)
+    aRxTime = [None]
+    def IsDone():
+        if aRxTime[0] is None and oReceiver.oDoneEvent.is_set():
+            aRxTime[0] = oEngine.fNow
+        return oSender.oDoneEvent.is_set() and oReceiver.oDoneEvent.is_set()
+    bDone = oEngine.Run(IsDone, fMaxTime)
+    sAbortReason = oSender.sAbortReason or oReceiver.sAbortReason
+    return {
+        'bComplete': bDone and (sAbortReason is None),
+        'bVerified': oReceiver.rxData == payload,
+        'fTime': oEngine.fNow,
+        'fRxTime': aRxTime[0],
+        'iRounds': oSender.iSAScnt, # Windows sent by the sender, including resends
+        'iApdus': oClient.iTxCnt + oServer.iTxCnt,
+        'iBytes': oClient.oPeerThread.iTxBytes + oServer.oPeerThread.iTxBytes,
+        'sAbortReason': sAbortReason,
+        'oClient': oClient,
+        'oServer': oServer,
+        'oSender': oSender,
+    }
+
+###############################################################################
+# Function : GBTSimEngineMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTSimEngineMain():
+    import GBTBlockTracker
+    import GBTLoss
+    import time
+    oConfig = GBT.GetDefaultConfig()._replace(aSvrDropMsgs=(), oSvrLoss=GBTLoss.cBernoulliLoss(0.05, 1),
+                                              oCltLoss=GBTLoss.cBernoulliLoss(0.05, 2), tTimeouts=(2.0, 2.0))
+    oLink = cLinkModel(0.05, 9600.0)
+    t = time.perf_counter()
+    dStats = RunTransfer(oConfig, 'x' * 10000, "request", oLink)
+    t = time.perf_counter() - t
+    print("Complete %s, verified %s, simulated time %.3f s, rounds %d, APDUs %d, bytes %d, run time %.3f s" %
+          (dStats['bComplete'], dStats['bVerified'], dStats['fTime'], dStats['iRounds'], dStats['iApdus'], dStats['iBytes'], t))
+    oTracker = dStats['oSender'].oBlockTracker
+    print(oTracker.GetSummary())
+    print(GBTBlockTracker.FormatHistogram(oTracker.GetHistogram()))
+    print("Worst stalls: %s" % GBTBlockTracker.FormatStalls(oTracker.GetWorstStalls()))
+
+if __name__ == '__main__':
+    GBTSimEngineMain()
@@ -28,12 +28,45 @@
 
 import pickle
 import wx
-import About
 import GBT
+import GBTApduStore
 import GBTClientThread
 import GBTServerThread
 import Logger
 
+# Interval at which the trace list catches up with the APDUs received
+TRACE_TIMER_MS = 250
+
+# Trace filter choices
+TRACE_FILTERS = (("All", GBTApduStore.AS_ALL),
+                 ("Client -> Server", GBTApduStore.AS_FROM_CLIENT_ONLY),
+                 ("Server -> Client", GBTApduStore.AS_FROM_SERVER_ONLY),
+                 ("Dropped", GBTApduStore.AS_DROPPED_ONLY))
+
+###############################################################################
+# Class : cTraceListCtrl
+#
+# Virtual list of GBT APDUs
+###############################################################################
+
+class cTraceListCtrl(wx.ListCtrl):
+    '''
+    Virtual list of the rows of a GBTApduStore.cApduView. The list asks
+    for the text of the rows on screen only, so it stays responsive
+    however many APDUs there are.
+    '''
+
+    def __init__(self, parent, oView, size):
+        wx.ListCtrl.__init__(self, parent, -1, size=size, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_HRULES)
+        self.oView = oView
+        for iColumn, sColumn in enumerate(GBTApduStore.AS_COLUMNS):
+            self.InsertColumn(iColumn, sColumn, (wx.LIST_FORMAT_RIGHT, wx.LIST_FORMAT_LEFT)[iColumn == 2],
+                              (60, 110)[iColumn in (1, 2)])
+        self.SetItemCount(0)
+
+    def OnGetItemText(self, item, column):
+        return self.oView.GetText(item, column)
+
 ###############################################################################
 # Class : cGBTSimulatorFrame
 #
@@ -56,7 +89,7 @@ class cGBTSimulatorFrame(wx.Frame):
         self.sTitle = sTitle
         self.sVersion = sVersion
         wx.Frame.__init__(self, parent, -1, self.sTitle + " " + self.sVersion,
-                          pos=(150, 150), size=(400, 400),  style=wx.DEFAULT_FRAME_STYLE)
+                          pos=(150, 150), size=(720, 720),  style=wx.DEFAULT_FRAME_STYLE)
 
         ########
         # Data #
@@ -77,6 +110,12 @@ class cGBTSimulatorFrame(wx.Frame):
         self.oGBTClientThread.oLoggerThread = self.oLoggerThread
         self.oGBTServerThread.oLoggerThread = self.oLoggerThread
 
+        # APDUs received by each GBT thread, shown in the trace list
+        self.oApduStore = GBTApduStore.cApduStore()
+        self.oApduView = GBTApduStore.cApduView(self.oApduStore)
+        self.oGBTClientThread.oApduStore = self.oApduStore
+        self.oGBTServerThread.oApduStore = self.oApduStore
+
         # Start threads
         self.oGBTClientThread.Start()
         self.oGBTServerThread.Start()
@@ -150,6 +189,31 @@ class cGBTSimulatorFrame(wx.Frame):
         self.oPayloadTextCtrl = wx.TextCtrl(oPanel, -1, self.sPayload, size = (400,200), style = wx.TE_MULTILINE)
         self.Bind(wx.EVT_TEXT, self.EvHPayloadText, self.oPayloadTextCtrl)
 
+        #### Trace
+
+        # Filter by direction
+        self.oTraceFilterChoice = wx.Choice(oPanel, -1, choices=[sLabel for sLabel, sFilter in TRACE_FILTERS])
+        self.oTraceFilterChoice.SetSelection(0)
+        self.Bind(wx.EVT_CHOICE, self.OnTraceFilter, self.oTraceFilterChoice)
+        # Filter by BN or range of BNs, applied on Enter
+        self.oTraceBNTextCtrl = wx.TextCtrl(oPanel, -1, "", size = (100,-1), style = wx.TE_PROCESS_ENTER)
+        self.oTraceBNTextCtrl.SetToolTip("BN or range of BNs, e.g. 5 or 10-20, then Enter")
+        self.Bind(wx.EVT_TEXT_ENTER, self.OnTraceFilter, self.oTraceBNTextCtrl)
+        # Keep the last APDU in view
+        self.oTraceFollowCheckBox = wx.CheckBox(oPanel, -1, "Follow")
+        self.oTraceFollowCheckBox.SetValue(True)
+        # Clear the trace
+        self.oTraceClearButton = wx.Button(oPanel, -1, "Clear", size = (60,30))
+        self.Bind(wx.EVT_BUTTON, self.OnTraceClearButton, self.oTraceClearButton)
+        # Trace list
+        self.oTraceListCtrl = cTraceListCtrl(oPanel, self.oApduView, size = (680,300))
+
+        # The trace list is updated on a timer rather than for each APDU
+        self.oTraceTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnTraceTimer, self.oTraceTimer)
+        self.oTraceTimer.Start(TRACE_TIMER_MS)
+        self.sTraceStatus = None
+
         # Use a sizer to layout the controls, stacked vertically and with
         # a 10 pixel border around each
         oVSizer = wx.BoxSizer(wx.VERTICAL)
@@ -169,6 +233,19 @@ class cGBTSimulatorFrame(wx.Frame):
         # ...add more controls to the horizontal sizer
         oVSizer.Add(oBox, 0, wx.ALL, 5)
 
+        # Trace
+        oStaticBox = wx.StaticBox(oPanel, -1, "Trace")
+        oBox = wx.StaticBoxSizer(oStaticBox, wx.VERTICAL)
+        oHBox = wx.BoxSizer(wx.HORIZONTAL)
+        oHBox.Add(self.oTraceFilterChoice, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        oHBox.Add(wx.StaticText(oPanel, -1, "BN"), 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        oHBox.Add(self.oTraceBNTextCtrl, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        oHBox.Add(self.oTraceFollowCheckBox, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        oHBox.Add(self.oTraceClearButton, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        oBox.Add(oHBox, 0)
+        oBox.Add(self.oTraceListCtrl, 1, wx.ALL | wx.EXPAND, 5)
+        oVSizer.Add(oBox, 1, wx.ALL | wx.EXPAND, 5)
+
         # ...create more HSizers and controls and add to VSizer
 
         oPanel.SetSizer(oVSizer)
@@ -197,6 +274,7 @@ class cGBTSimulatorFrame(wx.Frame):
     def EvtClose(self, evt):
         '''Event handler for global close.'''
         self.SaveData()
+        self.oTraceTimer.Stop()
         self.oGBTClientThread.Stop()
         self.oGBTServerThread.Stop()
         self.oLoggerThread.Stop()
@@ -209,6 +287,8 @@ class cGBTSimulatorFrame(wx.Frame):
     ###############################################################################
 
     def MenuFileAbout(self, evt):
+        # Imported here as wx.html is only needed for the dialog
+        import About
         oDlg = About.MyAboutBox(None, self.sTitle, self.sTitle + "<br>" + self.sVersion)
         oDlg.ShowModal()
         oDlg.Destroy()
@@ -252,6 +332,62 @@ class cGBTSimulatorFrame(wx.Frame):
         self.sPayload = self.oPayloadTextCtrl.GetValue()
         #print(self.sPayload)
 
+    ###############################################################################
+    # Method : OnTraceTimer
+    #
+    # Catch the trace list up with the APDUs received
+    ###############################################################################
+
+    def OnTraceTimer(self, evt):
+        '''
+        Coalesces the APDUs received since the last tick into one update of
+        the list. A new filter is applied to a bounded number of APDUs per
+        tick, so that the GUI stays responsive while it is.
+        '''
+        if self.oApduView.Update():
+            iRows = len(self.oApduView)
+            self.oTraceListCtrl.SetItemCount(iRows)
+            if self.oTraceFollowCheckBox.GetValue() and (iRows > 0):
+                self.oTraceListCtrl.EnsureVisible(iRows - 1)
+        sStatus = "%d APDUs, %d shown" % (len(self.oApduStore), len(self.oApduView))
+        if self.oApduView.IsBehind():
+            sStatus += ", filtering..."
+        if sStatus != self.sTraceStatus:
+            self.sTraceStatus = sStatus
+            self.SetStatusText(sStatus)
+
+    ###############################################################################
+    # Method : OnTraceFilter
+    #
+    # Filter choice or BN range changed
+    ###############################################################################
+
+    def OnTraceFilter(self, evt):
+        sFilter = TRACE_FILTERS[self.oTraceFilterChoice.GetSelection()][1]
+        try:
+            tBN = GBTApduStore.ParseBNRange(self.oTraceBNTextCtrl.GetValue())
+        except ValueError as oError:
+            self.SetStatusText(str(oError))
+            self.sTraceStatus = None
+            return
+        self.oApduView.SetFilter(sFilter, tBN)
+        # Filled in again by the timer
+        self.oTraceListCtrl.SetItemCount(0)
+        self.oTraceListCtrl.Refresh()
+
+    ###############################################################################
+    # Method : OnTraceClearButton
+    #
+    # Clear the trace
+    ###############################################################################
+
+    def OnTraceClearButton(self, evt):
+        self.oApduStore.Clear()
+        # Before the list next asks for rows which are no longer there
+        self.oApduView.Update()
+        self.oTraceListCtrl.SetItemCount(0)
+        self.oTraceListCtrl.Refresh()
+
 ###############################################################################
 # Class : GBTSimulatorApp
 #
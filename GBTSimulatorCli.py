@@ -0,0 +1,278 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Command line (headless) GBT simulation
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Note: This module must never import wx, directly or indirectly, so that it
+# can run on hosts without a display. Keep imports to the minimum needed
+# so that start-up is fast.
+
+import time
+tImportStart = time.perf_counter() # Start-up time is measured from here
+
+import argparse
+import random
+import sys
+import GBT
+import GBTBlockTracker
+import GBTClientThread
+import GBTServerThread
+import GBTLoss
+import Logger
+
+###############################################################################
+# Function : ParseDropList
+#
+# Parse a comma separated list of message sequence numbers
+###############################################################################
+
+def ParseDropList(sList):
+    return [int(s) for s in sList.split(',') if s.strip() != '']
+
+###############################################################################
+# Function : ParseArgs
+#
+# Parse command line arguments
+###############################################################################
+
+def ParseArgs(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Run a headless GBT transfer and print statistics.")
+    oGroup = oParser.add_mutually_exclusive_group(required=True)
+    oGroup.add_argument("-p", "--payload", help="inline payload text")
+    oGroup.add_argument("-f", "--payload-file", help="file containing the payload (sent as bytes)")
+    oGroup.add_argument("-g", "--generate", type=int, metavar="N", help="generate a random N character payload")
+    oGroup.add_argument("-w", "--workload", help="payload from a synthetic DLMS workload (see GBTWorkload.py)")
+    oParser.add_argument("--workload-index", type=int, default=0, help="index of the payload in the workload")
+    oParser.add_argument("--workload-cache-dir", default=None,
+                         help="directory in which to cache generated workloads, so that they are generated once")
+    oParser.add_argument("-d", "--direction", choices=("request", "response"), default="request",
+                         help="request: client sends ACCESS.request, response: server sends ACCESS.response")
+    oParser.add_argument("-b", "--block-size", type=int, default=GBT.GBT_MAX_PAYLOAD, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--clt-btw", type=int, default=GBT.GBT_CLT_BTW, help="client BTW")
+    oParser.add_argument("--svr-btw", type=int, default=GBT.GBT_SVR_BTW, help="server BTW")
+    oParser.add_argument("--clt-drop", type=ParseDropList, default=GBT.aCltDropMsgs,
+                         help="comma separated sequence numbers of messages dropped by the client")
+    oParser.add_argument("--svr-drop", type=ParseDropList, default=GBT.aSvrDropMsgs,
+                         help="comma separated sequence numbers of messages dropped by the server")
+    oParser.add_argument("-l", "--loss", type=float, default=0.0, help="random loss probability in each direction")
+    oParser.add_argument("--burst", type=float, default=1.0,
+                         help="mean loss burst length. 1 = independent loss, > 1 = Gilbert-Elliott bursty loss")
+    oParser.add_argument("--loss-trace", default=None,
+                         help="binary delivery trace to replay loss from in each direction (see GBTTrace.py)")
+    oParser.add_argument("--trace-offset", type=int, default=None,
+                         help="first trace record replayed by the client, the server starting half way round the trace. "
+                              "Derived from the seed of each direction if not given")
+    oParser.add_argument("-s", "--seed", type=int, default=0, help="seed for generated payload and random loss")
+    oParser.add_argument("--svr-timeout", type=float, default=GBT.tTimeouts[0], help="server timeout in seconds")
+    oParser.add_argument("--clt-timeout", type=float, default=GBT.tTimeouts[1], help="client timeout in seconds")
+    oParser.add_argument("--multi-gap", action="store_true",
+                         help="NON-STANDARD: recover all gaps in one round trip (see GBT.GBT_MULTI_GAP)")
+    oParser.add_argument("-t", "--max-time", type=float, default=60.0, help="give up after this many seconds")
+    oParser.add_argument("-m", "--msc", default=None, help="write PlantUML message sequence chart to this file")
+    oParser.add_argument("-v", "--verbose", action="store_true", help="print GBT diagnostics to the console")
+    return oParser.parse_args(aArgs)
+
+###############################################################################
+# Function : GetPayload
+#
+# Get the payload from the arguments
+###############################################################################
+
+def GetPayload(oArgs):
+    if oArgs.payload is not None:
+        return oArgs.payload
+    if oArgs.payload_file is not None:
+        with open(oArgs.payload_file, 'rb') as oFile:
+            return oFile.read()
+    if oArgs.workload is not None:
+        import GBTWorkload # Imports numpy, so only when needed
+        return GBTWorkload.GetPayload(GBTWorkload.ParseWorkload(oArgs.workload), oArgs.workload_index, oArgs.seed,
+                                      oArgs.workload_cache_dir)
+    oRandom = random.Random(oArgs.seed)
+    return ''.join(oRandom.choices('abcdefghijklmnopqrstuvwxyz', k=oArgs.generate))
+
+###############################################################################
+# Function : CreateLoss
+#
+# Create a loss model for one direction from the arguments
+###############################################################################
+
+def CreateLoss(oArgs, iSeed, iDirection):
+    '''
+    iDirection is 0 for the client, 1 for the server. With an explicit
+    trace offset, the server replays from half way round the trace, so
+    that the two directions do not lose the same messages.
+    '''
+    if oArgs.loss_trace is not None:
+        import GBTTrace # Only when needed
+        oTrace = GBTTrace.cTrace(oArgs.loss_trace)
+        iOffset = oArgs.trace_offset
+        if iOffset is not None:
+            iOffset += iDirection * (len(oTrace) // 2)
+        return GBTTrace.cTraceLoss(oTrace, iOffset, iSeed)
+    return GBTLoss.CreateLoss(oArgs.loss, oArgs.burst, iSeed)
+
+###############################################################################
+# Function : CreateConfig
+#
+# Create the session configuration from the arguments
+###############################################################################
+
+def CreateConfig(oArgs):
+    return GBT.GetDefaultConfig()._replace(
+        MaxPayload=oArgs.block_size,
+        CltBTW=oArgs.clt_btw,
+        SvrBTW=oArgs.svr_btw,
+        aCltDropMsgs=tuple(oArgs.clt_drop),
+        aSvrDropMsgs=tuple(oArgs.svr_drop),
+        oCltLoss=CreateLoss(oArgs, 2 * oArgs.seed, 0),
+        oSvrLoss=CreateLoss(oArgs, 2 * oArgs.seed + 1, 1),
+        tTimeouts=(oArgs.svr_timeout, oArgs.clt_timeout),
+        bMultiGap=oArgs.multi_gap)
+
+###############################################################################
+# Function : RunTransfer
+#
+# Run a single transfer and return statistics
+###############################################################################
+
+def RunTransfer(oConfig, payload, sDirection="request", fMaxTime=60.0, sMsc=None, bVerbose=False):
+    '''
+    Run a single transfer in its own client, server and logger threads.
+    Several transfers with different configurations may run concurrently
+    in the same process.
+    '''
+    # Threads, wired up as in the GUI application
+    oClient = GBTClientThread.cGBTClientThread(oConfig)
+    oServer = GBTServerThread.cGBTServerThread(oConfig)
+    oLogger = Logger.cLoggerThread(sMsc, bVerbose)
+    oClient.SetPeerThread(oServer)
+    oServer.SetPeerThread(oClient)
+    oClient.oLoggerThread = oLogger
+    oServer.oLoggerThread = oLogger
+    oClient.Start()
+    oServer.Start()
+    oLogger.Start()
+
+    if sDirection == "request":
+        oSender, oReceiver = oClient, oServer
+        oEvt = GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, payload)
+    else:
+        oSender, oReceiver = oServer, oClient
+        oEvt = GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, payload)
+
+    tStart = time.perf_counter()
+    tReady = tStart - tImportStart
+    oSender.SendEvent(oEvt)
+
+    # Sender is done when the last block has been acknowledged,
+    # receiver is done when the last block has been received.
+    bComplete = oSender.oDoneEvent.wait(fMaxTime)
+    if bComplete:
+        bComplete = oReceiver.oDoneEvent.wait(max(0.0, fMaxTime - (time.perf_counter() - tStart)))
+    tElapsed = time.perf_counter() - tStart
+    # Either side may have aborted the session. Report the side that started it.
+    oAborted = oSender
+    if (oSender.sAbortReason is None) or oSender.sAbortReason.startswith("Peer: "):
+        if oReceiver.sAbortReason is not None:
+            oAborted = oReceiver
+
+    for oThread in (oClient, oServer):
+        oThread.Stop()
+        oThread.StopTimer()
+    oLogger.Stop()
+
+    return {
+        'bComplete': bComplete and (oAborted.sAbortReason is None),
+        'sAbortReason': oAborted.sAbortReason,
+        'sAbortSnapshot': oAborted.sAbortSnapshot,
+        'sAbortBy': oAborted.GetNameStr(),
+        'bVerified': oReceiver.rxData == payload,
+        'tElapsed': tElapsed,
+        'tReady': tReady,
+        'iBlocks': (len(payload) + oConfig.MaxPayload - 1) // oConfig.MaxPayload,
+        'oClient': oClient,
+        'oServer': oServer,
+        'oLogger': oLogger,
+    }
+
+###############################################################################
+# Function : PrintStats
+#
+# Print transfer statistics
+###############################################################################
+
+def PrintStats(oArgs, payload, dStats):
+    sDir = ("ACCESS.request (client -> server)", "ACCESS.response (server -> client)")[oArgs.direction == "response"]
+    print("Direction : %s" % sDir)
+    print("Payload   : %d bytes, %d blocks of up to %d bytes" % (len(payload), dStats['iBlocks'], oArgs.block_size))
+    print("Windows   : client BTW %d, server BTW %d" % (oArgs.clt_btw, oArgs.svr_btw))
+    if dStats['sAbortReason'] is not None:
+        sResult = "aborted by %s, %s\n            %s" % (dStats['sAbortBy'], dStats['sAbortReason'], dStats['sAbortSnapshot'])
+    elif not dStats['bComplete']:
+        sResult = "incomplete after %.1f s" % oArgs.max_time
+    elif dStats['bVerified']:
+        sResult = "complete, payload verified"
+    else:
+        sResult = "complete, payload MISMATCH"
+    print("Result    : %s" % sResult)
+    print("Elapsed   : %.3f ms" % (dStats['tElapsed'] * 1e3))
+    # Block lifecycle of the sender
+    oTracker = (dStats['oClient'], dStats['oServer'])[oArgs.direction == "response"].oBlockTracker
+    print("Blocks    : %s" % oTracker.GetSummary())
+    if oTracker.GetRetransmissions() > 0:
+        print("Stalls    : %s" % GBTBlockTracker.FormatStalls(oTracker.GetWorstStalls(3)))
+    print("Latency   :\n%s" % GBTBlockTracker.FormatHistogram(oTracker.GetHistogram()))
+    for oThread in (dStats['oClient'], dStats['oServer']):
+        print("%-9s : sent %d, received %d, dropped %d, timeouts %d" %
+              (oThread.GetNameStr(), oThread.iTxCnt, oThread.iRxCnt, oThread.iDropCnt, oThread.iTimeoutCnt))
+    aQueues = []
+    for oThread in (dStats['oClient'], dStats['oServer'], dStats['oLogger']):
+        dQueue = oThread.GetQueueStats()
+        aQueues.append("%s high-water %d" % (oThread.oThread.name.split()[0].lower(), dQueue['iHighWater']))
+        if dQueue['iDropped'] or dQueue['iCoalesced'] or dQueue['iBlocked']:
+            aQueues[-1] += " (dropped %d, coalesced %d, blocked %d)" % (dQueue['iDropped'], dQueue['iCoalesced'], dQueue['iBlocked'])
+    print("Queues    : %s" % ", ".join(aQueues))
+    print("Start-up  : %.1f ms (imports and argument parsing)" % (dStats['tReady'] * 1e3))
+
+###############################################################################
+# Function : GBTSimulatorCliMain
+#
+# Main function
+###############################################################################
+
+def GBTSimulatorCliMain(aArgs=None):
+    oArgs = ParseArgs(aArgs)
+    payload = GetPayload(oArgs)
+    if len(payload) == 0:
+        print("Payload must not be empty")
+        return 2
+    dStats = RunTransfer(CreateConfig(oArgs), payload, oArgs.direction, oArgs.max_time, oArgs.msc, oArgs.verbose)
+    PrintStats(oArgs, payload, dStats)
+    return (1, 0)[dStats['bComplete'] and dStats['bVerified']]
+
+if __name__ == '__main__':
+    sys.exit(GBTSimulatorCliMain())
@@ -0,0 +1,325 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Concurrent prioritised GBT streams over one association
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Streams
+# -------
+# A GBT thread has one SQ, one RQ and one set of state variables, so one
+# client/server pair carries one stream at a time: an urgent short request
+# waits until a long transfer ahead of it has finished. Here each exchange
+# (an ACCESS.request, then the ACCESS.response once the request has been
+# acknowledged) has its own stream: its own client and server threads,
+# with their own state, SQ and RQ, over the one link of the association.
+# The GBT procedures of each stream are unchanged. Carrying several streams
+# at once is NON-STANDARD: the GBT APDU has no stream identifier, so on a
+# real link the streams would have to be told apart, e.g. by invoke-id.
+#
+# The link in each direction sends one GBT APDU at a time, at the bit rate
+# of the link, from queues kept by priority (0 = most urgent). An APDU of a
+# more urgent stream goes ahead of any APDU queued for a less urgent one, so
+# it waits for at most the APDU being sent. APDUs of the same priority are
+# sent in the order they were queued, which interleaves the windows of the
+# streams. Without priorities, all APDUs are sent in the order queued.
+#
+# iMaxStreams limits the streams open at once; exchanges wait for a free
+# stream, the most urgent first if priorities are used. One stream without
+# priorities is the association as it is today.
+
+import argparse
+import collections
+import GBT
+import GBTClientThread
+import GBTHeadEnd
+import GBTLoss
+import GBTServerThread
+import GBTSimEngine
+
+# Modes of the bench: streams open at once (None = no limit), priorities
+ST_MODES = (
+    ("one stream", 1, False),
+    ("interleaved", None, False),
+    ("prioritised", None, True),
+)
+
+###############################################################################
+# Class : cMuxLink
+#
+# One direction of the link shared by the streams
+###############################################################################
+
+class cMuxLink():
+    '''
+    Sends GBT APDUs one at a time over oLink, the most urgent queued first
+    if bPriority. Other events (aborts) are not queued.
+    '''
+
+    # Constructor
+    def __init__(self, oEngine, oLink, bPriority=True):
+        self.oEngine = oEngine
+        self.oLink = oLink
+        self.bPriority = bPriority
+        self.dQueues = collections.defaultdict(collections.deque) # Priority: (oDest, event)
+        self.iQueued = 0
+        self.iPeakQueued = 0
+        self.bBusy = False
+        self.iTxBytes = 0
+
+    def Send(self, oDest, iPriority, event):
+        if event.evtType != GBT.EVT_PEER_MSG:
+            self.oEngine.Schedule(self.oLink.fLatency, oDest.HandleEvent, event)
+            return
+        self.dQueues[iPriority if self.bPriority else 0].append((oDest, event))
+        self.iQueued += 1
+        self.iPeakQueued = max(self.iPeakQueued, self.iQueued)
+        if not self.bBusy:
+            self.SendNext()
+
+    def SendNext(self):
+        iPriority = min(i for i, aQueue in self.dQueues.items() if aQueue)
+        oDest, event = self.dQueues[iPriority].popleft()
+        self.iQueued -= 1
+        iBytes = GBTSimEngine.GetApduSize(event.data, self.oLink.iHeader)
+        self.iTxBytes += iBytes
+        fTxTime = self.oLink.GetTxTime(iBytes)
+        self.bBusy = True
+        self.oEngine.Schedule(fTxTime, self.SendDone)
+        self.oEngine.Schedule(fTxTime + self.oLink.fLatency, oDest.HandleEvent, event)
+
+    def SendDone(self):
+        self.bBusy = False
+        if self.iQueued > 0:
+            self.SendNext()
+
+###############################################################################
+# Class : cMuxPort
+#
+# Stands in for the peer thread of a stream
+###############################################################################
+
+class cMuxPort():
+    def __init__(self, oMuxLink, oDest, iPriority):
+        self.oMuxLink = oMuxLink
+        self.oDest = oDest
+        self.iPriority = iPriority
+
+    @property
+    def oGBTStateVars(self):
+        return self.oDest.oGBTStateVars
+
+    def SendEvent(self, event):
+        self.oMuxLink.Send(self.oDest, self.iPriority, event)
+
+###############################################################################
+# Class : cExchange
+#
+# An ACCESS.request and its ACCESS.response on a stream
+###############################################################################
+
+class cExchange():
+    def __init__(self, iSeq, sClass, iPriority, iRequest, iResponse, fRelease):
+        self.iSeq = iSeq
+        self.sClass = sClass
+        self.iPriority = iPriority
+        self.iRequest = iRequest
+        self.iResponse = iResponse
+        self.fRelease = fRelease
+        self.fStart = None
+        self.fEnd = None
+        self.sAbortReason = None
+        self.oClient = None
+        self.oServer = None
+        self.bResponding = False
+
+###############################################################################
+# Class : cGBTStreams
+#
+# Client and server carrying several streams over one link
+###############################################################################
+
+class cGBTStreams():
+    '''
+    Runs exchanges between a client and a server, each on its own stream,
+    in simulated time. Exchanges are added with AddExchange() and run by
+    Run(), which returns latency statistics for each class of exchange and
+    the peak streams open and GBT APDUs queued.
+    fLoss is the loss probability of GBT APDUs in each direction.
+    '''
+
+    # Constructor
+    def __init__(self, oConfig=None, oLink=GBTSimEngine.cLinkModel(), bPriority=True, iMaxStreams=None,
+                 fLoss=0.0, bVerbose=False):
+        if oConfig is None:
+            oConfig = GBT.GetDefaultConfig()
+        self.oConfig = oConfig._replace(aCltDropMsgs=(), aSvrDropMsgs=())
+        self.bPriority = bPriority
+        self.iMaxStreams = iMaxStreams
+        self.fLoss = fLoss
+        self.oEngine = GBTSimEngine.cSimEngine()
+        self.oEngine.fnHandled = self.Handled
+        self.oLogger = GBTSimEngine.cSimLogger(self.oEngine, bVerbose)
+        self.oUp = cMuxLink(self.oEngine, oLink, bPriority) # Client to server
+        self.oDown = cMuxLink(self.oEngine, oLink, bPriority) # Server to client
+        self.aExchanges = []
+        self.aWaiting = []
+        self.dByThread = {}
+        self.iOpen = 0
+        self.iPeakOpen = 0
+
+    def AddExchange(self, sClass, iRequest, iResponse, iPriority=0, fRelease=0.0):
+        oExchange = cExchange(len(self.aExchanges), sClass, iPriority, iRequest, iResponse, fRelease)
+        self.aExchanges.append(oExchange)
+        self.oEngine.Schedule(fRelease, self.Release, oExchange)
+        return oExchange
+
+    def Release(self, oExchange):
+        self.aWaiting.append(oExchange)
+        self.Dispatch()
+
+    def Dispatch(self):
+        while self.aWaiting and ((self.iMaxStreams is None) or (self.iOpen < self.iMaxStreams)):
+            if self.bPriority:
+                oExchange = min(self.aWaiting, key=lambda o: (o.iPriority, o.iSeq))
+                self.aWaiting.remove(oExchange)
+            else:
+                oExchange = self.aWaiting.pop(0)
+            self.Open(oExchange)
+
+    def Open(self, oExchange):
+        iSeed = oExchange.iSeq
+        oConfig = self.oConfig._replace(oCltLoss=GBTLoss.CreateLoss(self.fLoss, 1.0, 2 * iSeed),
+                                        oSvrLoss=GBTLoss.CreateLoss(self.fLoss, 1.0, 2 * iSeed + 1))
+        oExchange.oClient = GBTClientThread.cGBTClientThread(oConfig)
+        oExchange.oServer = GBTServerThread.cGBTServerThread(oConfig)
+        for oThread in (oExchange.oClient, oExchange.oServer):
+            self.oEngine.AddEndpoint(oThread, self.oLogger)
+            self.dByThread[oThread] = oExchange
+        oExchange.oClient.SetPeerThread(cMuxPort(self.oUp, oExchange.oServer, oExchange.iPriority))
+        oExchange.oServer.SetPeerThread(cMuxPort(self.oDown, oExchange.oClient, oExchange.iPriority))
+        oExchange.fStart = self.oEngine.fNow
+        self.iOpen += 1
+        self.iPeakOpen = max(self.iPeakOpen, self.iOpen)
+        oExchange.oClient.HandleEvent(GBT.cEvt(GBT.EVT_CLT_INVOKE_ACC_REQ, 'r' * oExchange.iRequest))
+
+    def Close(self, oExchange):
+        for oThread in (oExchange.oClient, oExchange.oServer):
+            oThread.StopTimer()
+            self.oEngine.RemoveEndpoint(oThread)
+            del self.dByThread[oThread]
+        oExchange.fEnd = self.oEngine.fNow
+        self.iOpen -= 1
+        self.Dispatch()
+
+    def Handled(self, oOwner):
+        '''Called by the engine after each event to follow the progress of exchanges.'''
+        oExchange = self.dByThread.get(oOwner)
+        if oExchange is None:
+            return
+        oClient, oServer = oExchange.oClient, oExchange.oServer
+        sAbortReason = oClient.sAbortReason or oServer.sAbortReason
+        if sAbortReason is not None:
+            oExchange.sAbortReason = sAbortReason
+            self.Close(oExchange)
+        elif not oExchange.bResponding:
+            if (oServer.rxData is not None) and (len(oServer.rxData) == oExchange.iRequest) and \
+               oClient.oDoneEvent.is_set():
+                oExchange.bResponding = True
+                oClient.rxData = None
+                oServer.HandleEvent(GBT.cEvt(GBT.EVT_SVR_INVOKE_ACC_RSP, 'x' * oExchange.iResponse))
+        elif (oClient.rxData is not None) and (len(oClient.rxData) == oExchange.iResponse):
+            self.Close(oExchange)
+
+    def Run(self, aClasses=(), fMaxTime=float('inf')):
+        '''
+        Run all exchanges. Returns the peak streams open and APDUs queued,
+        and in dClasses statistics for each class of exchange, including
+        those in aClasses which have no exchanges.
+        '''
+        self.oEngine.Run(None, fMaxTime)
+        dClasses = {}
+        for sClass in sorted(set(o.sClass for o in self.aExchanges).union(aClasses)):
+            aClass = [o for o in self.aExchanges if o.sClass == sClass]
+            aDone = sorted(o.fEnd - o.fRelease for o in aClass if (o.fEnd is not None) and (o.sAbortReason is None))
+            dClasses[sClass] = {
+                'iExchanges': len(aClass),
+                'iDone': len(aDone),
+                'fP50': GBTHeadEnd.Percentile(aDone, 50),
+                'fP95': GBTHeadEnd.Percentile(aDone, 95),
+                'fMax': GBTHeadEnd.Percentile(aDone, 100),
+                'fWaitMean': sum(o.fStart - o.fRelease for o in aClass if o.fStart is not None) / max(len(aClass), 1),
+            }
+        return {
+            'dClasses': dClasses,
+            'iPeakOpen': self.iPeakOpen,
+            'iPeakQueued': max(self.oUp.iPeakQueued, self.oDown.iPeakQueued),
+        }
+
+###############################################################################
+# Function : GBTStreamsMain
+#
+# Main function
+###############################################################################
+
+def GBTStreamsMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Measure urgent request latency with bulk transfers in the "
+                                      "background, on one stream or on concurrent prioritised streams.")
+    oParser.add_argument("--bulk", type=int, default=2, help="bulk exchanges, released at the start")
+    oParser.add_argument("--bulk-response", type=int, default=50000, help="bulk response size in bytes")
+    oParser.add_argument("--urgent", type=int, default=20, help="urgent exchanges")
+    oParser.add_argument("--urgent-interval", type=float, default=5.0, help="seconds between urgent exchanges")
+    oParser.add_argument("--urgent-response", type=int, default=200, help="urgent response size in bytes")
+    oParser.add_argument("--request", type=int, default=30, help="request size in bytes")
+    oParser.add_argument("-b", "--block-size", type=int, default=128, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--btw", type=int, default=16, help="client and server BTW")
+    oParser.add_argument("--latency", type=float, default=0.1, help="one way latency in seconds")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite")
+    oParser.add_argument("-l", "--loss", type=float, default=0.0, help="loss probability in each direction")
+    oParser.add_argument("--timeout", type=float, default=10.0, help="GBT timeout in seconds")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, CltBTW=oArgs.btw, SvrBTW=oArgs.btw,
+                                              tTimeouts=(oArgs.timeout, oArgs.timeout))
+    oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+    print("%d bulk exchanges of %d bytes, %d urgent exchanges of %d bytes every %.1f s, "
+          "block %d, BTW %d, latency %.3f s, %.0f bit/s, loss %.3f" %
+          (oArgs.bulk, oArgs.bulk_response, oArgs.urgent, oArgs.urgent_response, oArgs.urgent_interval,
+           oArgs.block_size, oArgs.btw, oArgs.latency, oArgs.bit_rate, oArgs.loss))
+    print("%-12s | %-31s | %-23s | %6s %6s" %
+          ("Mode", "urgent done, s p50/p95/max", "bulk done, s p50/max", "open", "queued"))
+    for sMode, iMaxStreams, bPriority in ST_MODES:
+        oStreams = cGBTStreams(oConfig, oLink, bPriority, iMaxStreams, oArgs.loss)
+        for i in range(oArgs.bulk):
+            oStreams.AddExchange("bulk", oArgs.request, oArgs.bulk_response, 1)
+        for i in range(oArgs.urgent):
+            oStreams.AddExchange("urgent", oArgs.request, oArgs.urgent_response, 0, (i + 1) * oArgs.urgent_interval)
+        d = oStreams.Run(("urgent", "bulk"))
+        dUrgent, dBulk = d['dClasses']['urgent'], d['dClasses']['bulk']
+        print("%-12s | %3d %8.2f %8.2f %8.2f | %3d %8.2f %8.2f | %6d %6d" %
+              (sMode, dUrgent['iDone'], dUrgent['fP50'], dUrgent['fP95'], dUrgent['fMax'],
+               dBulk['iDone'], dBulk['fP50'], dBulk['fMax'], d['iPeakOpen'], d['iPeakQueued']))
+
+if __name__ == '__main__':
+    GBTStreamsMain()
@@ -0,0 +1,293 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Loss replayed from recorded link delivery traces
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# A delivery trace is a log of the packets sent over a deployed link: for
+# each packet, when it was sent, whether it was delivered and, optionally,
+# its delay. Logs are converted once, line by line, from text to a binary
+# file of fixed size records, which is then memory-mapped, so that a trace
+# of any size is never read into memory and any record is found by its
+# index.
+#
+# Text format, one packet per line, '#' starts a comment:
+#     timestamp,delivered[,delay]
+# where delivered is 1/0, true/false, ok/lost or delivered/lost, and the
+# timestamp and delay are in seconds.
+#
+# Binary format: a header (TR_HEADER) followed by records (TR_RECORD) of
+# timestamp (float64), delivered (uint8, 1 = delivered, 0 = lost) and delay
+# (float32, NaN if not recorded), all little endian.
+#
+# cTraceLoss is a loss model (see GBTLoss.py) which drops message iMsg if
+# record (iOffset + iMsg) of the trace was lost, wrapping round at the end.
+# The offset is given or derived from a seed, so parallel runs sample
+# different segments of the same trace.
+
+import argparse
+import math
+import mmap
+import os
+import random
+import struct
+import GBTLoss
+
+# Binary trace format
+TR_MAGIC = b'GBTTRACE'
+TR_VERSION = 1
+TR_HEADER = struct.Struct('<8sHH4x') # Magic, version, record size
+TR_RECORD = struct.Struct('<dBf') # Timestamp, delivered, delay
+TR_DELIVERED_OFFSET = 8 # Offset of delivered in a record
+
+# Records converted or scanned at a time
+TR_CHUNK = 1 << 16
+
+# Text values of delivered
+TR_DELIVERED = {'1': 1, 'true': 1, 'ok': 1, 'delivered': 1, '0': 0, 'false': 0, 'lost': 0}
+
+###############################################################################
+# Class : cTraceWriter
+#
+# Writes a binary trace
+###############################################################################
+
+class cTraceWriter():
+    '''Writes records to a binary trace. Use as a context manager.'''
+
+    # Constructor
+    def __init__(self, sPath):
+        self.oFile = open(sPath, 'wb')
+        self.oFile.write(TR_HEADER.pack(TR_MAGIC, TR_VERSION, TR_RECORD.size))
+        self.aRecords = []
+        self.iCount = 0
+
+    def Write(self, fTime, bDelivered, fDelay=None):
+        self.aRecords.append(TR_RECORD.pack(fTime, int(bDelivered), float('nan') if fDelay is None else fDelay))
+        if len(self.aRecords) >= TR_CHUNK:
+            self.Flush()
+
+    def Flush(self):
+        self.oFile.write(b''.join(self.aRecords))
+        self.iCount += len(self.aRecords)
+        self.aRecords = []
+
+    def Close(self):
+        self.Flush()
+        self.oFile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *aExc):
+        self.Close()
+
+###############################################################################
+# Class : cTrace
+#
+# Memory-mapped binary trace
+###############################################################################
+
+class cTrace():
+    '''
+    Read only view of a binary trace. The file is memory-mapped, so only
+    the pages of the records read are brought into memory.
+    '''
+
+    # Constructor
+    def __init__(self, sPath):
+        self.sPath = sPath
+        with open(sPath, 'rb') as oFile:
+            bHeader = oFile.read(TR_HEADER.size)
+            if len(bHeader) < TR_HEADER.size:
+                raise ValueError("%s is not a binary trace, convert it with GBTTrace.py convert" % sPath)
+            sMagic, iVersion, iRecordSize = TR_HEADER.unpack(bHeader)
+            if sMagic != TR_MAGIC:
+                raise ValueError("%s is not a binary trace, convert it with GBTTrace.py convert" % sPath)
+            if (iVersion != TR_VERSION) or (iRecordSize != TR_RECORD.size):
+                raise ValueError("%s: unsupported trace version %d" % (sPath, iVersion))
+            self.iCount = (os.fstat(oFile.fileno()).st_size - TR_HEADER.size) // TR_RECORD.size
+            if self.iCount == 0:
+                raise ValueError("%s: trace has no records" % sPath)
+            self.oMap = mmap.mmap(oFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.iCount
+
+    def IsDelivered(self, i):
+        return self.oMap[TR_HEADER.size + i * TR_RECORD.size + TR_DELIVERED_OFFSET] == 1
+
+    def GetRecord(self, i):
+        '''Returns (timestamp, delivered, delay), delay None if not recorded.'''
+        fTime, iDelivered, fDelay = TR_RECORD.unpack_from(self.oMap, TR_HEADER.size + i * TR_RECORD.size)
+        return fTime, iDelivered == 1, None if math.isnan(fDelay) else fDelay
+
+    def GetDeliveredChunks(self):
+        '''Yields the delivered values of the records, TR_CHUNK records at a time, as bytes.'''
+        for iStart in range(0, self.iCount, TR_CHUNK):
+            iEnd = min(iStart + TR_CHUNK, self.iCount)
+            bChunk = self.oMap[TR_HEADER.size + iStart * TR_RECORD.size:TR_HEADER.size + iEnd * TR_RECORD.size]
+            yield bChunk[TR_DELIVERED_OFFSET::TR_RECORD.size]
+
+    def GetStats(self):
+        '''Loss rate, mean loss burst length and duration, scanning the trace in chunks.'''
+        iLost = 0
+        iBursts = 0
+        iPrev = 1
+        for bDelivered in self.GetDeliveredChunks():
+            iLost += bDelivered.count(0)
+            # A burst starts at each delivered to lost transition
+            iBursts += bDelivered.count(b'\x01\x00') + (iPrev == 1 and bDelivered[0] == 0)
+            iPrev = bDelivered[-1]
+        fDuration = self.GetRecord(self.iCount - 1)[0] - self.GetRecord(0)[0]
+        return {
+            'iCount': self.iCount,
+            'fLoss': iLost / float(self.iCount),
+            'fBurst': iLost / float(iBursts) if iBursts else 0.0,
+            'fDuration': fDuration,
+        }
+
+    def Close(self):
+        self.oMap.close()
+
+###############################################################################
+# Class : cTraceLoss
+#
+# Loss replayed from a trace
+###############################################################################
+
+class cTraceLoss():
+    '''
+    Trace loss model. Message iMsg is dropped if record (iOffset + iMsg) of
+    the trace, wrapping round, was lost. If iOffset is None it is derived
+    from iSeed, so the same seed always samples the same segment, or is
+    random if iSeed is also None.
+    oTrace may be a cTrace, shared read only between models, or a path.
+    '''
+    def __init__(self, oTrace, iOffset=None, iSeed=0):
+        if not isinstance(oTrace, cTrace):
+            oTrace = cTrace(oTrace)
+        self.oTrace = oTrace
+        self.iSeed = iSeed
+        if iOffset is None:
+            if iSeed is None:
+                iOffset = random.randrange(len(oTrace))
+            else:
+                iOffset = GBTLoss.SplitMix64(iSeed) % len(oTrace)
+        self.iOffset = iOffset % len(oTrace)
+
+    def IsDropped(self, iMsg):
+        return not self.oTrace.IsDelivered((self.iOffset + iMsg) % len(self.oTrace))
+
+    def GetDelay(self, iMsg):
+        '''Recorded delay of message iMsg in seconds, None if not recorded or lost.'''
+        _, bDelivered, fDelay = self.oTrace.GetRecord((self.iOffset + iMsg) % len(self.oTrace))
+        return fDelay if bDelivered else None
+
+    def __repr__(self):
+        return "cTraceLoss(%r, %d)" % (self.oTrace.sPath, self.iOffset)
+
+###############################################################################
+# Function : Convert
+#
+# Convert a text delivery log to a binary trace
+###############################################################################
+
+def Convert(sTextPath, sTracePath):
+    '''Converts line by line, so the log is never read into memory. Returns the number of records.'''
+    with open(sTextPath, 'r') as oText, cTraceWriter(sTracePath) as oWriter:
+        for iLine, sLine in enumerate(oText, 1):
+            sLine = sLine.split('#', 1)[0].strip()
+            if not sLine:
+                continue
+            aFields = [s.strip() for s in sLine.split(',')]
+            try:
+                fDelay = float(aFields[2]) if (len(aFields) > 2) and aFields[2] else None
+                oWriter.Write(float(aFields[0]), TR_DELIVERED[aFields[1].lower()], fDelay)
+            except (IndexError, KeyError, ValueError):
+                raise ValueError("%s line %d: expected timestamp,delivered[,delay]" % (sTextPath, iLine))
+    return oWriter.iCount
+
+###############################################################################
+# Function : Synthesise
+#
+# Write a synthetic bursty trace, for trying out trace replay
+###############################################################################
+
+def Synthesise(sTracePath, iCount, fLoss, fBurst, fInterval=1.0, fDelay=None, iSeed=0):
+    '''
+    Gilbert-Elliott loss as GBTLoss.cGilbertElliottLoss.FromMeanLoss(), run
+    here so that the chain is not kept in memory.
+    '''
+    fR = 1.0 / max(fBurst, 1.0)
+    fP = min(fLoss * fR / (1.0 - fLoss), 1.0)
+    oRandom = random.Random(iSeed)
+    bBad = False
+    with cTraceWriter(sTracePath) as oWriter:
+        for i in range(iCount):
+            if fBurst > 1.0:
+                bBad = (oRandom.random() >= fR) if bBad else (oRandom.random() < fP)
+            else:
+                bBad = oRandom.random() < fLoss
+            fThisDelay = None if (fDelay is None) or bBad else oRandom.expovariate(1.0 / fDelay)
+            oWriter.Write(i * fInterval, not bBad, fThisDelay)
+
+###############################################################################
+# Function : GBTTraceMain
+#
+# Main function
+###############################################################################
+
+def GBTTraceMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Convert, inspect and synthesise link delivery traces.")
+    oSubParsers = oParser.add_subparsers(dest="command", required=True)
+    oConvert = oSubParsers.add_parser("convert", help="convert a text delivery log to a binary trace")
+    oConvert.add_argument("text")
+    oConvert.add_argument("trace")
+    oInfo = oSubParsers.add_parser("info", help="print the statistics of a binary trace")
+    oInfo.add_argument("trace")
+    oSynth = oSubParsers.add_parser("synth", help="write a synthetic bursty binary trace")
+    oSynth.add_argument("trace")
+    oSynth.add_argument("--records", type=int, default=1000000)
+    oSynth.add_argument("--loss", type=float, default=0.05)
+    oSynth.add_argument("--burst", type=float, default=4.0)
+    oSynth.add_argument("--interval", type=float, default=1.0, help="seconds between packets")
+    oSynth.add_argument("--delay", type=float, default=None, help="mean delay in seconds, none if not given")
+    oSynth.add_argument("-s", "--seed", type=int, default=0)
+    oArgs = oParser.parse_args(aArgs)
+
+    if oArgs.command == "convert":
+        print("%d records written to %s" % (Convert(oArgs.text, oArgs.trace), oArgs.trace))
+    elif oArgs.command == "synth":
+        Synthesise(oArgs.trace, oArgs.records, oArgs.loss, oArgs.burst, oArgs.interval, oArgs.delay, oArgs.seed)
+    if oArgs.command in ("info", "synth"):
+        oTrace = cTrace(oArgs.trace)
+        d = oTrace.GetStats()
+        print("%s: %d records over %.1f s, loss %.4f, mean loss burst %.2f" %
+              (oArgs.trace, d['iCount'], d['fDuration'], d['fLoss'], d['fBurst']))
+        oTrace.Close()
+
+if __name__ == '__main__':
+    GBTTraceMain()
@@ -0,0 +1,350 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Transfers awaited by futures
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# InvokeAccessRequest() and InvokeAccessResponse() return a
+# concurrent.futures.Future of the transfer, so that a driver knows when it
+# ended without polling or reading the diagnostics. From any other thread,
+# PostAccessRequest() and PostAccessResponse() queue the invocation and
+# return its future, and AccessRequest() and AccessResponse() are their
+# asyncio coroutines.
+#
+# A transfer ends when the stream sent has been acknowledged, or, if
+# bAwaitResponse, when the next stream has then been received from the peer
+# (an ACCESS.request confirmed by its ACCESS.response). The future resolves
+# with a cTransferResult of the payload received (None if none was awaited)
+# and the statistics of the transfer. It fails with cTransferAborted if the
+# session was aborted, or with TimeoutError if the transfer had not ended
+# after fTimeout seconds, in which case the session is aborted.
+#
+# The thread tracks one transfer at a time, as GBT runs one stream at a
+# time: a transfer invoked before the last has ended fails the last.
+#
+# The threads import this module, so it imports only what they need.
+# concurrent.futures and asyncio are slow to import, and are imported when
+# a future or coroutine is first asked for.
+
+from typing import NamedTuple
+import GBT
+
+###############################################################################
+# Class : cTransferResult
+#
+# Result of a transfer
+###############################################################################
+
+class cTransferResult(NamedTuple):
+    payload: object # Payload received, None if no response was awaited
+    fStart: float # Thread clock, seconds
+    fEnd: float
+    iTxApdus: int # GBT APDUs sent
+    iRxApdus: int # GBT APDUs received
+    iDropped: int # GBT APDUs dropped
+    iTimeouts: int # Timer expiries
+    iRounds: int # Windows sent, including resends
+
+    @property
+    def fDuration(self):
+        return self.fEnd - self.fStart
+
+###############################################################################
+# Class : cTransferAborted
+#
+# Exception of a transfer whose session was aborted
+###############################################################################
+
+class cTransferAborted(Exception):
+    def __init__(self, sReason, sSnapshot=None, oResult=None):
+        Exception.__init__(self, sReason)
+        self.sReason = sReason
+        self.sSnapshot = sSnapshot
+        self.oResult = oResult # Statistics up to the abort
+
+###############################################################################
+# Class : cTransfer
+#
+# Transfer tracked by a GBT thread until it ends
+###############################################################################
+
+class cTransfer():
+    '''
+    Transfer of payload by a GBT thread, see cGBTThread.StartTransfer().
+    The thread calls Start() when the transfer is invoked, IsEnded() after
+    each event and End() once it has ended. Once started, the future can
+    no longer be cancelled.
+    '''
+
+    # Constructor
+    def __init__(self, payload, fTimeout=None, bAwaitResponse=False):
+        self.payload = payload
+        self.fTimeout = fTimeout
+        self.bAwaitResponse = bAwaitResponse
+        self.oFuture = None # Created by GetFuture()
+        self.tOutcome = None # (result, exception) once ended
+        self.oThread = None
+        self.oTimer = None
+        self.tStart = None # Thread counters at the start
+
+    def GetFuture(self):
+        '''
+        The future of the transfer, a concurrent.futures.Future, created
+        when first asked for, before the transfer is posted or in the
+        thread. A transfer invoked by a plain event never needs one.
+        '''
+        if self.oFuture is None:
+            import concurrent.futures # Slow to import, so only when needed
+            self.oFuture = concurrent.futures.Future()
+            if self.oThread is not None:
+                self.oFuture.set_running_or_notify_cancel()
+            if self.tOutcome is not None:
+                self.Resolve()
+        return self.oFuture
+
+    def Resolve(self):
+        result, oException = self.tOutcome
+        if oException is not None:
+            self.oFuture.set_exception(oException)
+        else:
+            self.oFuture.set_result(result)
+
+    def GetCounters(self, oThread):
+        return (oThread.fnClock(), oThread.iTxCnt, oThread.iRxCnt, oThread.iDropCnt, oThread.iTimeoutCnt,
+                oThread.iSAScnt)
+
+    def Start(self, oThread):
+        '''Returns False if the future was cancelled before the transfer was invoked.'''
+        if (self.oFuture is not None) and not self.oFuture.set_running_or_notify_cancel():
+            return False
+        self.oThread = oThread
+        self.tStart = self.GetCounters(oThread)
+        self.iRxStreams = oThread.iRxStreams
+        if self.fTimeout is not None:
+            self.oTimer = oThread.fnTimer(self.fTimeout, self.HandleTimeout)
+            self.oTimer.start()
+        return True
+
+    def HandleTimeout(self):
+        # Timer context, handled in the thread context
+        self.oThread.SendEvent(GBT.cEvt(GBT.EVT_TRANSFER_TIMEOUT_MSG, self))
+
+    def GetResult(self, payload=None):
+        tEnd = self.GetCounters(self.oThread)
+        return cTransferResult(payload, self.tStart[0], tEnd[0],
+                               *(iEnd - iStart for iStart, iEnd in zip(self.tStart[1:], tEnd[1:])))
+
+    def IsEnded(self):
+        oThread = self.oThread
+        if oThread.bGBTProcessing:
+            return False
+        if oThread.sAbortReason is not None:
+            return True
+        return (not self.bAwaitResponse) or (oThread.iRxStreams > self.iRxStreams)
+
+    def End(self):
+        '''Resolves the future once the transfer has ended.'''
+        self.CancelTimer()
+        oThread = self.oThread
+        if oThread.sAbortReason is not None:
+            oException = self.Aborted(oThread.sAbortReason)
+            oException.sSnapshot = oThread.sAbortSnapshot
+            self.tOutcome = (None, oException)
+        else:
+            self.tOutcome = (self.GetResult(oThread.rxData if self.bAwaitResponse else None), None)
+        if self.oFuture is not None:
+            self.Resolve()
+
+    def Aborted(self, sReason):
+        '''Exception of the transfer aborted for sReason, with the statistics up to now.'''
+        return cTransferAborted(sReason, None, self.GetResult())
+
+    def Fail(self, oException):
+        self.CancelTimer()
+        self.tOutcome = (None, oException)
+        if self.oFuture is not None:
+            self.Resolve()
+
+    def CancelTimer(self):
+        if self.oTimer is not None:
+            self.oTimer.cancel()
+            self.oTimer = None
+
+###############################################################################
+# Function : GetLossConfig
+#
+# Configuration with its own loss for each association
+###############################################################################
+
+def GetLossConfig(oConfig, fLoss, iSeed):
+    import GBTLoss
+    if fLoss <= 0.0:
+        return oConfig
+    return oConfig._replace(oCltLoss=GBTLoss.CreateLoss(fLoss, 1.0, 2 * iSeed),
+                            oSvrLoss=GBTLoss.CreateLoss(fLoss, 1.0, 2 * iSeed + 1))
+
+###############################################################################
+# Function : RunSimulated
+#
+# Keep transfers in flight in simulated time
+###############################################################################
+
+def RunSimulated(oConfig, payload, iTransfers, iInFlight, oLink, fTimeout, fLoss=0.0):
+    '''
+    Runs iTransfers ACCESS.request transfers, iInFlight at a time, each
+    over its own association, starting the next from the done callback of
+    the last. Returns the futures and the simulated time taken.
+    '''
+    import GBTClientThread
+    import GBTServerThread
+    import GBTSimEngine
+    oEngine = GBTSimEngine.cSimEngine()
+    oLogger = GBTSimEngine.cSimLogger(oEngine)
+    aFutures = []
+    def Next():
+        if len(aFutures) == iTransfers:
+            return
+        oThisConfig = GetLossConfig(oConfig, fLoss, len(aFutures))
+        oClient = GBTClientThread.cGBTClientThread(oThisConfig)
+        oServer = GBTServerThread.cGBTServerThread(oThisConfig)
+        oEngine.AddEndpoint(oClient, oLogger)
+        oEngine.AddEndpoint(oServer, oLogger)
+        oEngine.Connect(oClient, oServer, oLink)
+        oFuture = oClient.PostAccessRequest(payload, fTimeout)
+        oFuture.add_done_callback(lambda oFuture: Done(oClient, oServer))
+        aFutures.append(oFuture)
+    def Done(oClient, oServer):
+        oEngine.RemoveEndpoint(oClient)
+        oEngine.RemoveEndpoint(oServer)
+        oEngine.Schedule(0.0, Next)
+    for i in range(iInFlight):
+        oEngine.Schedule(0.0, Next)
+    oEngine.Run(lambda: (len(aFutures) == iTransfers) and all(oFuture.done() for oFuture in aFutures))
+    return aFutures, oEngine.fNow
+
+###############################################################################
+# Function : RunThreaded
+#
+# Keep transfers in flight in real time from asyncio
+###############################################################################
+
+async def RunThreaded(oConfig, payload, iTransfers, iInFlight, fTimeout, fLoss=0.0):
+    '''
+    As RunSimulated(), with the transfers of each of iInFlight client and
+    server threads running in real time one after another, each awaited
+    from an asyncio task.
+    '''
+    import asyncio
+    import time
+    import GBTClientThread
+    import GBTServerThread
+    import Logger
+    oLogger = Logger.cLoggerThread(None, False)
+    oLogger.Start()
+    aFutures = []
+    aThreads = []
+    async def Driver(oClient):
+        while len(aFutures) < iTransfers:
+            oFuture = asyncio.ensure_future(oClient.AccessRequest(payload, fTimeout))
+            aFutures.append(oFuture)
+            try:
+                await oFuture
+            except Exception:
+                pass
+    for i in range(iInFlight):
+        oThisConfig = GetLossConfig(oConfig, fLoss, i)
+        oClient = GBTClientThread.cGBTClientThread(oThisConfig)
+        oServer = GBTServerThread.cGBTServerThread(oThisConfig)
+        oClient.SetPeerThread(oServer)
+        oServer.SetPeerThread(oClient)
+        for oThread in (oClient, oServer):
+            oThread.oLoggerThread = oLogger
+            oThread.Start()
+            aThreads.append(oThread)
+    t = time.perf_counter()
+    await asyncio.gather(*(Driver(oThread) for oThread in aThreads if oThread.bIsClient))
+    t = time.perf_counter() - t
+    for oThread in aThreads:
+        oThread.Stop()
+        oThread.StopTimer()
+    oLogger.Stop()
+    return aFutures, t
+
+###############################################################################
+# Function : GBTTransferMain
+#
+# Main function
+###############################################################################
+
+def GBTTransferMain(aArgs=None):
+    import argparse
+    import asyncio
+    import GBTHeadEnd
+    import GBTSimEngine
+    oParser = argparse.ArgumentParser(description="Keep GBT transfers in flight, awaiting each by its future.")
+    oParser.add_argument("--mode", choices=("sim", "threads"), default="sim",
+                         help="simulated time, or real threads driven from asyncio")
+    oParser.add_argument("-n", "--transfers", type=int, default=100)
+    oParser.add_argument("--in-flight", type=int, default=8, help="transfers in flight")
+    oParser.add_argument("--payload", type=int, default=2000, help="payload size in bytes")
+    oParser.add_argument("-b", "--block-size", type=int, default=64, help="GBT_MAX_PAYLOAD")
+    oParser.add_argument("--loss", type=float, default=0.02, help="loss probability of each GBT APDU")
+    oParser.add_argument("--timeout", type=float, default=60.0, help="transfer timeout in seconds")
+    oParser.add_argument("--latency", type=float, default=0.05, help="one way latency in seconds (sim)")
+    oParser.add_argument("--bit-rate", type=float, default=9600.0, help="bit rate, 0 = infinite (sim)")
+    oArgs = oParser.parse_args(aArgs)
+
+    oConfig = GBT.GetDefaultConfig()._replace(MaxPayload=oArgs.block_size, aCltDropMsgs=(), aSvrDropMsgs=())
+    payload = 'x' * oArgs.payload
+    if oArgs.mode == "sim":
+        oLink = GBTSimEngine.cLinkModel(oArgs.latency, oArgs.bit_rate)
+        aFutures, fTime = RunSimulated(oConfig, payload, oArgs.transfers, oArgs.in_flight, oLink, oArgs.timeout,
+                                       oArgs.loss)
+    else:
+        oConfig = oConfig._replace(tTimeouts=(0.2, 0.4))
+        aFutures, fTime = asyncio.run(RunThreaded(oConfig, payload, oArgs.transfers, oArgs.in_flight, oArgs.timeout,
+                                                  oArgs.loss))
+    aResults = [oFuture.result() for oFuture in aFutures if oFuture.exception() is None]
+    dFailed = {}
+    for oFuture in aFutures:
+        oException = oFuture.exception()
+        if oException is not None:
+            sReason = oException.sReason if isinstance(oException, cTransferAborted) else "timeout"
+            dFailed[sReason] = dFailed.get(sReason, 0) + 1
+    print("%d transfers of %d bytes, %d in flight, %s: %d completed, %d failed in %.2f s" %
+          (len(aFutures), oArgs.payload, oArgs.in_flight, oArgs.mode, len(aResults), len(aFutures) - len(aResults), fTime))
+    if aResults:
+        aDurations = sorted(oResult.fDuration for oResult in aResults)
+        print("Duration (s): mean %.3f, p50 %.3f, p95 %.3f, max %.3f" %
+              (sum(aDurations) / len(aDurations), GBTHeadEnd.Percentile(aDurations, 50),
+               GBTHeadEnd.Percentile(aDurations, 95), aDurations[-1]))
+        print("Per transfer: %.1f APDUs sent, %.1f received, %.2f timeouts, %.1f rounds" %
+              tuple(sum(getattr(oResult, sKey) for oResult in aResults) / len(aResults)
+                    for sKey in ('iTxApdus', 'iRxApdus', 'iTimeouts', 'iRounds')))
+    for sReason, iCount in sorted(dFailed.items()):
+        print("Failed: %d %s" % (iCount, sReason))
+
+if __name__ == '__main__':
+    GBTTransferMain()
@@ -0,0 +1,171 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        GBT session watchdog
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+###############################################################################
+# Class : cGBTWatchdog
+#
+# Tracks the progress of a GBT session
+###############################################################################
+
+class cGBTWatchdog():
+    '''
+    GBT session watchdog. Tracks the progress of one GBT session and
+    reports when it appears to be stuck. Four things are tracked:
+    - Round trips (end of a peer window) without any progress through the
+      payload, i.e. no more blocks with payload acknowledged or received.
+      BNs are no measure, as blocks without payload get new ones.
+    - The same window (block numbers and W) being sent repeatedly
+    - Timer expiries in a row without any GBT APDU received
+    - Blocks received with a BN more than iRunawayBlocks past the end of
+      the peer's stream, e.g. when each side takes the other's resent
+      blocks or acknowledgements as a new stream
+    When a limit is reached, sReason is set to say why the session should
+    be aborted. A limit of 0 disables the check.
+    '''
+
+    # Constructor
+    def __init__(self, iStallRounds, iRepeatWindows, iTimeouts, iRunawayBlocks):
+        self.iStallRounds = iStallRounds
+        self.iRepeatWindows = iRepeatWindows
+        self.iTimeouts = iTimeouts
+        self.iRunawayBlocks = iRunawayBlocks
+        self.Reset()
+
+    def Reset(self):
+        self.tProgress = None
+        self.iStalls = 0
+        self.tWindow = None
+        self.iRepeats = 0
+        self.iTimeoutStreak = 0
+        self.sReason = None
+
+    def Stuck(self, sReason):
+        # Keep the first reason found
+        if self.sReason is None:
+            self.sReason = sReason
+
+    def RoundTrip(self, tProgress):
+        '''
+        Called at the end of each peer window. tProgress is a tuple of values
+        which only ever increase while the session makes progress.
+        '''
+        if tProgress == self.tProgress:
+            self.iStalls += 1
+            if self.iStallRounds and self.iStalls >= self.iStallRounds:
+                self.Stuck("no progress for %d round trips" % self.iStalls)
+        else:
+            self.iStalls = 0
+            self.tProgress = tProgress
+
+    def WindowSent(self, tWindow):
+        '''
+        Called when a window has been sent. tWindow identifies the window.
+        '''
+        if tWindow == self.tWindow:
+            self.iRepeats += 1
+            if self.iRepeatWindows and self.iRepeats >= self.iRepeatWindows:
+                self.Stuck("same window sent %d times in a row" % (self.iRepeats + 1))
+        else:
+            self.iRepeats = 0
+            self.tWindow = tWindow
+
+    def Timeout(self):
+        '''Called on each timer expiry.'''
+        self.iTimeoutStreak += 1
+        if self.iTimeouts and self.iTimeoutStreak >= self.iTimeouts:
+            self.Stuck("%d timeouts in a row" % self.iTimeoutStreak)
+
+    def ApduReceived(self):
+        '''Called on each GBT APDU received.'''
+        self.iTimeoutStreak = 0
+
+    def BlockReceived(self, bn, bnEnd):
+        '''
+        Called on each block received. bnEnd is the highest BN the peer
+        should send in its stream, None if not known.
+        '''
+        if self.iRunawayBlocks and (bnEnd is not None) and (bn > bnEnd + self.iRunawayBlocks):
+            self.Stuck("BN %d runaway past %d" % (bn, bnEnd))
+
+###############################################################################
+# Function : FormatBNs
+#
+# Format a list of block numbers compactly, e.g. 1-5,7,9-12
+###############################################################################
+
+def FormatBNs(aBNs):
+    aRanges = []
+    for bn in sorted(aBNs):
+        if aRanges and bn == aRanges[-1][1] + 1:
+            aRanges[-1][1] = bn
+        else:
+            aRanges.append([bn, bn])
+    return ','.join(("%d" % a) if a == b else ("%d-%d" % (a, b)) for a, b in aRanges)
+
+###############################################################################
+# Function : GBTWatchdogMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTWatchdogMain():
+    oWatchdog = cGBTWatchdog(3, 3, 3, 40)
+    for i in range(4):
+        oWatchdog.RoundTrip((1, 0))
+        print(oWatchdog.sReason)
+    # The peer's acknowledgements get new BNs while no payload moves on
+    oWatchdog = cGBTWatchdog(3, 0, 0, 40)
+    for bn in range(1, 60):
+        oWatchdog.BlockReceived(bn, 2 * 20)
+        oWatchdog.RoundTrip((18, 0))
+        if oWatchdog.sReason is not None:
+            break
+    print(oWatchdog.sReason)
+    oWatchdog = cGBTWatchdog(0, 0, 0, 40)
+    for bn in range(1, 100):
+        oWatchdog.BlockReceived(bn, 2 * 20)
+        if oWatchdog.sReason is not None:
+            break
+    print(oWatchdog.sReason)
+    print(FormatBNs([1, 2, 3, 4, 5, 7, 9, 10, 11, 12]))
+
+    # A lost final acknowledgement: the server takes the client's resent
+    # blocks as a new stream and each side acknowledges the other forever.
+    # Each check must end it on its own.
+    import GBT
+    import GBTSimEngine
+    dLimits = {'iWdgStallRounds': 10, 'iWdgRepeatWindows': 8, 'iWdgTimeouts': 5, 'iWdgRunawayBlocks': 40}
+    for sField in ('iWdgRepeatWindows', 'iWdgStallRounds', 'iWdgRunawayBlocks'):
+        oConfig = GBT.GetDefaultConfig()._replace(aCltDropMsgs=(3,), aSvrDropMsgs=(),
+                                                  **{s: (0, i)[s == sField] for s, i in dLimits.items()})
+        d = GBTSimEngine.RunTransfer(oConfig, "x" * 200, "request", GBTSimEngine.cLinkModel(0.05, 9600.0),
+                                     fMaxTime=60.0)
+        print("%s after %d GBT APDUs" % (d['sAbortReason'], d['iApdus']))
+
+if __name__ == '__main__':
+    GBTWatchdogMain()
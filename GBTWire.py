@@ -0,0 +1,174 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        GBT APDU encoding
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# The general-block-transfer APDU (DLMS Green Book Ed. 11 V1.0 9.4.6.13):
+#
+#   E0                  tag
+#   block-control       bit 7 LB, bit 6 STR, bits 5-0 W
+#   block-number        BN, 2 bytes
+#   block-number-ack    BNA, 2 bytes
+#   block-data          octet-string: A-XDR length, then the data
+#
+# APDUs follow each other on a stream with no other framing, so that
+# GetApduLength() is all that is needed to split a stream into APDUs.
+
+import struct
+
+GBT_TAG = 0xE0
+
+# Tag, block-control, BN, BNA
+WIRE_HEADER = struct.Struct('>BBHH')
+
+WIRE_LB = 0x80
+WIRE_STR = 0x40
+WIRE_W_MASK = 0x3F
+
+###############################################################################
+# Function : EncodeLength
+#
+# A-XDR length
+###############################################################################
+
+def EncodeLength(iLength):
+    if iLength < 0x80:
+        return bytes((iLength,))
+    bLength = iLength.to_bytes((iLength.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(bLength),)) + bLength
+
+###############################################################################
+# Function : EncodeApdu
+#
+# Encode a GBT APDU
+###############################################################################
+
+def EncodeApdu(apdu):
+    '''
+    Encode a GBT.cGBTAPDU. BD may be str, which is sent as UTF-8. BN and
+    BNA are sent modulo 65536. The NON-STANDARD SR field is not encoded.
+    '''
+    iControl = ((0, WIRE_LB)[apdu.LB == 1]) | ((0, WIRE_STR)[apdu.STR == 1]) | (apdu.W & WIRE_W_MASK)
+    BD = apdu.BD
+    if BD is None:
+        BD = b''
+    elif isinstance(BD, str):
+        BD = BD.encode('utf-8')
+    return WIRE_HEADER.pack(GBT_TAG, iControl, apdu.BN & 0xFFFF, apdu.BNA & 0xFFFF) + EncodeLength(len(BD)) + BD
+
+###############################################################################
+# Function : ParseHeader
+#
+# Header and block data lengths of the GBT APDU at the start of a buffer
+###############################################################################
+
+def ParseHeader(bBuffer, iOffset=0):
+    '''
+    Returns the length of the header, up to and including the A-XDR length
+    of the block data, and the length of the block data. None if the
+    buffer does not hold the whole header. Raises ValueError if it is not
+    a GBT APDU.
+    '''
+    iLengthOffset = iOffset + WIRE_HEADER.size
+    if len(bBuffer) <= iLengthOffset:
+        return None
+    if bBuffer[iOffset] != GBT_TAG:
+        raise ValueError("Not a GBT APDU, tag 0x%02X" % bBuffer[iOffset])
+    iLength = bBuffer[iLengthOffset]
+    if iLength < 0x80:
+        return WIRE_HEADER.size + 1, iLength
+    iBytes = iLength & 0x7F
+    if len(bBuffer) <= iLengthOffset + iBytes:
+        return None
+    return WIRE_HEADER.size + 1 + iBytes, int.from_bytes(bBuffer[iLengthOffset + 1:iLengthOffset + 1 + iBytes], 'big')
+
+###############################################################################
+# Function : GetApduLength
+#
+# Length of the GBT APDU at the start of a buffer
+###############################################################################
+
+def GetApduLength(bBuffer, iOffset=0):
+    '''Returns None if the buffer does not hold enough of the APDU to tell.'''
+    tHeader = ParseHeader(bBuffer, iOffset)
+    if tHeader is None:
+        return None
+    return tHeader[0] + tHeader[1]
+
+###############################################################################
+# Function : DecodeApdu
+#
+# Decode a GBT APDU
+###############################################################################
+
+def DecodeApdu(bApdu, fnApdu):
+    '''
+    Decode a whole GBT APDU. fnApdu(LB, STR, W, BN, BNA, BD) builds the
+    result, e.g. a GBT.cGBTAPDU, so that this module does not depend on GBT.
+    BD is bytes, or None if empty.
+    '''
+    tHeader = ParseHeader(bApdu)
+    if (tHeader is None) or (tHeader[0] + tHeader[1] > len(bApdu)):
+        raise ValueError("GBT APDU truncated")
+    iTag, iControl, BN, BNA = WIRE_HEADER.unpack_from(bApdu)
+    BD = bytes(bApdu[tHeader[0]:tHeader[0] + tHeader[1]]) if tHeader[1] > 0 else None
+    return fnApdu(int(bool(iControl & WIRE_LB)), int(bool(iControl & WIRE_STR)), iControl & WIRE_W_MASK, BN, BNA, BD)
+
+###############################################################################
+# Function : SplitApdus
+#
+# Split a buffer into whole GBT APDUs
+###############################################################################
+
+def SplitApdus(bBuffer):
+    '''Returns a list of the whole APDUs in the buffer and the number of bytes they take up.'''
+    aApdus = []
+    iOffset = 0
+    while True:
+        iLength = GetApduLength(bBuffer, iOffset)
+        if (iLength is None) or (iOffset + iLength > len(bBuffer)):
+            break
+        aApdus.append(bBuffer[iOffset:iOffset + iLength])
+        iOffset += iLength
+    return aApdus, iOffset
+
+###############################################################################
+# Function : GBTWireMain
+#
+# Main function. Used for test if module
+###############################################################################
+
+def GBTWireMain():
+    import GBT
+    apdu = GBT.cGBTAPDU(GBT.cGBTBlock(1, 300, 'x' * 200), 0, 6, 299)
+    bApdu = EncodeApdu(apdu)
+    aApdus, iUsed = SplitApdus(bApdu + bApdu[:5])
+    oDecoded = DecodeApdu(aApdus[0], lambda LB, STR, W, BN, BNA, BD: GBT.cGBTAPDU(GBT.cGBTBlock(LB, BN, BD), STR, W, BNA))
+    print("%d bytes, %d APDU, %d bytes used, LB=%d, STR=%d, W=%d, BN=%d, BNA=%d, %d bytes of BD" %
+          (len(bApdu), len(aApdus), iUsed, oDecoded.LB, oDecoded.STR, oDecoded.W, oDecoded.BN, oDecoded.BNA, len(oDecoded.BD)))
+
+if __name__ == '__main__':
+    GBTWireMain()
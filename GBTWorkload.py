@@ -0,0 +1,359 @@
+###############################################################################
+#
+# MODULE:             GBT Simulator Application
+#
+# AUTHOR:             Robert Cragie
+#
+# DESCRIPTION:        Synthetic DLMS workload generator
+#
+###############################################################################
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright 2024 Gridmerge Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+###############################################################################
+
+# Payloads are GET.response-normal APDUs carrying the buffer of a profile
+# generic object, A-XDR encoded:
+#
+#   C4 01 C1 00                 GET.response-normal, invoke-id, data
+#   01 <length>                 array of entries
+#   02 <n> ...                  each entry a structure:
+#     09 0C <12 bytes>            clock, octet-string date-time
+#     load profile:  11 <status> then 06 <4 bytes> per channel (registers)
+#     event log:     12 <2 bytes> (event code)
+#
+# The number of entries in each payload is drawn from a distribution, so
+# the payload sizes follow it. All the entries of a workload are generated
+# at once with numpy, which is needed for this module only.
+
+import argparse
+import hashlib
+import os
+import time
+import zipfile
+from typing import NamedTuple
+import numpy as np
+
+# Bump when the generated content changes, so that cached workloads are not reused
+WL_VERSION = 1
+
+WL_LOAD_PROFILE = "load_profile"
+WL_EVENT_LOG = "event_log"
+
+# Start of the clock of the first entry (UTC)
+WL_EPOCH = np.datetime64('2024-01-01T00:00:00', 's')
+
+# GET.response-normal, invoke-id and priority, data
+WL_APDU_HEADER = bytes((0xC4, 0x01, 0xC1, 0x00))
+
+# Event codes of the standard event log (DLMS UA 1000-1) and their weights
+WL_EVENT_CODES = np.array((1, 2, 3, 4, 5, 6, 40, 47, 48, 69, 70), dtype=np.uint16)
+WL_EVENT_WEIGHTS = np.array((20, 20, 2, 8, 8, 10, 5, 3, 3, 10, 11), dtype=float)
+
+###############################################################################
+# Class : cWorkload
+#
+# Description of a set of payloads
+###############################################################################
+
+class cWorkload(NamedTuple):
+    sDescription: str
+    sContent: str = WL_LOAD_PROFILE
+    iPayloads: int = 100
+    sEntries: str = "fixed:48" # Distribution of entries per payload, see DrawCounts()
+    iChannels: int = 1 # Registers per load profile entry
+    iInterval: int = 1800 # Seconds between entries. Mean for event logs.
+
+# Named workloads
+WL_WORKLOADS = {
+    "daily-load-profile-10k": cWorkload("Daily half hourly load profile, import and export, 10k meters",
+                                        WL_LOAD_PROFILE, 10000, "fixed:48", 2, 1800),
+    "daily-load-profile-1k-4ch": cWorkload("Daily quarter hourly load profile, 4 channels, 1k meters",
+                                           WL_LOAD_PROFILE, 1000, "fixed:96", 4, 900),
+    "catch-up-load-profile-1k": cWorkload("Half hourly load profile backlog after outages, 1k meters",
+                                          WL_LOAD_PROFILE, 1000, "lognormal:240,0.8", 2, 1800),
+    "yearly-billing-1k": cWorkload("Monthly billing values for a year, 8 registers, 1k meters",
+                                   WL_LOAD_PROFILE, 1000, "fixed:12", 8, 30 * 86400),
+    "event-log-10k": cWorkload("Standard event log, 10k meters",
+                               WL_EVENT_LOG, 10000, "lognormal:5,1.0", 1, 6 * 3600),
+}
+
+###############################################################################
+# Function : DrawCounts
+#
+# Draw counts from a distribution
+###############################################################################
+
+def DrawCounts(sSpec, iCount, oRng):
+    '''
+    Draw iCount counts, each at least 1, from a distribution given as
+    "kind:parameters": fixed:N, uniform:LOW,HIGH (inclusive),
+    lognormal:MEDIAN,SIGMA, poisson:MEAN or geometric:MEAN.
+    '''
+    sKind, _, sParams = sSpec.partition(':')
+    aParams = [float(s) for s in sParams.split(',') if s.strip() != '']
+    if sKind == "fixed" and len(aParams) == 1:
+        aCounts = np.full(iCount, aParams[0])
+    elif sKind == "uniform" and len(aParams) == 2:
+        aCounts = oRng.integers(int(aParams[0]), int(aParams[1]), iCount, endpoint=True)
+    elif sKind == "lognormal" and len(aParams) == 2:
+        aCounts = np.rint(oRng.lognormal(np.log(aParams[0]), aParams[1], iCount))
+    elif sKind == "poisson" and len(aParams) == 1:
+        aCounts = oRng.poisson(aParams[0], iCount)
+    elif sKind == "geometric" and len(aParams) == 1:
+        aCounts = oRng.geometric(1.0 / max(aParams[0], 1.0), iCount)
+    else:
+        raise ValueError("Bad distribution '%s'" % sSpec)
+    return np.maximum(aCounts, 1).astype(np.int64)
+
+###############################################################################
+# Function : EncodeLength
+#
+# A-XDR length
+###############################################################################
+
+def EncodeLength(iLength):
+    if iLength < 0x80:
+        return bytes((iLength,))
+    bLength = iLength.to_bytes((iLength.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(bLength),)) + bLength
+
+###############################################################################
+# Function : SegmentCumsum
+#
+# Cumulative sum restarting at the start of each segment
+###############################################################################
+
+def SegmentCumsum(aValues, aStarts):
+    '''aStarts are the indices of the first row of each segment, the first being 0.'''
+    aCumsum = np.cumsum(aValues, axis=0)
+    aLengths = np.diff(np.append(aStarts, len(aValues)))
+    aBefore = np.concatenate((np.zeros((1,) + aValues.shape[1:], aCumsum.dtype), aCumsum[aStarts[1:] - 1]))
+    return aCumsum - np.repeat(aBefore, aLengths, axis=0)
+
+###############################################################################
+# Function : EncodeClocks
+#
+# A-XDR date-time octet-strings for an array of times
+###############################################################################
+
+def EncodeClocks(aSeconds):
+    '''aSeconds are seconds since WL_EPOCH. Returns an array of 14 bytes per time, tag and length included.'''
+    aTimes = WL_EPOCH + aSeconds.astype('timedelta64[s]')
+    aDays = aTimes.astype('datetime64[D]')
+    aMonths = aTimes.astype('datetime64[M]')
+    aYears = aTimes.astype('datetime64[Y]').astype(np.int64) + 1970
+    aSecOfDay = (aTimes - aDays).astype(np.int64)
+    aClocks = np.zeros((len(aSeconds), 14), dtype=np.uint8)
+    aClocks[:, 0] = 0x09
+    aClocks[:, 1] = 0x0C
+    aClocks[:, 2] = aYears >> 8
+    aClocks[:, 3] = aYears & 0xFF
+    aClocks[:, 4] = aMonths.astype(np.int64) % 12 + 1
+    aClocks[:, 5] = (aDays - aMonths).astype(np.int64) + 1
+    aClocks[:, 6] = (aDays.astype(np.int64) + 3) % 7 + 1 # Monday = 1
+    aClocks[:, 7] = aSecOfDay // 3600
+    aClocks[:, 8] = aSecOfDay // 60 % 60
+    aClocks[:, 9] = aSecOfDay % 60
+    aClocks[:, 10] = 0x00 # Hundredths
+    aClocks[:, 11] = 0x00 # Deviation (UTC)
+    aClocks[:, 12] = 0x00
+    aClocks[:, 13] = 0x00 # Clock status
+    return aClocks
+
+###############################################################################
+# Function : GenerateEntries
+#
+# Generate the encoded entries of all the payloads of a workload at once
+###############################################################################
+
+def GenerateEntries(oWorkload, aCounts, oRng):
+    '''Returns an array with one row of bytes per entry.'''
+    iEntries = int(aCounts.sum())
+    aStarts = np.concatenate(([0], np.cumsum(aCounts)[:-1]))
+    # Each payload starts at WL_EPOCH. Profile entries are captured on the
+    # interval, events at random with iInterval between them on average.
+    if oWorkload.sContent == WL_LOAD_PROFILE:
+        aGaps = np.full(iEntries, oWorkload.iInterval, dtype=np.int64)
+        aGaps[aStarts] = 0
+    elif oWorkload.sContent == WL_EVENT_LOG:
+        aGaps = np.rint(oRng.exponential(oWorkload.iInterval, iEntries)).astype(np.int64)
+    else:
+        raise ValueError("Unknown content '%s'" % oWorkload.sContent)
+    aClocks = EncodeClocks(SegmentCumsum(aGaps, aStarts))
+
+    if oWorkload.sContent == WL_LOAD_PROFILE:
+        iChannels = oWorkload.iChannels
+        aEntries = np.empty((iEntries, 2 + 14 + 2 + 5 * iChannels), dtype=np.uint8)
+        aEntries[:, 0] = 0x02 # Structure
+        aEntries[:, 1] = 2 + iChannels
+        aEntries[:, 2:16] = aClocks
+        aEntries[:, 16] = 0x11 # Unsigned status, occasionally flagged (e.g. power down)
+        aEntries[:, 17] = np.where(oRng.random(iEntries) < 0.02, 0x84, 0x00)
+        # Registers: a random reading at the start, then consumption in Wh per interval
+        aUsage = oRng.gamma(2.0, 150.0 * oWorkload.iInterval / 1800.0, (iEntries, iChannels))
+        aUsage[aStarts] = oRng.uniform(0.0, 5.0e7, (len(aCounts), iChannels))
+        aRegisters = (SegmentCumsum(aUsage, aStarts).astype(np.int64) & 0xFFFFFFFF).astype('>u4')
+        aFields = aEntries[:, 18:].reshape(iEntries, iChannels, 5)
+        aFields[:, :, 0] = 0x06 # Double long unsigned
+        aFields[:, :, 1:] = aRegisters.view(np.uint8).reshape(iEntries, iChannels, 4)
+    else:
+        aEntries = np.empty((iEntries, 2 + 14 + 3), dtype=np.uint8)
+        aEntries[:, 0] = 0x02 # Structure
+        aEntries[:, 1] = 2
+        aEntries[:, 2:16] = aClocks
+        aEntries[:, 16] = 0x12 # Long unsigned event code
+        aCodes = oRng.choice(WL_EVENT_CODES, iEntries, p=WL_EVENT_WEIGHTS / WL_EVENT_WEIGHTS.sum()).astype('>u2')
+        aEntries[:, 17:19] = aCodes.view(np.uint8).reshape(iEntries, 2)
+    return aEntries
+
+###############################################################################
+# Function : Generate
+#
+# Generate the payloads of a workload
+###############################################################################
+
+def Generate(oWorkload, iSeed=0):
+    '''Returns a list of payloads (bytes). The same workload and seed always give the same payloads.'''
+    oRng = np.random.default_rng(iSeed)
+    aCounts = DrawCounts(oWorkload.sEntries, oWorkload.iPayloads, oRng)
+    bEntries = GenerateEntries(oWorkload, aCounts, oRng).tobytes()
+    iEntrySize = len(bEntries) // int(aCounts.sum())
+    aPayloads = []
+    iOffset = 0
+    for iCount in aCounts.tolist():
+        iEnd = iOffset + iCount * iEntrySize
+        aPayloads.append(WL_APDU_HEADER + b'\x01' + EncodeLength(iCount) + bEntries[iOffset:iEnd])
+        iOffset = iEnd
+    return aPayloads
+
+###############################################################################
+# Function : GetCachePath
+#
+# Cache file of a workload
+###############################################################################
+
+def GetCachePath(sCacheDir, oWorkload, iSeed):
+    sKey = hashlib.sha256(repr((WL_VERSION, tuple(oWorkload), iSeed)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(sCacheDir, "workload-%s.npz" % sKey)
+
+###############################################################################
+# Function : GetPayloads
+#
+# Get the payloads of a workload, from the cache if possible
+###############################################################################
+
+def GetPayloads(oWorkload, iSeed=0, sCacheDir=None):
+    '''
+    Returns a list of payloads (bytes). If sCacheDir is given, the
+    payloads are loaded from it if they have been generated before,
+    otherwise generated and saved there.
+    '''
+    if isinstance(oWorkload, str):
+        oWorkload = WL_WORKLOADS[oWorkload]
+    if sCacheDir is None:
+        return Generate(oWorkload, iSeed)
+    sPath = GetCachePath(sCacheDir, oWorkload, iSeed)
+    if os.path.exists(sPath):
+        with np.load(sPath) as oFile:
+            bData = oFile['data'].tobytes()
+            aOffsets = oFile['offsets'].tolist()
+        return [bData[iStart:iEnd] for iStart, iEnd in zip(aOffsets[:-1], aOffsets[1:])]
+    aPayloads = Generate(oWorkload, iSeed)
+    os.makedirs(sCacheDir, exist_ok=True)
+    aOffsets = np.concatenate(([0], np.cumsum([len(p) for p in aPayloads])))
+    sTmpPath = sPath + '.tmp.npz'
+    np.savez(sTmpPath, data=np.frombuffer(b''.join(aPayloads), dtype=np.uint8), offsets=aOffsets)
+    os.replace(sTmpPath, sPath)
+    return aPayloads
+
+###############################################################################
+# Function : GetPayload
+#
+# Get one payload of a workload, from the cache if possible
+###############################################################################
+
+def GetPayload(oWorkload, iIndex, iSeed=0, sCacheDir=None):
+    '''
+    Returns payload iIndex of a workload. The payloads of a workload are
+    drawn together, so one cannot be generated alone, but if the workload
+    is in sCacheDir only that payload is read from it.
+    '''
+    if isinstance(oWorkload, str):
+        oWorkload = WL_WORKLOADS[oWorkload]
+    if not (0 <= iIndex < oWorkload.iPayloads):
+        raise IndexError("Payload %d not in workload of %d payloads" % (iIndex, oWorkload.iPayloads))
+    if sCacheDir is None:
+        return Generate(oWorkload, iSeed)[iIndex]
+    sPath = GetCachePath(sCacheDir, oWorkload, iSeed)
+    if not os.path.exists(sPath):
+        return GetPayloads(oWorkload, iSeed, sCacheDir)[iIndex]
+    with zipfile.ZipFile(sPath) as oZip:
+        with oZip.open('offsets.npy') as oFile:
+            iStart, iEnd = np.lib.format.read_array(oFile)[iIndex:iIndex + 2].tolist()
+        # np.savez() stores the arrays uncompressed, so the file can seek to the payload
+        with oZip.open('data.npy') as oFile:
+            np.lib.format.read_magic(oFile)
+            np.lib.format.read_array_header_1_0(oFile)
+            oFile.seek(iStart, os.SEEK_CUR)
+            return oFile.read(iEnd - iStart)
+
+###############################################################################
+# Function : ParseWorkload
+#
+# Parse a workload given by name or by fields
+###############################################################################
+
+def ParseWorkload(sWorkload):
+    '''
+    A workload name, or "content/payloads/entries[/channels[/interval]]",
+    e.g. "load_profile/500/uniform:24,96/2/900".
+    '''
+    if sWorkload in WL_WORKLOADS:
+        return WL_WORKLOADS[sWorkload]
+    aFields = sWorkload.split('/')
+    if len(aFields) < 3:
+        raise ValueError("Unknown workload '%s'" % sWorkload)
+    return cWorkload("Custom", aFields[0], int(aFields[1]), aFields[2], *[int(s) for s in aFields[3:]])
+
+###############################################################################
+# Function : GBTWorkloadMain
+#
+# Main function
+###############################################################################
+
+def GBTWorkloadMain(aArgs=None):
+    oParser = argparse.ArgumentParser(description="Generate synthetic DLMS workloads and print their sizes.")
+    oParser.add_argument("workload", nargs='*', default=list(WL_WORKLOADS),
+                         help="workload names or content/payloads/entries[/channels[/interval]] (default all named)")
+    oParser.add_argument("-s", "--seed", type=int, default=0, help="seed")
+    oParser.add_argument("--cache-dir", default=None, help="directory in which to cache generated workloads")
+    oArgs = oParser.parse_args(aArgs)
+
+    print("%-28s %8s %8s %8s %8s %8s %10s %9s" % ("Workload", "payloads", "min", "p50", "p95", "max", "total", "time (s)"))
+    for sWorkload in oArgs.workload:
+        oWorkload = ParseWorkload(sWorkload)
+        t = time.perf_counter()
+        aPayloads = GetPayloads(oWorkload, oArgs.seed, oArgs.cache_dir)
+        t = time.perf_counter() - t
+        aSizes = np.sort([len(p) for p in aPayloads])
+        print("%-28s %8d %8d %8d %8d %8d %10d %9.3f" %
+              (sWorkload[:28], len(aSizes), aSizes[0], aSizes[len(aSizes) // 2], aSizes[int(0.95 * (len(aSizes) - 1))],
+               aSizes[-1], aSizes.sum(), t))
+
+if __name__ == '__main__':
+    GBTWorkloadMain()
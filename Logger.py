@@ -35,6 +35,10 @@ LOG_CONSOLE_PRINT = 1
 LOG_LOGGER_PRINT = 2
 LOG_BOTH_PRINT = 3
 
+# Most log events queued. When full, console only messages are merged into a
+# count of skipped messages and other messages wait for space.
+LOG_QUEUE_SIZE = 10000
+
 ###############################################################################
 # Class : cLogEvt
 #
@@ -46,6 +50,27 @@ class cLogEvt():
         self.evtType = evtType
         self.mask = mask
         self.sLog = sLog
+        self.iSkipped = 0 # Console only messages skipped after this one
+
+###############################################################################
+# Function : CoalesceLogEvts
+#
+# Merge a log event into the newest queued one when the queue is full
+###############################################################################
+
+def CoalesceLogEvts(oLast, oNew):
+    '''
+    Console only messages are counted as skipped against the newest queued
+    event. Messages for the MSC file are never merged, so the file is
+    complete. Nor is anything merged into the stop sentinel, which is not a
+    log event.
+    '''
+    if not (isinstance(oLast, cLogEvt) and isinstance(oNew, cLogEvt)):
+        return None
+    if oNew.mask != LOG_CONSOLE_PRINT:
+        return None
+    oLast.iSkipped += 1 + oNew.iSkipped
+    return oLast
 
 ###############################################################################
 # Class : cLogger
@@ -74,9 +99,9 @@ class cLogger:
 
     def PrintData(self, sData):
         if self.bLog:
-            PrintData.PrintData(sData, 0, 16)
+            PrintData.PrintDataBulk(sData, 0, 16, bReturn=False)
             if self.oFile is not None:
-                PrintData.PrintData(sData, 0, 16, 0, 2, self.oFile)
+                PrintData.PrintDataBulk(sData, 0, 16, 0, 2, self.oFile, False)
 
     def OpenFile(self):
         self.oFile = open(self.sFilename, "w")
@@ -100,12 +125,17 @@ class cLoggerThread(EvQThread.cEvQThread):
     '''
 
     # Constructor
-    def __init__(self):
-        EvQThread.cEvQThread.__init__(self)
+    def __init__(self, sFilename="msc.txt", bConsole=True, iMaxQueue=LOG_QUEUE_SIZE):
+        # Bounded queue so that a slow console cannot make memory grow without limit
+        EvQThread.cEvQThread.__init__(self, iMaxQueue, EvQThread.QUEUE_COALESCE, CoalesceLogEvts)
         self.oThread.name = "Logger Thread"
         self.bUseEvent = True # Set this to True to send event to thread, False to print directly
-        self.oLogger = cLogger("msc.txt", True)
-        self.oLogger.OpenFile()
+        self.bConsole = bConsole # Set this to False to suppress console printing, e.g. for batch runs
+        self.iConsoleSkipped = 0 # Console messages skipped since the last one printed
+        # No MSC file is written if sFilename is None
+        self.oLogger = cLogger(sFilename, sFilename is not None)
+        if sFilename is not None:
+            self.oLogger.OpenFile()
         self.oLogger.Print("@startuml")
         self.oLogger.Print("skin rose")
         self.oLogger.Print("title GBT example")
@@ -116,7 +146,7 @@ class cLoggerThread(EvQThread.cEvQThread):
         if self.bUseEvent:
             self.SendEvent(cLogEvt(EVT_LOGGER_MSG, mask, sLog))
         else:
-            if mask & LOG_CONSOLE_PRINT:
+            if (mask & LOG_CONSOLE_PRINT) and self.bConsole:
                 print(sLog)
             if mask & LOG_LOGGER_PRINT:
                 self.oLogger.Print(sLog)        
@@ -125,16 +155,38 @@ class cLoggerThread(EvQThread.cEvQThread):
         self.oLogger.Print("@enduml")
         self.oLogger.CloseFile()
         EvQThread.cEvQThread.Stop(self)
+        self.PrintSkipped()
+
+    def IsBehind(self):
+        '''
+        True if the queue is more than half full. Console printing is
+        skipped until the logger has caught up.
+        '''
+        return self.oQueue.iMaxSize > 0 and self.oQueue.qsize() > self.oQueue.iMaxSize // 2
+
+    def PrintSkipped(self):
+        if self.iConsoleSkipped > 0:
+            print("[Logger behind, %d console messages skipped]" % self.iConsoleSkipped)
+            self.iConsoleSkipped = 0
+
+    def PrintConsole(self, sLog):
+        if self.IsBehind():
+            self.iConsoleSkipped += 1
+        else:
+            self.PrintSkipped()
+            print(sLog)
         
     def HandleEvent(self, event: cLogEvt):
         '''
         Pure virtual method to handle the event obtained from the queue.
         '''
         if event.evtType == EVT_LOGGER_MSG:
-            if event.mask & LOG_CONSOLE_PRINT:
-                print(event.sLog)
+            if (event.mask & LOG_CONSOLE_PRINT) and self.bConsole:
+                self.PrintConsole(event.sLog)
             if event.mask & LOG_LOGGER_PRINT:
                 self.oLogger.Print(event.sLog)
+            if self.bConsole:
+                self.iConsoleSkipped += event.iSkipped
                 
 
 ###############################################################################